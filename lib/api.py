@@ -0,0 +1,273 @@
+"""
+Local HTTP/JSON API - a long-running service in front of CarRentalORM for
+kiosks and branch terminals, with pooled connections and ETag caching.
+"""
+
+import gzip
+import hashlib
+import json
+import queue
+import re
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from database import db
+from models.orm import CarRentalORM
+from models.coverage import coverage_index
+from models.pricing import demand_pricing
+from cache import INVALIDATES
+from telemetry import TelemetryIngestor
+from metrics import metrics
+from sync import CentralSync
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str)
+
+def _plain(value):
+    """sqlite3.Row / dict-row results as JSON-friendly values"""
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if value is not None and hasattr(value, 'keys'):
+        return {key: value[key] for key in value.keys()}
+    return value
+
+# Read endpoints: path pattern -> (finder taking the URL groups, tables the answer depends on)
+READ_ROUTES = [
+    (r'/vehicles', lambda: CarRentalORM.get_all('vehicles'), ('vehicles',)),
+    (r'/vehicles/available', CarRentalORM.find_available_vehicles, ('vehicles',)),
+    (r'/vehicles/type/([^/]+)', lambda t: CarRentalORM.find_vehicles_by_type(unquote(t)), ('vehicles',)),
+    (r'/vehicles/(\d+)', lambda i: CarRentalORM.find_by_id('vehicles', int(i)), ('vehicles',)),
+    (r'/locations', lambda: CarRentalORM.get_all('locations'), ('locations',)),
+    (r'/locations/(\d+)/vehicles', lambda i: CarRentalORM.find_vehicles_by_location(int(i)), ('vehicles',)),
+    (r'/customers', lambda: CarRentalORM.get_all('customers'), ('customers',)),
+    (r'/customers/(\d+)', lambda i: CarRentalORM.find_by_id('customers', int(i)), ('customers',)),
+    (r'/customers/(\d+)/rentals', lambda i: CarRentalORM.find_rentals_by_customer(int(i)), ('rentals', 'vehicles')),
+    (r'/rentals', CarRentalORM.find_rentals_with_details, ('rentals', 'customers', 'vehicles')),
+    (r'/rentals/active', CarRentalORM.find_active_rentals, ('rentals', 'customers', 'vehicles')),
+    (r'/rentals/overdue', CarRentalORM.find_overdue_rentals, ('rentals', 'customers', 'vehicles')),
+    (r'/rentals/(\d+)', lambda i: CarRentalORM.find_by_id('rentals', int(i)), ('rentals',)),
+    (r'/maintenance/overdue', CarRentalORM.find_overdue_maintenance, ('maintenance_records', 'vehicles')),
+    (r'/maintenance/scheduled', CarRentalORM.find_scheduled_maintenance, ('maintenance_records', 'vehicles')),
+    (r'/insurance/expiring', CarRentalORM.find_expiring_insurance, ('insurance', 'vehicles')),
+    (r'/reports/revenue', CarRentalORM.get_revenue_report, ('rentals',)),
+    (r'/reports/utilization', CarRentalORM.get_utilization_report, ('vehicles',)),
+]
+READ_ROUTES = [(re.compile(pattern + '$'), finder, tables) for pattern, finder, tables in READ_ROUTES]
+
+# Answers that depend on today's date as well as the tables: cached per day
+DATED_ROUTES = {'/rentals/overdue', '/maintenance/overdue', '/insurance/expiring'}
+
+class ResponseCache:
+    """Encoded GET responses with their ETags, dropped when a table they read from changes.
+
+    Writes made through CarRentalORM in this process invalidate by table
+    straight away. Any commit seen through ``PRAGMA data_version`` clears
+    everything: the version cannot tell this process's writes from another
+    process's that landed alongside them. ``dependents`` are the process's
+    other caches (anything with an ``invalidate()``, such as the coverage
+    index) that only hear about ORM writes otherwise; they are invalidated
+    on the same version change.
+    """
+
+    def __init__(self, dependents=()):
+        self.dependents = tuple(dependents)
+        self.lock = threading.Lock()
+        self.entries = {}
+        # Bumped on every invalidation so a response computed across a write is not stored
+        self.generation = 0
+        self.monitor = None
+        self.data_version = None
+
+    def start(self):
+        CarRentalORM.add_listener(self.on_write)
+        if db.backend.name == 'sqlite':
+            self.monitor = db.backend.connect(db.db_name, read_only=db.read_only, shared=True)
+            self.data_version = self._read_data_version()
+
+    def stop(self):
+        CarRentalORM.remove_listener(self.on_write)
+        if self.monitor is not None:
+            self.monitor.close()
+            self.monitor = None
+        self.entries.clear()
+
+    def _read_data_version(self):
+        return self.monitor.execute("PRAGMA data_version").fetchone()[0]
+
+    def on_write(self, table):
+        affected = {table, *INVALIDATES.get(table, ())}
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, entry in self.entries.items() if affected & entry[2]]:
+                del self.entries[key]
+
+    def _sync(self):
+        if self.monitor is None:
+            return
+        version = self._read_data_version()
+        if version != self.data_version:
+            self.generation += 1
+            self.entries.clear()
+            self.data_version = version
+            for dependent in self.dependents:
+                dependent.invalidate()
+
+    def poll(self):
+        """Catch up with commits from other processes (done by ``get`` too)"""
+        with self.lock:
+            self._sync()
+
+    def get(self, key):
+        """``(entry or None, generation)`` for a cache key"""
+        with self.lock:
+            self._sync()
+            return self.entries.get(key), self.generation
+
+    def put(self, key, body, tables, generation):
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (etag, body, frozenset(tables))
+        return etag
+
+class APIHandler(BaseHTTPRequestHandler):
+    """Routes requests to the ORM; keep-alive HTTP/1.1 so terminals reuse their sockets"""
+
+    protocol_version = 'HTTP/1.1'
+    ingestor = None
+    # Headers and body go out as separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+    cache = None
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b'', etag=None, content_type='application/json', encoding=None):
+        self.send_response(status)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, _encoder.encode(_plain(payload)).encode())
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        body = self.rfile.read(length)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    def _send_sync(self, payload):
+        # Branch terminals sit on slow links: sync deltas always travel compressed
+        self._send(200, gzip.compress(_encoder.encode(payload).encode()), encoding='gzip')
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip('/') or '/'
+        if path == '/health':
+            return self._send_json(200, {'status': 'ok'})
+        if path == '/metrics':
+            return self._send(200, metrics.prometheus().encode(), content_type='text/plain; version=0.0.4')
+        if path == '/sync/changes':
+            query = parse_qs(urlsplit(self.path).query)
+            try:
+                events_since = int(query['events_since'][0]) if 'events_since' in query else None
+                return self._send_sync(CentralSync().changes_since(query['terminal'][0], int(query['since'][0]), events_since))
+            except (KeyError, ValueError) as e:
+                return self._send_json(400, {'error': f"Bad request: {e}"})
+
+        for pattern, finder, tables in READ_ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return self._send_json(404, {'error': f"No such endpoint: {path}"})
+
+        key = f"{path}@{date.today().isoformat()}" if path in DATED_ROUTES else path
+        entry, generation = self.cache.get(key)
+        if entry is None:
+            result = finder(*match.groups())
+            if result is None:
+                return self._send_json(404, {'error': 'Not found'})
+            body = _encoder.encode(_plain(result)).encode()
+            etag = self.cache.put(key, body, tables, generation)
+        else:
+            etag, body, _ = entry
+
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, etag=etag)
+        self._send(200, body, etag)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        try:
+            data = self._read_json()
+            # Bookings check cover against the coverage index: see policies added by other processes first
+            if self.cache is not None:
+                self.cache.poll()
+            if path == '/telemetry':
+                # Queued for the batch writer; 503 tells devices to back off when the queue is full
+                readings = data if isinstance(data, list) else [data]
+                try:
+                    self.ingestor.submit_many(readings, timeout=1)
+                except queue.Full:
+                    return self._send_json(503, {'error': 'Telemetry queue full, retry later'})
+                except RuntimeError as e:
+                    return self._send_json(503, {'error': str(e)})
+                return self._send_json(202, {'accepted': len(readings)})
+            if not isinstance(data, dict):
+                return self._send_json(400, {'error': "Bad request: expected a JSON object"})
+            if path == '/sync/push':
+                try:
+                    return self._send_sync(CentralSync().apply_push(data))
+                except db.backend.Error as e:
+                    return self._send_json(409, {'error': f"Sync rejected: {e}"})
+            if path == '/rentals':
+                rental_id, total = CarRentalORM.book_rental(
+                    int(data['customer_id']), int(data['vehicle_id']), data['start_date'], data['end_date'])
+                insured = coverage_index.is_covered(int(data['vehicle_id']), data['start_date'], data['end_date'])
+                return self._send_json(201, {'id': rental_id, 'total_amount': total, 'insured': insured})
+            match = re.match(r'/rentals/(\d+)/return$', path)
+            if match:
+                CarRentalORM.return_rental(int(match.group(1)), data.get('return_date'))
+                return self._send_json(200, CarRentalORM.find_by_id('rentals', int(match.group(1))))
+        except (KeyError, TypeError, json.JSONDecodeError, gzip.BadGzipFile) as e:
+            return self._send_json(400, {'error': f"Bad request: {e}"})
+        except ValueError as e:
+            return self._send_json(422, {'error': str(e)})
+        except db.backend.IntegrityError as e:
+            # e.g. an unknown customer_id failing its foreign key
+            return self._send_json(409, {'error': f"Constraint failed: {e}"})
+        except db.backend.Error as e:
+            return self._send_json(500, {'error': f"Database error: {e}"})
+        self._send_json(404, {'error': f"No such endpoint: {path}"})
+
+def serve(host='127.0.0.1', port=8080, pool_size=8, verbose=False):
+    """Run the API until interrupted"""
+    db.use_pool(pool_size)
+    cache = ResponseCache(dependents=(coverage_index, demand_pricing))
+    cache.start()
+    ingestor = TelemetryIngestor().start()
+    handler = type('Handler', (APIHandler,), {'cache': cache, 'ingestor': ingestor, 'quiet': not verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        ingestor.stop(timeout=5)
+        cache.stop()
+        db.close_pool()
@@ -0,0 +1,77 @@
+"""
+Load test for the local HTTP API - concurrent keep-alive clients replaying
+kiosk traffic, reporting throughput and latency percentiles.
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+
+# Weighted mix of kiosk reads
+DEFAULT_PATHS = [
+    ('/vehicles/available', 5),
+    ('/vehicles', 2),
+    ('/rentals/active', 3),
+    ('/customers', 2),
+    ('/reports/utilization', 1),
+    ('/reports/revenue', 1),
+]
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def _client(host, port, paths, weights, requests, use_etags, seed, results):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    etags = {}
+    latencies, statuses = [], {}
+    for _ in range(requests):
+        path = rng.choices(paths, weights)[0]
+        headers = {'If-None-Match': etags[path]} if use_etags and path in etags else {}
+        started = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    conn.close()
+    results.append((latencies, statuses))
+
+def run_load_test(host='127.0.0.1', port=8080, clients=8, requests=500, use_etags=True, paths=None):
+    """Hammer the API from ``clients`` threads and summarise the latencies"""
+    paths, weights = zip(*(paths or DEFAULT_PATHS))
+    results = []
+    threads = [
+        threading.Thread(target=_client, args=(host, port, paths, weights, requests, use_etags, seed, results))
+        for seed in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(value for values, _ in results for value in values)
+    statuses = {}
+    for _, counts in results:
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return {
+        'requests': len(latencies),
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'statuses': statuses,
+    }
+
+if __name__ == '__main__':
+    print(json.dumps(run_load_test(), indent=2))
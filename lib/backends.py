@@ -0,0 +1,250 @@
+"""
+Storage backends for the Car Rental System.
+
+The ORM writes SQL with ``?`` placeholders; a backend owns everything that
+differs between drivers: opening connections, placeholder style, row
+access, upserts, bulk loads and fetching generated IDs.
+
+SQLite is the complete backend. ``DBAPIBackend`` and ``PostgresBackend``
+run the ORM's CRUD, finders, bookings and reports, and nothing more:
+
+* The schema is not created for them. ``Database.init_database`` holds the
+  reference DDL, and a server schema must also keep the derived state the
+  SQLite triggers maintain: ``vehicles.status``, the ``*_day`` epoch-day
+  columns, ``customer_stats`` and ``change_log``.
+* Queries on that path stick to SQL both databases accept: no two-argument
+  scalar ``MAX()``/``MIN()`` (use ``CASE``), every selected column grouped.
+* Features built on SQLite itself raise ``ValueError`` through
+  ``Database.require_sqlite``: documents, database maintenance, branch
+  sync, the index advisor, rebuilding customer stats, merging customers
+  (their documents move along) and cloning. The
+  session cache stays off, and parallel reports only accept PostgreSQL
+  targets.
+
+``tests/test_backends.py`` runs the ORM through ``DBAPIBackend`` with the
+sqlite3 module standing in for a server driver.
+"""
+
+import importlib
+import os
+import sqlite3
+
+def _split_placeholders(query):
+    """Split a query on ``?`` placeholders that are outside quoted literals"""
+    parts, current, quote = [], [], None
+    for char in query:
+        if quote:
+            current.append(char)
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            current.append(char)
+        elif char == '?':
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+class DictCursor:
+    """Wraps a DB-API cursor so rows support ``row['column']`` access"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def _to_dict(self, row):
+        if row is None:
+            return None
+        columns = [column[0] for column in self.cursor.description]
+        return dict(zip(columns, row))
+
+    def fetchone(self):
+        return self._to_dict(self.cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size else self.cursor.fetchmany()
+        return [self._to_dict(row) for row in rows]
+
+    def fetchall(self):
+        return [self._to_dict(row) for row in self.cursor.fetchall()]
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+class SQLiteBackend:
+    """Default single-file backend built on the standard library sqlite3 driver"""
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    # Schema, triggers and PRAGMA-based features are created by Database.init_database
+    manages_schema = True
+
+    def connect(self, target, read_only=False, shared=False):
+        # ``shared`` connections are pooled and may be used from several threads (one at a time)
+        if target.startswith('file:'):
+            # URI targets, e.g. the shared-cache in-memory databases of Database(':memory:')
+            if read_only and 'mode=' not in target:
+                target += ('&' if '?' in target else '?') + 'mode=ro'
+            conn = sqlite3.connect(target, uri=True, check_same_thread=not shared)
+            if read_only and 'mode=ro' not in target:
+                # mode=memory cannot be combined with mode=ro, so refuse writes per connection instead
+                conn.execute("PRAGMA query_only = ON")
+        elif read_only:
+            conn = sqlite3.connect(f"file:{os.path.abspath(target)}?mode=ro", uri=True, check_same_thread=not shared)
+        else:
+            conn = sqlite3.connect(target, check_same_thread=not shared)
+        conn.row_factory = sqlite3.Row
+        # Enable foreign keys
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def adapt(self, query):
+        return query
+
+    def begin_write(self, conn):
+        """Take the write lock now, so rows read in this transaction cannot change before it commits"""
+        conn.execute("BEGIN IMMEDIATE")
+
+    def execute(self, conn, query, params=()):
+        return conn.execute(self.adapt(query), params)
+
+    def executemany(self, conn, query, rows):
+        """Run one statement for every parameter tuple in ``rows``"""
+        conn.executemany(self.adapt(query), rows)
+
+    def insert(self, conn, table, data):
+        """Insert a row and return its generated ID"""
+        columns = ', '.join(data.keys())
+        placeholders = ', '.join(['?' for _ in data])
+        cursor = self.execute(conn, f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(data.values()))
+        return cursor.lastrowid
+
+    def upsert_sql(self, table, columns, conflict_columns):
+        """INSERT ... ON CONFLICT DO UPDATE statement (same syntax on SQLite and PostgreSQL)"""
+        placeholders = ', '.join(['?' for _ in columns])
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column not in conflict_columns)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({', '.join(conflict_columns)}) {action}")
+
+    def bulk_copy(self, conn, table, columns, rows):
+        """Load many rows in one statement batch"""
+        placeholders = ', '.join(['?' for _ in columns])
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        conn.executemany(self.adapt(query), rows)
+
+class DBAPIBackend(SQLiteBackend):
+    """Backend for any DB-API 2 driver module.
+
+    ``?`` placeholders are rewritten to the driver's ``paramstyle`` and rows
+    are returned as dicts. The schema is expected to exist already (see the
+    module docstring for what it must provide).
+    """
+
+    name = 'dbapi'
+    manages_schema = False
+
+    def __init__(self, module, paramstyle=None, **connect_kwargs):
+        self.module = importlib.import_module(module) if isinstance(module, str) else module
+        self.Error = self.module.Error
+        self.IntegrityError = self.module.IntegrityError
+        self.paramstyle = paramstyle or self.module.paramstyle
+        self.connect_kwargs = connect_kwargs
+
+    def connect(self, target, read_only=False, shared=False):
+        return self.module.connect(target, **self.connect_kwargs)
+
+    def begin_write(self, conn):
+        # Drivers open transactions implicitly; conflicting writers are left to the server's isolation level
+        pass
+
+    def adapt(self, query):
+        parts = _split_placeholders(query)
+        if self.paramstyle == 'qmark' or len(parts) == 1:
+            return query
+        markers = {
+            'format': lambda i: '%s',
+            'pyformat': lambda i: '%s',
+            'numeric': lambda i: f':{i + 1}',
+            'named': lambda i: f':p{i}',
+        }[self.paramstyle]
+        adapted = [parts[0]]
+        for index, part in enumerate(parts[1:]):
+            adapted.append(markers(index))
+            adapted.append(part)
+        return ''.join(adapted)
+
+    def _params(self, params):
+        if self.paramstyle == 'named':
+            return {f'p{i}': value for i, value in enumerate(params)}
+        return tuple(params)
+
+    def execute(self, conn, query, params=()):
+        cursor = conn.cursor()
+        cursor.execute(self.adapt(query), self._params(params))
+        return DictCursor(cursor)
+
+    def executemany(self, conn, query, rows):
+        conn.cursor().executemany(self.adapt(query), [self._params(row) for row in rows])
+
+    def bulk_copy(self, conn, table, columns, rows):
+        placeholders = ', '.join(['?' for _ in columns])
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        conn.cursor().executemany(self.adapt(query), [self._params(row) for row in rows])
+
+class PostgresBackend(DBAPIBackend):
+    """PostgreSQL through psycopg (v3) or psycopg2, whichever is installed"""
+
+    name = 'postgresql'
+
+    def __init__(self, **connect_kwargs):
+        try:
+            module = importlib.import_module('psycopg')
+        except ImportError:
+            module = importlib.import_module('psycopg2')
+        super().__init__(module, paramstyle='format', **connect_kwargs)
+
+    def connect(self, target, read_only=False, shared=False):
+        conn = super().connect(target, read_only=read_only, shared=shared)
+        if read_only:
+            conn.cursor().execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        return conn
+
+    def insert(self, conn, table, data):
+        columns = ', '.join(data.keys())
+        placeholders = ', '.join(['?' for _ in data])
+        cursor = self.execute(conn, f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) RETURNING id", tuple(data.values()))
+        return cursor.fetchone()['id']
+
+    def bulk_copy(self, conn, table, columns, rows):
+        """Stream rows through COPY FROM STDIN"""
+        cursor = conn.cursor()
+        statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        if hasattr(cursor, 'copy'):
+            with cursor.copy(statement) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            import csv
+            import io
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"{statement} WITH (FORMAT csv)", buffer)
+
+def backend_from_url(url):
+    """Pick a backend from a database URL or file path; returns (backend, target)"""
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresBackend(), url
+    if url.startswith('sqlite:///'):
+        url = url[len('sqlite:///'):]
+    return SQLiteBackend(), url
@@ -0,0 +1,102 @@
+"""
+Session-scoped in-memory cache of fleet reference data for the interactive menus.
+"""
+
+from database import db
+from models.orm import CarRentalORM
+
+# Tables whose API responses a write to each table affects (triggers keep vehicles.status current)
+INVALIDATES = {
+    'locations': ('locations', 'vehicles'),
+    'vehicles': ('vehicles',),
+    'customers': ('customers',),
+    'rentals': ('vehicles',),
+    'maintenance_records': ('vehicles',),
+}
+
+class FleetStateCache:
+    """Keeps locations, vehicles and customers in memory for one session.
+
+    Every lookup polls ``PRAGMA data_version`` on a long-lived connection,
+    which moves whenever any other connection - this process's ORM writes
+    included - commits. Any move drops the whole cache: the version cannot
+    tell which tables changed or who wrote them. When the cache is not
+    started every lookup goes straight to the ORM, so one-shot commands
+    behave as before.
+    """
+
+    TABLES = ('locations', 'vehicles', 'customers')
+
+    def __init__(self):
+        self.conn = None
+        self.rows = {}
+        self.by_id = {}
+        self.data_version = None
+
+    @property
+    def active(self):
+        return self.conn is not None
+
+    def start(self):
+        """Begin caching for the current session"""
+        if self.active or db.backend.name != 'sqlite':
+            # Without PRAGMA data_version other writers can't be noticed, so server backends stay uncached
+            return
+        self.conn = db.get_connection()
+        self.data_version = self._read_data_version()
+
+    def stop(self):
+        """Stop caching and release the connection"""
+        if not self.active:
+            return
+        self.conn.close()
+        self.conn = None
+        self.rows.clear()
+        self.by_id.clear()
+
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        version = self._read_data_version()
+        if version != self.data_version:
+            self.rows.clear()
+            self.by_id.clear()
+            self.data_version = version
+
+    def _load(self, table):
+        if table not in self.rows:
+            rows = self.conn.execute(f"SELECT * FROM {table}").fetchall()
+            self.rows[table] = rows
+            self.by_id[table] = {row['id']: row for row in rows}
+        return self.rows[table]
+
+    def get_all(self, table):
+        """All rows of a cached table"""
+        if not self.active or table not in self.TABLES:
+            return CarRentalORM.get_all(table)
+        self._sync()
+        return self._load(table)
+
+    def find_by_id(self, table, record_id):
+        """One row of a cached table by ID"""
+        if not self.active or table not in self.TABLES:
+            return CarRentalORM.find_by_id(table, record_id)
+        self._sync()
+        self._load(table)
+        return self.by_id[table].get(record_id)
+
+    def available_vehicles(self):
+        """Vehicles whose status is 'available'"""
+        if not self.active:
+            return CarRentalORM.find_available_vehicles()
+        return [v for v in self.get_all('vehicles') if v['status'] == 'available']
+
+    def vehicles_by_type(self, vehicle_type):
+        """Available vehicles of one type"""
+        if not self.active:
+            return CarRentalORM.find_vehicles_by_type(vehicle_type)
+        return [v for v in self.available_vehicles() if v['vehicle_type'] == vehicle_type]
+
+# Shared cache for the interactive session
+fleet_cache = FleetStateCache()
@@ -3,17 +3,31 @@
 import click
 import sys
 import os
+import time
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from helpers import *
 from debug import debug_menu
+from output import FORMATS, write_rows
 
 @click.group()
-def cli():
+@click.option('--format', 'output_format', type=click.Choice(FORMATS), default='text', show_default=True,
+              help='Output format for listings and reports')
+@click.pass_context
+def cli(ctx, output_format):
     """🇰🇪 Kenyan Car Rental Management System"""
-    pass
+    ctx.ensure_object(dict)
+    ctx.obj['format'] = output_format
+
+def _emit(rows, show):
+    """Print with ``show`` in text mode, otherwise stream ``rows()`` in the selected format"""
+    output_format = click.get_current_context().obj['format']
+    if output_format == 'text':
+        show()
+    else:
+        write_rows(rows(), output_format)
 
 # Vehicle commands
 @cli.group()
@@ -24,12 +38,22 @@ def vehicles():
 @vehicles.command()
 def list():
     """List all vehicles"""
-    list_vehicles()
+    _emit(lambda: CarRentalORM.get_all('vehicles', stream=True), list_vehicles)
 
 @vehicles.command()
 def available():
     """List available vehicles"""
-    find_available_vehicles()
+    _emit(lambda: CarRentalORM.find_available_vehicles(stream=True), find_available_vehicles)
+
+@vehicles.command()
+@click.option('--lat', type=float, required=True, help='Customer latitude')
+@click.option('--lon', type=float, required=True, help='Customer longitude')
+@click.option('--type', 'vehicle_type', default=None, help='Only count vehicles of this type')
+@click.option('--limit', type=int, default=5, show_default=True, help='Branches to return')
+def near(lat, lon, vehicle_type, limit):
+    """Closest branches with available vehicles"""
+    _emit(lambda: CarRentalORM.find_vehicles_near(lat, lon, vehicle_type, limit),
+          lambda: find_vehicles_near(lat, lon, vehicle_type, limit))
 
 @vehicles.command()
 @click.option('--make', prompt=True, help='Vehicle make')
@@ -59,7 +83,7 @@ def customers():
 @customers.command()
 def list():
     """List all customers"""
-    list_customers()
+    _emit(lambda: CarRentalORM.get_all('customers', stream=True), list_customers)
 
 @customers.command()
 @click.option('--first-name', prompt=True, help='First name')
@@ -76,6 +100,69 @@ def add(first_name, last_name, email, phone, license):
     customer_id = CarRentalORM.create('customers', data)
     click.echo(f" Customer added! ID: {customer_id}")
 
+@customers.command()
+@click.argument('customer_id', type=int)
+def status(customer_id):
+    """Loyalty tier and lifetime figures of a customer"""
+    from models.loyalty import LoyaltyTiers
+    _emit(lambda: [row for row in [LoyaltyTiers.status(customer_id)] if row], lambda: show_customer_status(customer_id))
+
+@customers.command()
+@click.option('--rebuild', is_flag=True, help='Recompute every customer\'s figures from rentals first')
+@click.option('--archive-db', default=None, help='Archive to include in --rebuild (default: the last one archived to)')
+def tiering(rebuild, archive_db):
+    """Re-evaluate loyalty tiers of customers whose figures changed (nightly job)"""
+    if rebuild:
+        from models.loyalty import LoyaltyTiers
+        LoyaltyTiers.rebuild(archive_db)
+    run_loyalty_tiering()
+
+@customers.command()
+@click.option('--threshold', type=float, default=0.85, show_default=True, help='Lowest match score to propose')
+@click.option('--max-block', type=int, default=50, show_default=True, help='Skip blocking keys shared by more customers')
+@click.option('--apply', is_flag=True, help='Merge every proposal')
+def dedupe(threshold, max_block, apply):
+    """Find likely duplicate customers (and optionally merge them)"""
+    from models.dedupe import CustomerDeduplicator
+    deduplicator = CustomerDeduplicator(threshold, max_block)
+    proposals = deduplicator.find_duplicates()
+    _emit(lambda: proposals, lambda: show_duplicate_customers(proposals, deduplicator.stats))
+    if apply and proposals:
+        moved = sum(CustomerDeduplicator.merge(p['keep_id'], p['merge_ids']) for p in proposals)
+        merged = sum(len(p['merge_ids']) for p in proposals)
+        click.echo(f" Merged {merged} customers, {moved} rentals moved", err=True)
+
+@customers.command()
+@click.argument('keep_id', type=int)
+@click.argument('duplicate_ids', type=int, nargs=-1, required=True)
+def merge(keep_id, duplicate_ids):
+    """Fold duplicate customers into KEEP_ID (rentals are moved to it)"""
+    from models.dedupe import CustomerDeduplicator
+    try:
+        moved = CustomerDeduplicator.merge(keep_id, duplicate_ids)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    click.echo(f" Merged {len(set(duplicate_ids) - {keep_id})} customers into {keep_id}, {moved} rentals moved")
+
+# Location commands
+@cli.group()
+def locations():
+    """Manage branches"""
+    pass
+
+@locations.command('set-position')
+@click.argument('location_id', type=int)
+@click.option('--lat', type=float, required=True, help='Latitude')
+@click.option('--lon', type=float, required=True, help='Longitude')
+def set_position(location_id, lat, lon):
+    """Set a branch's coordinates"""
+    if not CarRentalORM.find_by_id('locations', location_id):
+        click.echo(" Location not found!")
+        return
+    CarRentalORM.update('locations', location_id, {'lat': lat, 'lon': lon})
+    click.echo(f" Location {location_id} placed at {lat}, {lon}")
+
 # Rental commands
 @cli.group()
 def rentals():
@@ -85,12 +172,12 @@ def rentals():
 @rentals.command()
 def list():
     """List all rentals"""
-    list_rentals()
+    _emit(lambda: CarRentalORM.find_rentals_with_details(stream=True), list_rentals)
 
 @rentals.command()
 def active():
     """List active rentals"""
-    find_active_rentals()
+    _emit(lambda: CarRentalORM.find_active_rentals(stream=True), find_active_rentals)
 
 @rentals.command()
 @click.option('--customer-id', prompt=True, type=int, help='Customer ID')
@@ -99,31 +186,358 @@ def active():
 @click.option('--end-date', prompt=True, help='End date (YYYY-MM-DD)')
 def create(customer_id, vehicle_id, start_date, end_date):
     """Create a new rental"""
-    from datetime import datetime
-    
-    vehicle = CarRentalORM.find_by_id('vehicles', vehicle_id)
-    if not vehicle:
-        click.echo(" Vehicle not found!")
+    try:
+        rental_id, total = CarRentalORM.book_rental(customer_id, vehicle_id, start_date, end_date)
+    except ValueError as e:
+        click.echo(f" {e}")
         return
     
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d')
-    days = (end - start).days
-    
-    if days <= 0:
-        click.echo(" Invalid date range!")
+    click.echo(f" Rental created! ID: {rental_id}, Total: KES {total:,.2f}")
+    warn_if_uninsured(vehicle_id, start_date, end_date)
+
+@rentals.command()
+@click.option('--vehicle-id', prompt=True, type=int, help='Vehicle ID')
+@click.option('--start-date', prompt=True, help='Start date (YYYY-MM-DD)')
+@click.option('--end-date', prompt=True, help='End date (YYYY-MM-DD)')
+def quote(vehicle_id, start_date, end_date):
+    """Demand-priced quote, night by night"""
+    show_rental_quote(vehicle_id, start_date, end_date)
+
+@rentals.command()
+@click.argument('rental_id', type=int)
+def history(rental_id):
+    """Show the event history of a rental"""
+    _emit(lambda: RentalEventLog.find_by_rental(rental_id), lambda: show_rental_history(rental_id))
+
+@rentals.command()
+@click.option('--as-of', default=None, help='Date to rebuild state for (YYYY-MM-DD), default now')
+def snapshot(as_of):
+    """Rebuild fleet rental state from the event log"""
+    _emit(lambda: RentalProjector.vehicles_out(as_of), lambda: show_fleet_snapshot(as_of))
+
+@rentals.command()
+@click.option('--start-date', prompt=True, help='Start date (YYYY-MM-DD)')
+@click.option('--end-date', prompt=True, help='End date (YYYY-MM-DD)')
+def utilization(start_date, end_date):
+    """Historical utilization from the event log"""
+    _emit(lambda: RentalProjector.utilization_rows(start_date, end_date),
+          lambda: generate_historical_utilization_report(start_date, end_date))
+
+@rentals.command()
+@click.argument('requests_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--commit', is_flag=True, help='Create reservations for the assignments')
+def allocate(requests_file, commit):
+    """Assign vehicles to a CSV batch of reservation requests"""
+    try:
+        requests = ReservationAllocator.load_requests(requests_file)
+    except (OSError, ValueError) as e:
+        click.echo(f" Could not read requests: {e}")
         return
-    
-    total = days * vehicle['daily_rate']
-    
+    assignments, unassigned = ReservationAllocator().allocate(requests)
+    try:
+        rental_ids = ReservationAllocator.commit(assignments) if commit and assignments else []
+    except ValueError as e:
+        click.echo(f" No reservations created: {e}")
+        return
+    _emit(lambda: ReservationAllocator.result_rows(assignments, unassigned, rental_ids),
+          lambda: show_allocation(requests, assignments, unassigned, rental_ids))
+
+# Fleet commands
+@cli.group()
+def fleet():
+    """Fleet planning"""
+    pass
+
+@fleet.command()
+@click.option('--horizon', type=int, default=None, help='Only store services due within this many days')
+@click.option('--dry-run', is_flag=True, help='Show the forecast without saving it')
+def forecast(horizon, dry_run):
+    """Predict next service dates from rental usage and block those days"""
+    forecast_maintenance(horizon, dry_run)
+
+@fleet.command()
+@click.option('--horizon', type=int, default=7, show_default=True, help='Days ahead to plan stock for')
+@click.option('--lookback', type=int, default=56, show_default=True, help='Days of rental history to forecast from')
+@click.option('--service-level', type=float, default=0.9, show_default=True, help='Chance a branch meets its demand')
+@click.option('--keep', type=int, default=1, show_default=True, help='Vehicles of each type a donor branch keeps')
+@click.option('--max-km', type=int, default=None, help='Longest transfer allowed')
+def rebalance(horizon, lookback, service_level, keep, max_km):
+    """Plan vehicle transfers between branches from forecast demand"""
+    from models.rebalance import FleetRebalancer
+    plan = FleetRebalancer(horizon, lookback, service_level, keep, max_km).plan()
+    _emit(lambda: plan['moves'], lambda: show_rebalance_plan(plan))
+
+# Insurance commands
+@cli.group()
+def insurance():
+    """Insurance cover"""
+    pass
+
+@insurance.command()
+@click.option('--vehicle-id', prompt=True, type=int, help='Vehicle ID')
+@click.option('--provider', prompt=True, help='Insurer')
+@click.option('--policy-number', prompt=True, help='Policy number')
+@click.option('--coverage-type', prompt=True, type=click.Choice(['comprehensive', 'third-party', 'liability']),
+              default='comprehensive', help='Cover')
+@click.option('--premium', prompt=True, type=float, help='Premium')
+@click.option('--start-date', prompt=True, help='First day of cover (YYYY-MM-DD)')
+@click.option('--end-date', prompt=True, help='Last day of cover (YYYY-MM-DD)')
+@click.option('--deductible', type=float, default=None, help='Deductible')
+def add(vehicle_id, provider, policy_number, coverage_type, premium, start_date, end_date, deductible):
+    """Add an insurance policy for a vehicle"""
     data = {
-        'customer_id': customer_id, 'vehicle_id': vehicle_id,
-        'start_date': start_date, 'end_date': end_date,
-        'total_amount': total, 'status': 'active'
+        'vehicle_id': vehicle_id, 'provider': provider, 'policy_number': policy_number,
+        'coverage_type': coverage_type, 'premium': premium, 'deductible': deductible,
+        'start_date': start_date, 'end_date': end_date
     }
-    
-    rental_id = CarRentalORM.create('rentals', data)
-    click.echo(f" Rental created! ID: {rental_id}, Total: KES {total:,.2f}")
+    policy_id = CarRentalORM.create('insurance', data)
+    click.echo(f" Insurance policy added! ID: {policy_id}")
+
+@insurance.command()
+@click.option('--days', type=int, default=90, show_default=True, help='How far ahead to check cover')
+def audit(days):
+    """Find uninsured vehicles, cover gaps, overlapping policies and rentals at risk"""
+    _emit(lambda: audit_rows(audit_coverage(days)), lambda: show_coverage_audit(days))
+
+# Telemetry commands
+@cli.group()
+def telemetry():
+    """Vehicle telematics (odometer, fuel, GPS)"""
+    pass
+
+@telemetry.command()
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Readings per commit')
+@click.option('--max-delay', type=float, default=0.05, show_default=True, help='Seconds before a partial batch is committed')
+@click.option('--durability', type=click.Choice(['full', 'normal', 'off']), default='normal', show_default=True,
+              help='How hard each commit waits for the disk')
+def ingest(source, batch_size, max_delay, durability):
+    """Load JSON-lines readings from a file or stdin"""
+    import json
+    from telemetry import TelemetryIngestor
+    ingestor = TelemetryIngestor(batch_size, max_delay, durability=durability).start()
+    started = time.perf_counter()
+    # A malformed line only loses itself; the first one is shown so the feed can be fixed
+    malformed, first_error = 0, None
+    try:
+        for number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                reading = json.loads(line)
+                if not isinstance(reading, dict):
+                    raise ValueError("expected a JSON object")
+                ingestor.submit(reading)
+            except (ValueError, KeyError, TypeError) as e:
+                malformed += 1
+                first_error = first_error or f"line {number}: {e}"
+    except RuntimeError as e:
+        click.echo(f" {e}")
+    finally:
+        ingestor.stop()
+    elapsed = time.perf_counter() - started
+    stats = ingestor.stats
+    if ingestor.crashed.is_set():
+        click.echo(f" Telemetry writer failed: {ingestor.error}")
+    click.echo(f" {stats['written']:,} readings in {stats['batches']:,} batches, {elapsed:.2f}s "
+               f"({stats['written'] / elapsed if elapsed else 0:,.0f}/s)")
+    if stats['failed']:
+        click.echo(f" {stats['failed']:,} readings rejected: {ingestor.error}")
+    if malformed:
+        click.echo(f" {malformed:,} malformed lines skipped (first at {first_error})")
+
+@telemetry.command()
+@click.argument('vehicle_id', type=int)
+@click.option('--limit', type=int, default=20, show_default=True, help='Readings to show')
+def show(vehicle_id, limit):
+    """Latest readings for a vehicle"""
+    from telemetry import latest_readings
+    _emit(lambda: latest_readings(vehicle_id, limit), lambda: show_telemetry(vehicle_id, limit))
+
+# Document commands
+@cli.group()
+def documents():
+    """License scans and inspection photos"""
+    pass
+
+@documents.command()
+@click.argument('owner_type', type=click.Choice(['customer', 'vehicle', 'rental']))
+@click.argument('owner_id', type=int)
+@click.argument('kind', type=click.Choice(['license_scan', 'pickup_inspection', 'return_inspection', 'damage_photo', 'other']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def attach(owner_type, owner_id, kind, path):
+    """Store a file and attach it to a customer, vehicle or rental"""
+    from documents import DocumentStore
+    try:
+        document_id, reused = DocumentStore.store(owner_type, owner_id, kind, path)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    note = " (same content already stored, not copied again)" if reused else ""
+    click.echo(f" Document {document_id} attached{note}")
+
+@documents.command('list')
+@click.argument('owner_type', type=click.Choice(['customer', 'vehicle', 'rental']))
+@click.argument('owner_id', type=int)
+def list_documents(owner_type, owner_id):
+    """Documents attached to a customer, vehicle or rental"""
+    from documents import DocumentStore
+    _emit(lambda: DocumentStore.find_by_owner(owner_type, owner_id), lambda: show_documents(owner_type, owner_id))
+
+@documents.command()
+@click.argument('document_id', type=int)
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export(document_id, path):
+    """Write a document's content to a file"""
+    from documents import DocumentStore
+    try:
+        size = DocumentStore.export(document_id, path)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    click.echo(f" Wrote {size:,} bytes to {path}")
+
+@documents.command('delete')
+@click.argument('document_id', type=int)
+def delete_document(document_id):
+    """Detach a document (its content goes once nothing refers to it)"""
+    from documents import DocumentStore
+    try:
+        DocumentStore.delete(document_id)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    click.echo(f" Document {document_id} deleted")
+
+@documents.command()
+def storage():
+    """Stored bytes and the space saved by deduplication"""
+    show_document_storage()
+
+# Report commands
+@cli.group()
+def reports():
+    """Run business reports"""
+    pass
+
+@reports.command()
+def revenue():
+    """Revenue summary"""
+    _emit(lambda: [CarRentalORM.get_revenue_report()], generate_revenue_report)
+
+@reports.command('utilization')
+def utilization_report():
+    """Current fleet utilization"""
+    _emit(lambda: [CarRentalORM.get_utilization_report()], generate_utilization_report)
+
+@reports.command('export-history')
+@click.argument('path', default='rental_history.cols')
+def export_history(path):
+    """Write rental history to a columnar snapshot file for analytics"""
+    from columnar import export_snapshot
+    started = time.perf_counter()
+    rows = export_snapshot(path)
+    click.echo(f" {rows:,} rentals written to {path} ({os.path.getsize(path):,} bytes) "
+               f"in {time.perf_counter() - started:.2f}s")
+
+@reports.command('history')
+@click.option('--snapshot', 'path', default='rental_history.cols', show_default=True, help='Snapshot from export-history')
+@click.option('--from', 'start_date', default=None, help='First start date (default: a year ago)')
+@click.option('--to', 'end_date', default=None, help='Last start date (default: today)')
+@click.option('--by', type=click.Choice(['city', 'location', 'vehicle_type', 'make', 'model', 'status']),
+              default='city', show_default=True)
+def history(path, start_date, end_date, by):
+    """Rentals, rental days and revenue per group, read from a columnar snapshot"""
+    from datetime import date, timedelta
+    from columnar import ColumnarSnapshot, history_summary
+    end_date = end_date or date.today().isoformat()
+    start_date = start_date or (date.fromisoformat(end_date) - timedelta(days=365)).isoformat()
+    try:
+        snapshot = ColumnarSnapshot(path)
+    except (OSError, ValueError) as e:
+        click.echo(f" Cannot open snapshot: {e} (create one with reports export-history)")
+        return
+    with snapshot:
+        summary = history_summary(snapshot, start_date, end_date, by)
+    _emit(lambda: summary, lambda: show_history_summary(summary, by))
+
+@reports.command('run-all')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+@click.option('--report', 'names', multiple=True, help='Run only these reports (repeatable)')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write JSON here instead of stdout')
+def run_all(workers, names, output):
+    """Run every report in parallel and merge the results as JSON"""
+    from reports import ReportRunner
+    runner = ReportRunner(workers=workers, tasks=names or None)
+    try:
+        document = runner.run()
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    runner.write(document, output)
+    if output:
+        click.echo(f" {len(document['reports'])} reports written to {output} in {document['elapsed_seconds']:.3f}s")
+    if document['failed']:
+        click.echo(f" Failed reports: {', '.join(document['failed'])}", err=True)
+        sys.exit(1)
+
+# Database maintenance commands
+@cli.group()
+def maintenance():
+    """Database housekeeping (archive, backup, vacuum, analyze)"""
+    pass
+
+@maintenance.command()
+@click.option('--months', type=int, default=12, show_default=True, help='Archive history older than this')
+@click.option('--archive-db', default='car_rental_archive.db', show_default=True, help='Archive database file')
+def archive(months, archive_db):
+    """Move old completed rentals, maintenance and expired policies to an archive DB"""
+    from housekeeping import DatabaseMaintenance
+    try:
+        moved = DatabaseMaintenance.archive(months, archive_db)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    for table, count in moved.items():
+        click.echo(f" {table}: {count} archived")
+
+@maintenance.command()
+@click.argument('destination', type=click.Path(dir_okay=False))
+@click.option('--pages', type=int, default=256, show_default=True, help='Pages copied per step')
+def backup(destination, pages):
+    """Online backup of the live database"""
+    from housekeeping import DatabaseMaintenance
+    try:
+        size = DatabaseMaintenance.backup(destination, pages=pages)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    click.echo(f" Backup written to {destination} ({size:,} bytes)")
+
+@maintenance.command()
+@click.option('--pages', type=int, default=None, help='Free pages to reclaim (default: all)')
+def vacuum(pages):
+    """Incrementally reclaim free space"""
+    from housekeeping import DatabaseMaintenance
+    try:
+        result = DatabaseMaintenance.vacuum(pages)
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    if result['converted']:
+        click.echo(" Switched database to incremental auto-vacuum (full VACUUM run once)")
+    click.echo(f" Free pages: {result['free_pages_before']} -> {result['free_pages_after']}")
+
+@maintenance.command()
+def analyze():
+    """Refresh query planner statistics"""
+    from housekeeping import DatabaseMaintenance
+    try:
+        indexes = DatabaseMaintenance.analyze()
+    except ValueError as e:
+        click.echo(f" {e}")
+        return
+    click.echo(f" Statistics refreshed for {indexes} tables/indexes")
 
 # Debug commands
 @cli.group()
@@ -143,12 +557,77 @@ def test_db():
     from debug import DebugHelper
     DebugHelper.test_database_connection()
 
+@debug.command()
+def selftest():
+    """Run the database checks on an in-memory copy of the sample data"""
+    from debug import DebugHelper
+    if not DebugHelper.run_isolated_tests():
+        raise SystemExit(1)
+
 @debug.command()
 def stats():
     """Show database statistics"""
     from debug import DebugHelper
     DebugHelper.display_database_stats()
 
+@debug.command('advise-indexes')
+@click.option('--rows', type=int, default=20000, show_default=True, help='Synthetic rentals in the benchmark dataset')
+@click.option('--repeat', type=int, default=5, show_default=True, help='Timing runs per statement')
+@click.option('--apply', is_flag=True, help='Create the proposed indexes on the live database')
+def advise_indexes(rows, repeat, apply):
+    """Propose indexes from the captured ORM workload"""
+    from index_advisor import advise, apply_indexes
+    results, proposals = advise(rows, repeat)
+    for result in results:
+        click.echo(f"\n {result['statement'][:100]}")
+        click.echo(f"   plan: {'; '.join(result['plan_before'])}")
+        for sql in result['proposed']:
+            click.echo(f"   + {sql}")
+        click.echo(f"   {result['ms_before']:.3f} ms -> {result['ms_after']:.3f} ms")
+    
+    if not proposals:
+        click.echo("\n No new indexes needed for this workload.")
+        return
+    click.echo(f"\n Proposed indexes: {len(proposals)}")
+    if apply:
+        apply_indexes(proposals)
+        click.echo(" Indexes created on the live database.")
+
+@debug.command()
+@click.option('--url', default=None, help='Read the /metrics endpoint of a running API server instead')
+@click.option('--repeat', type=int, default=20, show_default=True, help='Runs of the representative workload')
+def metrics(url, repeat):
+    """Latency percentiles per operation"""
+    if url:
+        from urllib.request import urlopen
+        try:
+            with urlopen(url) as response:
+                click.echo(response.read().decode(), nl=False)
+        except OSError as e:
+            click.echo(f" Cannot read metrics from {url}: {e}")
+        return
+    from index_advisor import representative_workload
+    from metrics import metrics as registry
+    registry.reset()
+    for _ in range(repeat):
+        representative_workload()
+    _emit(registry.summary, lambda: show_metrics(registry.summary()))
+
+@debug.command('load-test')
+@click.option('--workers', type=int, default=8, show_default=True, help='Counter processes')
+@click.option('--duration', type=float, default=10.0, show_default=True, help='Seconds each counter runs')
+@click.option('--database', 'database', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Load-test a copy of this SQLite file instead of seeded sample data')
+@click.option('--vehicles', type=int, default=200, show_default=True, help='Synthetic vehicles to seed')
+@click.option('--customers', type=int, default=2000, show_default=True, help='Synthetic customers to seed')
+@click.option('--seed', type=int, default=0, show_default=True, help='Random seed for the operation mix')
+def counter_load_test(workers, duration, database, vehicles, customers, seed):
+    """Simulate concurrent branch counters on a copy and report JSON results"""
+    import json
+    from counter_loadtest import run_counter_load_test
+    summary = run_counter_load_test(workers, duration, database, vehicles, customers, seed=seed)
+    click.echo(json.dumps(summary, indent=2))
+
 @debug.command()
 def reset():
     """Reset database (DANGEROUS)"""
@@ -156,6 +635,95 @@ def reset():
     if click.confirm('  WARNING: This will delete ALL data. Are you sure?'):
         DebugHelper.reset_database()
 
+# Branch sync commands
+@cli.group()
+def sync():
+    """Offline branch terminals (local replica + delta sync)"""
+    pass
+
+@sync.command('clone')
+@click.argument('replica')
+@click.option('--terminal', required=True, help='Terminal name, e.g. kisumu')
+def sync_clone(replica, terminal):
+    """Create a terminal replica of this (central) database"""
+    from sync import CentralSync
+    try:
+        seq = CentralSync().register(terminal, replica)
+    except ValueError as e:
+        click.echo(f" {e}")
+        raise SystemExit(1)
+    click.echo(f" Replica for '{terminal}' written to {replica} (central change log at {seq})")
+    click.echo(f" Work offline with CAR_RENTAL_DATABASE_URL={replica}, then run sync run --central ...")
+
+@sync.command('run')
+@click.option('--central', required=True, help='Central database file, or API server URL (http://host:port)')
+def sync_run(central):
+    """Push local changes to the central database and pull its changes"""
+    from sync import TerminalSync, transport_for
+    try:
+        stats = TerminalSync(transport_for(central)).sync()
+    except (ValueError, OSError) as e:
+        click.echo(f" Sync failed: {e}")
+        raise SystemExit(1)
+    click.echo(f" Pushed {stats['pushed']} changes, pulled {stats['pulled']} "
+               f"({stats['bytes_sent']:,} bytes sent, {stats['bytes_received']:,} received)")
+    for rental_id in stats['rejected']:
+        click.echo(f" Rental {rental_id} clashed with a central booking and was cancelled")
+
+@sync.command('status')
+def sync_status():
+    """Show this database's sync role and pending changes"""
+    from sync import CentralSync, TerminalSync
+    state = TerminalSync(None).status()
+    if state['role'] == 'terminal':
+        click.echo(f" Terminal '{state['terminal']}': {state['pending_changes']} local changes to push, "
+                   f"central change log seen up to {state['pulled_seq']}")
+    elif state['role'] == 'central':
+        click.echo(" Central database; terminals:")
+        for peer in CentralSync().peers():
+            click.echo(f"  {peer['terminal']:<15} pulled up to {peer['pulled_seq']}, last sync {peer['last_sync']}")
+    else:
+        click.echo(" Not taking part in branch sync (create a replica with sync clone)")
+
+# HTTP API commands
+@cli.group()
+def api():
+    """Local HTTP/JSON service"""
+    pass
+
+@api.command()
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address to bind')
+@click.option('--port', type=int, default=8080, show_default=True, help='Port to listen on')
+@click.option('--pool-size', type=int, default=8, show_default=True, help='Pooled database connections')
+@click.option('--verbose', is_flag=True, help='Log every request')
+def serve(host, port, pool_size, verbose):
+    """Serve the ORM finders, rentals and reports over HTTP"""
+    from api import serve as serve_api
+    click.echo(f" Car rental API listening on http://{host}:{port} (Ctrl+C to stop)", err=True)
+    try:
+        serve_api(host, port, pool_size, verbose)
+    except KeyboardInterrupt:
+        click.echo("\n API stopped", err=True)
+
+@api.command('load-test')
+@click.option('--host', default='127.0.0.1', show_default=True, help='API address')
+@click.option('--port', type=int, default=8080, show_default=True, help='API port')
+@click.option('--clients', type=int, default=8, show_default=True, help='Concurrent keep-alive clients')
+@click.option('--requests', 'count', type=int, default=500, show_default=True, help='Requests per client')
+@click.option('--no-etags', is_flag=True, help='Ignore ETags (always fetch full bodies)')
+def load_test(host, port, clients, count, no_etags):
+    """Measure API throughput and latency"""
+    from api_loadtest import run_load_test
+    try:
+        summary = run_load_test(host, port, clients, count, use_etags=not no_etags)
+    except OSError as e:
+        click.echo(f" Cannot reach API at {host}:{port}: {e}")
+        return
+    click.echo(f" {summary['requests']} requests in {summary['elapsed_seconds']}s "
+               f"({summary['requests_per_second']} req/s)")
+    click.echo(f" p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms")
+    click.echo(f" Statuses: {summary['statuses']}")
+
 # Interactive mode (replaces main.py functionality)
 @cli.command()
 def interactive():
@@ -167,6 +735,9 @@ def interactive():
     click.echo("Type 'debug' for debug menu or '0' to exit")
     click.echo("="*60)
     
+    # Menus serve reference data from memory for the rest of the session
+    fleet_cache.start()
+    
     while True:
         show_main_menu()
         choice = click.prompt(" Select option", type=str)
@@ -345,7 +916,8 @@ def insurance_menu_interactive():
         click.echo("  INSURANCE MANAGEMENT")
         click.echo("="*40)
         click.echo("1. List all insurance policies")
-        click.echo("2. Back to main menu")
+        click.echo("2. Add insurance policy")
+        click.echo("3. Back to main menu")
         
         choice = click.prompt(" Select option", type=str)
         
@@ -353,6 +925,8 @@ def insurance_menu_interactive():
             click.echo("\n Insurance Policies:")
             list_insurance()
         elif choice == "2":
+            create_insurance()
+        elif choice == "3":
             break
         else:
             click.echo(" Invalid choice. Please try again.")
@@ -364,7 +938,8 @@ def reporting_menu_interactive():
         click.echo("="*40)
         click.echo("1. Revenue Report")
         click.echo("2. Vehicle Utilization Report")
-        click.echo("3. Back to main menu")
+        click.echo("3. Historical Utilization Report")
+        click.echo("4. Back to main menu")
         
         choice = click.prompt(" Select option", type=str)
         
@@ -375,6 +950,11 @@ def reporting_menu_interactive():
             click.echo("\n Vehicle Utilization Report:")
             generate_utilization_report()
         elif choice == "3":
+            click.echo("\n Historical Utilization Report:")
+            start_date = click.prompt(" Start Date (YYYY-MM-DD)")
+            end_date = click.prompt(" End Date (YYYY-MM-DD)")
+            generate_historical_utilization_report(start_date, end_date)
+        elif choice == "4":
             break
         else:
             click.echo(" Invalid choice. Please try again.")
@@ -0,0 +1,197 @@
+"""
+Columnar snapshot of rental history for analytics - rentals joined with their
+vehicle and branch, written column by column into one file that is opened
+with mmap, so reports scan typed arrays instead of sqlite3.Row objects and
+never touch the live database.
+
+File layout: 8-byte magic, 8-byte header length, a JSON header, then one
+8-byte aligned block per column. Numbers are stored as native typed arrays,
+strings as integer codes into a per-column dictionary kept in the header.
+Rows are sorted by start day, so a date range is two bisects.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+
+from database import db, epoch_day
+
+MAGIC = b'CRCOLS1\0'
+
+# Missing numbers: the smallest value of the type (floats use NaN)
+NULL_INT = {'i': -2 ** 31, 'q': -2 ** 63}
+
+# column -> (SQL expression, storage: typecode or 'str' for dictionary-encoded)
+COLUMNS = {
+    'rental_id': ('r.id', 'q'),
+    'start_day': ('r.start_day', 'i'),
+    'end_day': ('r.end_day', 'i'),
+    'return_day': ('r.return_day', 'i'),
+    'total_amount': ('r.total_amount', 'd'),
+    'status': ('r.status', 'str'),
+    'customer_id': ('r.customer_id', 'q'),
+    'vehicle_id': ('r.vehicle_id', 'q'),
+    'vehicle_type': ('v.vehicle_type', 'str'),
+    'make': ('v.make', 'str'),
+    'model': ('v.model', 'str'),
+    'daily_rate': ('v.daily_rate', 'd'),
+    'location_id': ('v.location_id', 'q'),
+    'city': ('l.city', 'str'),
+    'location': ('l.name', 'str'),
+}
+
+def _code_type(size):
+    return 'B' if size <= 0xFF else 'H' if size <= 0xFFFF else 'I'
+
+def export_snapshot(path, batch_size=5000):
+    """Write every rental (with vehicle and branch columns) to ``path``; returns the row count"""
+    values = {name: array('q' if storage == 'str' else storage) for name, (_, storage) in COLUMNS.items()}
+    dictionaries = {name: {} for name, (_, storage) in COLUMNS.items() if storage == 'str'}
+    query = f"""
+        SELECT {', '.join(f'{sql} AS {name}' for name, (sql, _) in COLUMNS.items())}
+        FROM rentals r
+        LEFT JOIN vehicles v ON v.id = r.vehicle_id
+        LEFT JOIN locations l ON l.id = v.location_id
+        ORDER BY r.start_day, r.id
+    """
+    rows = 0
+    for row in db.iter_rows(query, batch_size=batch_size):
+        rows += 1
+        for name, (_, storage) in COLUMNS.items():
+            value = row[name]
+            if storage == 'str':
+                codes = dictionaries[name]
+                values[name].append(codes.setdefault(value, len(codes)))
+            elif value is None:
+                values[name].append(float('nan') if storage == 'd' else NULL_INT[storage])
+            else:
+                values[name].append(value)
+
+    header = {'rows': rows, 'byteorder': sys.byteorder, 'exported_at': date.today().isoformat(), 'columns': {}}
+    blocks = []
+    for name, (_, storage) in COLUMNS.items():
+        column = values[name]
+        if storage == 'str':
+            dictionary = list(dictionaries[name])
+            column = array(_code_type(len(dictionary)), column)
+            header['columns'][name] = {'type': column.typecode, 'dictionary': dictionary}
+        else:
+            header['columns'][name] = {'type': storage}
+        blocks.append((name, column.tobytes()))
+
+    # Offsets count from the end of the header, so the header can carry them
+    offset = 0
+    for name, data in blocks:
+        header['columns'][name]['offset'] = offset
+        offset += len(data) + (-len(data)) % 8
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    encoded += b' ' * ((-len(encoded)) % 8)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+        for _, data in blocks:
+            f.write(data + b'\0' * ((-len(data)) % 8))
+    os.replace(temporary, path)
+    return rows
+
+class ColumnarSnapshot:
+    """A snapshot file opened read-only through mmap; columns are zero-copy memoryviews.
+
+    Views support indexing, slicing, ``len`` and iteration like lists, and
+    can be wrapped without copying by anything that takes a buffer
+    (e.g. ``numpy.frombuffer``). Close the snapshot (or use ``with``) once
+    the views are no longer needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:8] != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a rental history snapshot")
+        (length,) = struct.unpack('<Q', self.map[8:16])
+        self.header = json.loads(self.map[16:16 + length])
+        if self.header['byteorder'] != sys.byteorder:
+            self.map.close()
+            raise ValueError(f"{path} was written on a {self.header['byteorder']}-endian machine")
+        self.data_start = 16 + length
+        self.rows = self.header['rows']
+        self.views = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for view in self.views.values():
+            view.release()
+        self.views.clear()
+        self.map.close()
+
+    def column(self, name):
+        """Typed view over one column (dictionary codes for string columns)"""
+        if name not in self.views:
+            meta = self.header['columns'][name]
+            start = self.data_start + meta['offset']
+            size = struct.calcsize(meta['type']) * self.rows
+            self.views[name] = memoryview(self.map)[start:start + size].cast(meta['type'])
+        return self.views[name]
+
+    def dictionary(self, name):
+        """Values of a dictionary-encoded column, indexed by code"""
+        return self.header['columns'][name]['dictionary']
+
+    def decode(self, name, index):
+        return self.dictionary(name)[self.column(name)[index]]
+
+    def start_range(self, start_date, end_date):
+        """``(first, last)`` row indices of rentals starting between two dates (inclusive)"""
+        starts = self.column('start_day')
+        return bisect_left(starts, epoch_day(start_date)), bisect_right(starts, epoch_day(end_date))
+
+def history_summary(snapshot, start_date, end_date, by='city'):
+    """Rentals, rental days and revenue per ``by`` value for rentals starting between two dates.
+
+    Cancelled rentals are left out. Scans only the matching slice of the
+    columns involved; strings are compared as integer codes and decoded
+    once per group at the end.
+    """
+    first, last = snapshot.start_range(start_date, end_date)
+    statuses = snapshot.dictionary('status')
+    cancelled = statuses.index('cancelled') if 'cancelled' in statuses else -1
+    encoded = snapshot.header['columns'][by].get('dictionary') is not None
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    for key, status, start, end, amount in zip(
+            snapshot.column(by)[first:last], snapshot.column('status')[first:last],
+            snapshot.column('start_day')[first:last], snapshot.column('end_day')[first:last],
+            snapshot.column('total_amount')[first:last]):
+        if status == cancelled:
+            continue
+        group = totals[key]
+        group[0] += 1
+        group[1] += max(end - start, 1)
+        if amount == amount:  # not NaN
+            group[2] += amount
+
+    dictionary = snapshot.dictionary(by) if encoded else None
+    summary = [{
+        by: dictionary[key] if encoded else key,
+        'rentals': rentals,
+        'rental_days': days,
+        'revenue': round(revenue, 2),
+        'revenue_per_day': round(revenue / days, 2) if days else 0.0,
+    } for key, (rentals, days, revenue) in totals.items()]
+    return sorted(summary, key=lambda group: group['revenue'], reverse=True)
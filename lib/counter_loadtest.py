@@ -0,0 +1,206 @@
+"""
+Load test for the branch counters - worker processes replaying a mix of
+searches, walk-in bookings, returns and reports through CarRentalORM against
+a seeded copy of the database, reporting throughput, latency percentiles,
+lock-wait errors and double bookings.
+
+Each worker is a separate process with its own connections, as each counter
+is in production, so SQLite locking is exercised for real. The copy lives
+in a temporary file and is deleted afterwards; the live database is never
+written to.
+"""
+
+import json
+import multiprocessing
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from database import db, Database
+from fixtures import DatabaseTemplate, seed_sample_data
+from models.orm import CarRentalORM
+
+VEHICLE_TYPES = ('sedan', 'SUV', 'hatchback', 'minivan', 'pickup', 'luxury')
+
+# Weighted mix of counter operations
+DEFAULT_MIX = [
+    ('search', 6),
+    ('book', 3),
+    ('return', 2),
+    ('report', 1),
+]
+
+def seed_counter_data(vehicles=200, customers=2000, seed=42):
+    """Sample branches plus an insured synthetic fleet and customer base"""
+    seed_sample_data()
+    rng = random.Random(seed)
+    today = date.today()
+    location_ids = [row['id'] for row in db.fetch_all("SELECT id FROM locations")]
+    db.bulk_copy('vehicles', ('make', 'model', 'year', 'license_plate', 'vehicle_type', 'daily_rate', 'location_id'), [
+        ('Toyota', 'Load', rng.randint(2018, 2024), f'LOAD{i:06d}', rng.choice(VEHICLE_TYPES),
+         rng.randint(20, 80) * 100, rng.choice(location_ids))
+        for i in range(vehicles)])
+    vehicle_ids = [row['id'] for row in db.fetch_all("SELECT id FROM vehicles")]
+    db.bulk_copy('insurance', ('vehicle_id', 'provider', 'policy_number', 'coverage_type', 'premium', 'start_date', 'end_date', 'deductible'), [
+        (vehicle_id, 'Load Assurance', f'LOAD-{vehicle_id:06d}', 'comprehensive', 50000,
+         (today - timedelta(days=30)).isoformat(), (today + timedelta(days=365)).isoformat(), 10000)
+        for vehicle_id in vehicle_ids])
+    db.bulk_copy('customers', ('first_name', 'last_name', 'email', 'phone', 'license_number'), [
+        ('Load', f'Customer{i}', f'load{i}@example.com', f'07{i:08d}', f'LOAD{i:08d}')
+        for i in range(customers)])
+
+def _search(rng, customer_ids):
+    CarRentalORM.find_vehicles_by_type(rng.choice(VEHICLE_TYPES))
+
+def _book(rng, customer_ids):
+    # A walk-in: pick a vehicle the counter sees as free and rent it from today
+    vehicles = CarRentalORM.find_available_vehicles()
+    if not vehicles:
+        raise ValueError("No vehicles available!")
+    vehicle = rng.choice(vehicles)
+    today = date.today()
+    end = today + timedelta(days=rng.randint(1, 7))
+    CarRentalORM.book_rental(rng.choice(customer_ids), vehicle['id'], today.isoformat(), end.isoformat())
+
+def _return(rng, customer_ids):
+    rentals = CarRentalORM.find_active_rentals()
+    if not rentals:
+        raise ValueError("No active rentals!")
+    CarRentalORM.return_rental(rng.choice(rentals)['id'])
+
+def _report(rng, customer_ids):
+    rng.choice((CarRentalORM.get_revenue_report, CarRentalORM.get_utilization_report))()
+
+OPERATIONS = {'search': _search, 'book': _book, 'return': _return, 'report': _report}
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def _worker(seed, mix, duration, barrier, results):
+    """One counter: replay the mix until ``duration`` runs out, then report per-operation outcomes.
+
+    Runs in a spawned process whose ``db`` already points at the copy
+    (CAR_RENTAL_DATABASE_URL). Read helpers log and swallow database
+    errors, so lock waits are only counted where they reach the caller.
+    """
+    rng = random.Random(seed)
+    names, weights = zip(*mix)
+    customer_ids = [row['id'] for row in db.fetch_all("SELECT id FROM customers")]
+    stats = {name: {'ok': 0, 'rejected': 0, 'lock_errors': 0, 'errors': 0, 'latencies': []} for name in names}
+    barrier.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        entry = stats[name]
+        started = time.perf_counter()
+        try:
+            OPERATIONS[name](rng, customer_ids)
+            entry['ok'] += 1
+        except ValueError:
+            entry['rejected'] += 1
+        except db.backend.Error as e:
+            entry['lock_errors' if _is_lock_error(e) else 'errors'] += 1
+        entry['latencies'].append(time.perf_counter() - started)
+    results.put(stats)
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def count_double_bookings(database, after_id=0):
+    """Pairs of overlapping, uncancelled rentals of one vehicle where the later one has an ID above ``after_id``"""
+    conn = database.get_connection()
+    try:
+        return database.execute(conn, """
+            SELECT COUNT(*) FROM rentals a
+            JOIN rentals b ON b.vehicle_id = a.vehicle_id AND b.id > a.id
+            WHERE b.id > ? AND a.status != 'cancelled' AND b.status != 'cancelled'
+              AND a.start_day < COALESCE(b.return_day, b.end_day)
+              AND b.start_day < COALESCE(a.return_day, a.end_day)
+        """, (after_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def _summarise(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'operations': len(latencies),
+        'per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def run_counter_load_test(workers=8, duration=10.0, database=None, vehicles=200, customers=2000, mix=None, seed=0):
+    """Run ``workers`` counter processes for ``duration`` seconds and summarise the outcome.
+
+    The seeded copy is ``database`` (a SQLite file) when given, otherwise
+    the sample data plus ``vehicles`` insured vehicles and ``customers``
+    customers.
+    """
+    mix = mix or DEFAULT_MIX
+    if database:
+        copy = Database(database, initialize=False).clone(temporary=True)
+    else:
+        template = DatabaseTemplate(seed=lambda: seed_counter_data(vehicles, customers, seed))
+        copy = template.clone(temporary=True)
+        template.database.close()
+
+    try:
+        conn = copy.get_connection()
+        try:
+            first_id = copy.execute(conn, "SELECT COALESCE(MAX(id), 0) FROM rentals").fetchone()[0]
+        finally:
+            conn.close()
+
+        # Spawned workers import ``database`` afresh, so the URL decides which file their ``db`` opens
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(workers + 1)
+        results = context.Queue()
+        saved_url = os.environ.get('CAR_RENTAL_DATABASE_URL')
+        os.environ['CAR_RENTAL_DATABASE_URL'] = copy.db_name
+        try:
+            processes = [
+                context.Process(target=_worker, args=(seed * 1000 + index, mix, duration, barrier, results))
+                for index in range(workers)
+            ]
+            for process in processes:
+                process.start()
+        finally:
+            if saved_url is None:
+                del os.environ['CAR_RENTAL_DATABASE_URL']
+            else:
+                os.environ['CAR_RENTAL_DATABASE_URL'] = saved_url
+
+        barrier.wait(timeout=120)
+        started = time.perf_counter()
+        collected = [results.get(timeout=duration + 120) for _ in processes]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+        operations, latencies = {}, []
+        for name, _ in mix:
+            entries = [stats[name] for stats in collected]
+            values = [value for entry in entries for value in entry['latencies']]
+            latencies.extend(values)
+            operations[name] = {
+                **_summarise(values, elapsed),
+                **{key: sum(entry[key] for entry in entries) for key in ('ok', 'rejected', 'lock_errors', 'errors')},
+            }
+        return {
+            'workers': workers,
+            'elapsed_seconds': round(elapsed, 3),
+            **_summarise(latencies, elapsed),
+            'lock_errors': sum(op['lock_errors'] for op in operations.values()),
+            'errors': sum(op['errors'] for op in operations.values()),
+            'double_bookings': count_double_bookings(copy, first_id),
+            'by_operation': operations,
+        }
+    finally:
+        copy.close()
+
+if __name__ == '__main__':
+    print(json.dumps(run_counter_load_test(), indent=2))
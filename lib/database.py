@@ -1,26 +1,216 @@
+import itertools
+import os
+import queue
 import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import click
+from backends import SQLiteBackend, backend_from_url
+from metrics import metrics
+
+# Integer day number of a TEXT date/timestamp: days since 1970-01-01
+EPOCH_DAY_SQL = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+# TEXT date column -> integer day column, per table
+EPOCH_DAY_COLUMNS = {
+    'rentals': {'start_date': 'start_day', 'end_date': 'end_day', 'actual_return_date': 'return_day'},
+    'maintenance_records': {'maintenance_date': 'maintenance_day', 'next_maintenance_date': 'next_maintenance_day'},
+    'insurance': {'start_date': 'start_day', 'end_date': 'end_day'},
+}
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+# Tables replicated to offline branch terminals (sync.py), parents before children
+SYNCED_TABLES = ('locations', 'vehicles', 'customers', 'rentals', 'maintenance_records', 'insurance')
+
+# Columns every database derives for itself (triggers), so they are never synced
+DERIVED_COLUMNS = {
+    'vehicles': ('status',),
+    **{table: tuple(columns.values()) for table, columns in EPOCH_DAY_COLUMNS.items()},
+}
+
+# Database name for a private in-memory database
+MEMORY = ':memory:'
+
+def epoch_day(value=None):
+    """Day number (days since 1970-01-01) of a date, 'YYYY-MM-DD' string or today"""
+    if value is None:
+        value = datetime.now().date()
+    elif isinstance(value, str):
+        value = datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value.toordinal() - EPOCH_ORDINAL
+
+class PooledConnection:
+    """Connection lent out by a ConnectionPool; ``close()`` hands it back instead of closing it"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __del__(self):
+        self.close()
+
+class ConnectionPool:
+    """A bounded set of open connections shared by worker threads"""
+
+    def __init__(self, connect, size=8):
+        self.connect = connect
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """Borrow an idle connection (opening one if needed), waiting while all are in use"""
+        self.slots.acquire()
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self.connect()
+            except Exception:
+                self.slots.release()
+                raise
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            # Never hand on a half-finished transaction
+            conn.rollback()
+            self.idle.put(conn)
+        except Exception:
+            conn.close()
+        finally:
+            self.slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
 
 class Database:
-    def __init__(self, db_name='car_rental.db'):
-        self.db_name = db_name
-        self.init_database()
+    _memory_names = itertools.count(1)
+    
+    def __init__(self, db_name='car_rental.db', backend=None, initialize=True):
+        self.backend = backend or SQLiteBackend()
+        self.read_only = False
+        self.workload = None
+        self.pool = None
+        self.anchor = None
+        self.owned_file = None
+        self.db_name = self._resolve_name(db_name)
+        if initialize:
+            self.init_database()
+    
+    def _resolve_name(self, db_name):
+        if db_name != MEMORY or self.backend.name != 'sqlite':
+            return db_name
+        # Every connection to a named shared-cache database sees the same data,
+        # which lives as long as one connection to it stays open
+        name = f"file:car_rental_{os.getpid()}_{next(self._memory_names)}?mode=memory&cache=shared"
+        self.anchor = self.backend.connect(name, shared=True)
+        return name
+    
+    @classmethod
+    def temporary(cls, initialize=True):
+        """A throwaway database in a temporary file, deleted again by ``close()``"""
+        handle, path = tempfile.mkstemp(prefix='car_rental_', suffix='.db')
+        os.close(handle)
+        database = cls(path, initialize=initialize)
+        database.owned_file = path
+        return database
+    
+    def clone(self, temporary=False):
+        """Copy this database into a new in-memory (or temporary file) one with the SQLite backup API"""
+        self.require_sqlite("Cloning")
+        copy = Database.temporary(initialize=False) if temporary else Database(MEMORY, initialize=False)
+        source = self.get_connection()
+        target = copy.anchor or copy.get_connection()
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            if target is not copy.anchor:
+                target.close()
+        return copy
+    
+    def close(self):
+        """Close pooled connections, drop an in-memory database and delete an owned temporary file"""
+        self.close_pool()
+        if self.anchor is not None:
+            self.anchor.close()
+            self.anchor = None
+        if self.owned_file is not None:
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                if os.path.exists(self.owned_file + suffix):
+                    os.remove(self.owned_file + suffix)
+            self.owned_file = None
+    
+    @contextmanager
+    def redirect(self, other):
+        """Serve every query from ``other`` (another Database) inside the block.
+        
+        Module code shares the global ``db``, so this is how a whole command
+        or test runs against a copy without touching the live file.
+        """
+        saved = (self.db_name, self.backend, self.read_only, self.pool)
+        self.db_name, self.backend, self.read_only, self.pool = other.db_name, other.backend, False, None
+        try:
+            yield self
+        finally:
+            self.close_pool()
+            self.db_name, self.backend, self.read_only, self.pool = saved
+    
+    def require_sqlite(self, feature):
+        """Refuse ``feature`` on server backends, which only run the ORM's plain queries (see backends.py)"""
+        if self.backend.name != 'sqlite':
+            raise ValueError(f"{feature} is only available for the SQLite backend")
+    
+    def use_pool(self, size=8):
+        """Reuse up to ``size`` open connections instead of opening one per call (for long-running servers)"""
+        self.close_pool()
+        self.pool = ConnectionPool(
+            lambda: self.backend.connect(self.db_name, read_only=self.read_only, shared=True), size)
+        return self.pool
+    
+    def close_pool(self):
+        """Close pooled connections and go back to a connection per call"""
+        if self.pool is not None:
+            self.pool.close_all()
+            self.pool = None
+    
+    def open_read_only(self, db_name=None):
+        """Point this instance at an existing database and open it read-only from now on"""
+        self.db_name = db_name or self.db_name
+        self.read_only = True
     
     def get_connection(self):
         """Get database connection with proper error handling"""
         try:
-            conn = sqlite3.connect(self.db_name)
-            conn.row_factory = sqlite3.Row
-            # Enable foreign keys
-            conn.execute("PRAGMA foreign_keys = ON")
-            return conn
-        except sqlite3.Error as e:
-            click.echo(f"Database connection error: {e}")
+            with metrics.timer('db_connect'):
+                if self.pool is not None:
+                    return self.pool.acquire()
+                return self.backend.connect(self.db_name, read_only=self.read_only)
+        except self.backend.Error as e:
+            click.echo(f"Database connection error: {e}", err=True)
             raise
     
     def init_database(self):
         """Initialize database tables with better constraints"""
+        if not self.backend.manages_schema:
+            # Server databases are provisioned separately; the SQLite DDL below is the reference schema
+            return
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -51,6 +241,7 @@ class Database:
                     vehicle_type TEXT CHECK(vehicle_type IN ('sedan', 'SUV', 'hatchback', 'minivan', 'pickup', 'luxury')),
                     daily_rate REAL NOT NULL CHECK (daily_rate > 0),
                     available BOOLEAN DEFAULT 1,
+                    status TEXT NOT NULL DEFAULT 'available' CHECK (status IN ('available', 'reserved', 'rented', 'maintenance')),
                     location_id INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (location_id) REFERENCES locations (id) ON DELETE SET NULL
@@ -122,27 +313,494 @@ class Database:
                 )
             ''')
             
+            # Vehicle telematics: one compact row per (vehicle, millisecond), written by telemetry.py
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS vehicle_telemetry (
+                    vehicle_id INTEGER NOT NULL,
+                    recorded_ms INTEGER NOT NULL,
+                    odometer_km REAL,
+                    fuel_pct REAL,
+                    lat REAL,
+                    lon REAL,
+                    PRIMARY KEY (vehicle_id, recorded_ms),
+                    FOREIGN KEY (vehicle_id) REFERENCES vehicles (id) ON DELETE CASCADE
+                ) WITHOUT ROWID
+            ''')
+            
+            # Rental event log (append-only history of rental state changes)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rental_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rental_id INTEGER NOT NULL,
+                    vehicle_id INTEGER NOT NULL,
+                    customer_id INTEGER NOT NULL,
+                    event_type TEXT NOT NULL CHECK (event_type IN ('reserved', 'picked_up', 'returned', 'cancelled', 'extended')),
+                    event_date TEXT NOT NULL,
+                    start_date TEXT,
+                    end_date TEXT,
+                    total_amount REAL,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_rental_events_date ON rental_events (event_date, rental_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_rental_events_rental ON rental_events (rental_id, id)')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS rental_events_no_update
+                BEFORE UPDATE ON rental_events
+                BEGIN
+                    SELECT RAISE(ABORT, 'rental_events is append-only');
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS rental_events_no_delete
+                BEFORE DELETE ON rental_events
+                BEGIN
+                    SELECT RAISE(ABORT, 'rental_events is append-only');
+                END
+            ''')
+
+            # Document content, stored once per SHA-256 and streamed in chunks by documents.py
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS document_blobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sha256 TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL CHECK (size >= 0),
+                    content BLOB NOT NULL
+                )
+            ''')
+
+            # License scans and inspection photos attached to a customer, vehicle or rental
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner_type TEXT NOT NULL CHECK (owner_type IN ('customer', 'vehicle', 'rental')),
+                    owner_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL CHECK (kind IN ('license_scan', 'pickup_inspection', 'return_inspection', 'damage_photo', 'other')),
+                    filename TEXT NOT NULL,
+                    content_type TEXT,
+                    blob_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (blob_id) REFERENCES document_blobs (id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_owner ON documents (owner_type, owner_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_blob ON documents (blob_id)')
+
+            # Per-customer history, customer merges and the cascade check when a customer is deleted
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_customer ON rentals (customer_id)')
+            self._backfill_rental_events(cursor)
+            self._create_vehicle_status_triggers(cursor)
+            self._create_epoch_day_columns(cursor)
+            # Set when next_maintenance_date was predicted by the usage forecaster (models.forecast)
+            self._ensure_column(cursor, 'maintenance_records', 'forecast', 'INTEGER NOT NULL DEFAULT 0')
+            self._create_location_index(cursor)
+            self._create_change_log(cursor)
+            self._create_customer_stats(cursor)
+            
             conn.commit()
-            click.echo("Database initialized successfully!")
+            click.echo("Database initialized successfully!", err=True)
             
         except sqlite3.Error as e:
-            click.echo(f"Database initialization error: {e}")
+            click.echo(f"Database initialization error: {e}", err=True)
             conn.rollback()
             raise
         finally:
             conn.close()
     
+    def _backfill_rental_events(self, cursor):
+        """Seed the event log for rentals recorded before it existed"""
+        history = [
+            # (order, event type, event date, statuses that imply the event happened)
+            (1, 'reserved', 'date(created_at)', "('reserved', 'active', 'completed', 'cancelled')"),
+            (2, 'picked_up', 'start_date', "('active', 'completed')"),
+            (3, 'returned', 'COALESCE(actual_return_date, end_date)', "('completed')"),
+            (4, 'cancelled', 'date(created_at)', "('cancelled')"),
+        ]
+        selects = ' UNION ALL '.join(f'''
+            SELECT id, vehicle_id, customer_id, '{event_type}' AS event_type, {event_date} AS event_date,
+                   start_date, end_date, total_amount, {order} AS seq
+            FROM rentals
+            WHERE status IN {statuses} AND id NOT IN (SELECT rental_id FROM rental_events)
+        ''' for order, event_type, event_date, statuses in history)
+        cursor.execute(f'''
+            INSERT INTO rental_events
+                (rental_id, vehicle_id, customer_id, event_type, event_date, start_date, end_date, total_amount)
+            SELECT id, vehicle_id, customer_id, event_type, event_date, start_date, end_date, total_amount
+            FROM ({selects})
+            ORDER BY id, seq
+        ''')
+    
+    @staticmethod
+    def _ensure_column(cursor, table, column, definition):
+        """Add a column to an existing table if it is missing; returns True when added"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column in [row[1] for row in cursor.fetchall()]:
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    
+    def _create_epoch_day_columns(self, cursor):
+        """Mirror TEXT dates into indexed integer day numbers (days since 1970-01-01)"""
+        for table, columns in EPOCH_DAY_COLUMNS.items():
+            added = [self._ensure_column(cursor, table, day_column, 'INTEGER')
+                     for day_column in columns.values()]
+            
+            assignments = ', '.join(
+                f"{day_column} = {EPOCH_DAY_SQL.format(f'NEW.{date_column}')}"
+                for date_column, day_column in columns.items()
+            )
+            date_columns = ', '.join(columns)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_epoch_days_insert AFTER INSERT ON {table}
+                BEGIN UPDATE {table} SET {assignments} WHERE id = NEW.id; END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_epoch_days_update AFTER UPDATE OF {date_columns} ON {table}
+                BEGIN UPDATE {table} SET {assignments} WHERE id = NEW.id; END
+            ''')
+            
+            if any(added):
+                backfill = ', '.join(
+                    f"{day_column} = {EPOCH_DAY_SQL.format(date_column)}"
+                    for date_column, day_column in columns.items()
+                )
+                cursor.execute(f"UPDATE {table} SET {backfill}")
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_status_end_day ON rentals (status, end_day)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_vehicle_days ON rentals (vehicle_id, start_day, end_day)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_next_day ON maintenance_records (next_maintenance_day)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_insurance_end_day ON insurance (end_day)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_insurance_vehicle_days ON insurance (vehicle_id, start_day, end_day)')
+    
+    def _create_location_index(self, cursor):
+        """Branch coordinates plus an R*Tree over them, kept in step by triggers"""
+        self._ensure_column(cursor, 'locations', 'lat', 'REAL')
+        self._ensure_column(cursor, 'locations', 'lon', 'REAL')
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+        except sqlite3.OperationalError:
+            # SQLite built without R*Tree: nearest-branch search scans this index instead
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_locations_lat_lon ON locations (lat, lon)')
+            return
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_rtree_insert
+            AFTER INSERT ON locations WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+            BEGIN
+                INSERT INTO locations_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_rtree_update
+            AFTER UPDATE OF lat, lon ON locations
+            BEGIN
+                DELETE FROM locations_rtree WHERE id = OLD.id;
+                INSERT INTO locations_rtree SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+                WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS locations_rtree_delete
+            AFTER DELETE ON locations
+            BEGIN
+                DELETE FROM locations_rtree WHERE id = OLD.id;
+            END
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO locations_rtree
+            SELECT id, lat, lat, lon, lon FROM locations WHERE lat IS NOT NULL AND lon IS NOT NULL
+        ''')
+    
+    def _create_change_log(self, cursor):
+        """Change log for branch sync: triggers record which synced rows were written.
+        
+        Nothing is logged until the database takes part in sync (a ``role``
+        in sync_state); ``origin`` tags changes applied on behalf of a peer.
+        """
+        cursor.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+                origin TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id, seq)')
+        # Terminals keep only the central event log (copied in with origin 'central'); their own events are dropped
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS rental_events_terminal_copy
+            BEFORE INSERT ON rental_events
+            WHEN (SELECT value FROM sync_state WHERE key = 'role') = 'terminal'
+             AND (SELECT value FROM sync_state WHERE key = 'origin') IS NOT 'central'
+            BEGIN
+                SELECT RAISE(IGNORE);
+            END
+        ''')
+        # Central side: how far each terminal has pulled, and the IDs given to its offline rows
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                terminal TEXT PRIMARY KEY,
+                pulled_seq INTEGER NOT NULL DEFAULT 0,
+                last_sync TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_id_map (
+                terminal TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                local_id INTEGER NOT NULL,
+                central_id INTEGER NOT NULL,
+                PRIMARY KEY (terminal, table_name, local_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        for table in SYNCED_TABLES:
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [row[1] for row in cursor.fetchall() if row[1] not in DERIVED_COLUMNS.get(table, ())]
+            # Updates that only touch derived columns are not changes worth syncing
+            events = [('insert', 'INSERT', 'NEW', 'upsert'),
+                      ('update', f"UPDATE OF {', '.join(columns)}", 'NEW', 'upsert'),
+                      ('delete', 'DELETE', 'OLD', 'delete')]
+            for suffix, event, ref, op in events:
+                name = f"{table}_change_log_{suffix}"
+                sql = (f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+                       f"WHEN EXISTS (SELECT 1 FROM sync_state WHERE key = 'role') "
+                       f"BEGIN INSERT INTO change_log (table_name, row_id, op, origin) "
+                       f"VALUES ('{table}', {ref}.id, '{op}', (SELECT value FROM sync_state WHERE key = 'origin')); END")
+                # Recreated only when the column list changed (e.g. a column was added)
+                cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+                existing = cursor.fetchone()
+                if existing is None or existing[0] != sql:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    cursor.execute(sql)
+
+    @staticmethod
+    def _rental_contribution(ref):
+        """(rentals, spend, late returns, start date) one rental adds to its customer's stats"""
+        counted = f"{ref}.status != 'cancelled'"
+        return (
+            f"(CASE WHEN {counted} THEN 1 ELSE 0 END)",
+            f"(CASE WHEN {counted} THEN COALESCE({ref}.total_amount, 0) ELSE 0 END)",
+            f"(CASE WHEN {counted} AND date({ref}.actual_return_date) > date({ref}.end_date) THEN 1 ELSE 0 END)",
+            f"(CASE WHEN {counted} THEN {ref}.start_date END)",
+        )
+
+    def _create_customer_stats(self, cursor):
+        """Per-customer rental aggregates, adjusted by triggers in the same transaction as each rental write.
+
+        ``needs_tiering`` marks customers whose figures changed since the
+        loyalty tiers (models.loyalty) were last evaluated.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_stats'")
+        created = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_stats (
+                customer_id INTEGER PRIMARY KEY,
+                rentals INTEGER NOT NULL DEFAULT 0,
+                total_spend REAL NOT NULL DEFAULT 0,
+                late_returns INTEGER NOT NULL DEFAULT 0,
+                last_rental_date TEXT,
+                tier TEXT NOT NULL DEFAULT 'standard',
+                needs_tiering INTEGER NOT NULL DEFAULT 1,
+                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_stats_pending ON customer_stats (customer_id) WHERE needs_tiering = 1')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_stats_tier ON customer_stats (tier, last_rental_date)')
+
+        rentals, spend, late, start = self._rental_contribution('NEW')
+        add = f'''
+            INSERT INTO customer_stats (customer_id, rentals, total_spend, late_returns, last_rental_date, needs_tiering)
+            VALUES (NEW.customer_id, {rentals}, {spend}, {late}, {start}, 1)
+            ON CONFLICT (customer_id) DO UPDATE SET
+                rentals = rentals + excluded.rentals,
+                total_spend = total_spend + excluded.total_spend,
+                late_returns = late_returns + excluded.late_returns,
+                last_rental_date = CASE WHEN excluded.last_rental_date > COALESCE(last_rental_date, '')
+                                        THEN excluded.last_rental_date ELSE last_rental_date END,
+                needs_tiering = 1;
+        '''
+        rentals, spend, late, start = self._rental_contribution('OLD')
+        # The latest start date cannot be decremented; look it up again only when this rental held it
+        subtract = f'''
+            UPDATE customer_stats SET
+                rentals = rentals - {rentals},
+                total_spend = total_spend - {spend},
+                late_returns = late_returns - {late},
+                last_rental_date = CASE WHEN {start} = last_rental_date THEN (
+                    SELECT MAX(start_date) FROM rentals WHERE customer_id = OLD.customer_id AND status != 'cancelled'
+                ) ELSE last_rental_date END,
+                needs_tiering = 1
+            WHERE customer_id = OLD.customer_id;
+        '''
+        triggers = [
+            ('rentals_customer_stats_insert', 'AFTER INSERT ON rentals', add),
+            ('rentals_customer_stats_update',
+             'AFTER UPDATE OF customer_id, status, total_amount, start_date, end_date, actual_return_date ON rentals',
+             subtract + add),
+            # Rentals moved to the archive (housekeeping) stay part of the lifetime figures
+            ('rentals_customer_stats_delete',
+             "AFTER DELETE ON rentals WHEN NOT EXISTS (SELECT 1 FROM sync_state WHERE key = 'archiving')",
+             subtract),
+            # A VIP flag set by hand is checked against the tier on the next run
+            ('customers_vip_changed', 'AFTER UPDATE OF is_vip ON customers', '''
+                INSERT INTO customer_stats (customer_id) VALUES (NEW.id)
+                ON CONFLICT (customer_id) DO UPDATE SET needs_tiering = 1;
+            '''),
+        ]
+        for name, event, body in triggers:
+            sql = f'CREATE TRIGGER {name} {event} BEGIN {body} END'
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+            existing = cursor.fetchone()
+            if existing is None or existing[0] != sql:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+                cursor.execute(sql)
+
+        if created:
+            self.backfill_customer_stats(cursor)
+
+    def backfill_customer_stats(self, cursor, archived=False):
+        """Recompute every customer's stats from rentals (keeping tiers, flagging everyone for tiering).
+
+        With ``archived``, rentals in an attached ``archive`` database count too.
+        """
+        rentals, spend, late, start = self._rental_contribution('r')
+        source = 'rentals'
+        if archived:
+            columns = 'customer_id, status, total_amount, start_date, end_date, actual_return_date'
+            source = f'(SELECT {columns} FROM main.rentals UNION ALL SELECT {columns} FROM archive.rentals)'
+        cursor.execute('''
+            UPDATE customer_stats SET rentals = 0, total_spend = 0, late_returns = 0,
+                                      last_rental_date = NULL, needs_tiering = 1
+        ''')
+        cursor.execute(f'''
+            INSERT INTO customer_stats (customer_id, rentals, total_spend, late_returns, last_rental_date)
+            SELECT customer_id, SUM({rentals}), SUM({spend}), SUM({late}), MAX({start})
+            FROM {source} r WHERE true GROUP BY customer_id
+            ON CONFLICT (customer_id) DO UPDATE SET
+                rentals = excluded.rentals, total_spend = excluded.total_spend,
+                late_returns = excluded.late_returns, last_rental_date = excluded.last_rental_date
+        ''')
+    
+    def _create_vehicle_status_triggers(self, cursor):
+        """Keep vehicles.status in step with rentals, maintenance and the in-service flag"""
+        added = self._ensure_column(cursor, 'vehicles', 'status', '''
+            TEXT NOT NULL DEFAULT 'available'
+            CHECK (status IN ('available', 'reserved', 'rented', 'maintenance'))
+        ''')
+        
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rentals_vehicle_status ON rentals (vehicle_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_vehicle_status ON maintenance_records (vehicle_id, status)')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicles_available_type ON vehicles (vehicle_type) WHERE status = 'available'")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicles_available_location ON vehicles (location_id) WHERE status = 'available'")
+        
+        triggers = [
+            # (trigger name, event, vehicle id references to refresh)
+            ('rentals_status_insert', 'AFTER INSERT ON rentals', ['NEW.vehicle_id']),
+            ('rentals_status_update', 'AFTER UPDATE OF status, vehicle_id ON rentals', ['NEW.vehicle_id', 'OLD.vehicle_id']),
+            ('rentals_status_delete', 'AFTER DELETE ON rentals', ['OLD.vehicle_id']),
+            ('maintenance_status_insert', 'AFTER INSERT ON maintenance_records', ['NEW.vehicle_id']),
+            ('maintenance_status_update', 'AFTER UPDATE OF status, vehicle_id ON maintenance_records', ['NEW.vehicle_id', 'OLD.vehicle_id']),
+            ('maintenance_status_delete', 'AFTER DELETE ON maintenance_records', ['OLD.vehicle_id']),
+            ('vehicles_in_service_insert', 'AFTER INSERT ON vehicles', ['NEW.id']),
+            ('vehicles_in_service_update', 'AFTER UPDATE OF available ON vehicles', ['NEW.id']),
+        ]
+        for name, event, vehicle_refs in triggers:
+            body = ' '.join(self._vehicle_status_update(ref) + ';' for ref in dict.fromkeys(vehicle_refs))
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+        
+        if added:
+            cursor.execute(self._vehicle_status_update('vehicles.id', all_vehicles=True))
+    
+    @staticmethod
+    def _vehicle_status_update(vehicle_ref, all_vehicles=False):
+        """UPDATE statement deriving a vehicle's status: rented > reserved > maintenance > available"""
+        where = '' if all_vehicles else f'WHERE id = {vehicle_ref}'
+        return f'''
+            UPDATE vehicles SET status = CASE
+                WHEN EXISTS (SELECT 1 FROM rentals WHERE vehicle_id = {vehicle_ref} AND status = 'active') THEN 'rented'
+                WHEN EXISTS (SELECT 1 FROM rentals WHERE vehicle_id = {vehicle_ref} AND status = 'reserved') THEN 'reserved'
+                WHEN available = 0 THEN 'maintenance'
+                WHEN EXISTS (SELECT 1 FROM maintenance_records WHERE vehicle_id = {vehicle_ref} AND status = 'in-progress') THEN 'maintenance'
+                ELSE 'available'
+            END
+            {where}
+        '''
+    
+    @contextmanager
+    def transaction(self, conn=None, immediate=False):
+        """Run several statements as one unit of work.
+        
+        Reuses ``conn`` when the caller already holds a transaction, otherwise
+        opens a connection that is committed on success and rolled back on error.
+        With ``immediate`` the write lock is taken up front, for checks that
+        must still hold when the transaction's own writes land.
+        """
+        if conn is not None:
+            yield conn
+            return
+        conn = self.get_connection()
+        try:
+            if immediate:
+                self.backend.begin_write(conn)
+            yield conn
+            with metrics.timer('db_commit'):
+                conn.commit()
+        except self.backend.Error as e:
+            conn.rollback()
+            click.echo(f"Database error: {e}", err=True)
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def execute(self, conn, query, params=()):
+        """Execute a ``?``-placeholder query on an open connection via the backend"""
+        if self.workload is not None:
+            statement = ' '.join(query.split())
+            entry = self.workload.setdefault(statement, {'count': 0, 'params': tuple(params)})
+            entry['count'] += 1
+        return self.backend.execute(conn, query, params)
+    
+    @contextmanager
+    def capture_workload(self):
+        """Record every distinct statement (with sample parameters) executed inside the block"""
+        self.workload = {}
+        try:
+            yield self.workload
+        finally:
+            self.workload = None
+    
+    def insert(self, conn, table, data):
+        """Insert a row on an open connection and return its ID"""
+        return self.backend.insert(conn, table, data)
+    
+    def upsert(self, table, data, conflict_columns, conn=None):
+        """Insert a row, or update it when it clashes on ``conflict_columns``"""
+        query = self.backend.upsert_sql(table, list(data.keys()), list(conflict_columns))
+        with self.transaction(conn) as conn:
+            self.execute(conn, query, tuple(data.values()))
+    
+    def bulk_copy(self, table, columns, rows, conn=None):
+        """Load many rows at once using the backend's fastest path"""
+        with self.transaction(conn) as conn:
+            self.backend.bulk_copy(conn, table, columns, rows)
+    
     def execute_query(self, query, params=()):
         """Execute a query with proper error handling"""
         conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(query, params)
-            conn.commit()
+            cursor = self.execute(conn, query, params)
+            with metrics.timer('db_commit'):
+                conn.commit()
             return cursor
-        except sqlite3.Error as e:
+        except self.backend.Error as e:
             conn.rollback()
-            click.echo(f"Database error: {e}")
+            click.echo(f"Database error: {e}", err=True)
             raise
         finally:
             conn.close()
@@ -150,28 +808,42 @@ class Database:
     def fetch_all(self, query, params=()):
         """Fetch all results from a query"""
         conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(query, params)
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            click.echo(f"Database fetch error: {e}")
+            return self.execute(conn, query, params).fetchall()
+        except self.backend.Error as e:
+            click.echo(f"Database fetch error: {e}", err=True)
             return []
         finally:
             conn.close()
     
+    def iter_rows(self, query, params=(), batch_size=1000):
+        """Yield rows straight from the cursor in batches; the connection closes when exhausted"""
+        conn = self.get_connection()
+        try:
+            cursor = self.execute(conn, query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+    
     def fetch_one(self, query, params=()):
         """Fetch one result from a query"""
         conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(query, params)
-            return cursor.fetchone()
-        except sqlite3.Error as e:
-            click.echo(f"Database fetch error: {e}")
+            return self.execute(conn, query, params).fetchone()
+        except self.backend.Error as e:
+            click.echo(f"Database fetch error: {e}", err=True)
             return None
         finally:
             conn.close()
 
+def create_database():
+    """Build the shared Database from CAR_RENTAL_DATABASE_URL (default: ./car_rental.db)"""
+    backend, target = backend_from_url(os.environ.get('CAR_RENTAL_DATABASE_URL', 'car_rental.db'))
+    return Database(target, backend=backend)
+
 # Global database instance
-db = Database()
\ No newline at end of file
+db = create_database()
@@ -38,11 +38,11 @@ class DebugHelper:
         
         # Create sample locations in Kenyan cities
         locations_data = [
-            {'name': 'Nairobi CBD Branch', 'address': 'Kenyatta Avenue, ICEA Building', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00100', 'phone': '020-1234567'},
-            {'name': 'JKIA Airport Branch', 'address': 'Jomo Kenyatta International Airport', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00501', 'phone': '020-2345678'},
-            {'name': 'Mombasa Branch', 'address': 'Moi Avenue, Nyali', 'city': 'Mombasa', 'state': 'Coast', 'zip_code': '80100', 'phone': '041-1234567'},
-            {'name': 'Kisumu Branch', 'address': 'Oginga Odinga Road', 'city': 'Kisumu', 'state': 'Nyanza', 'zip_code': '40100', 'phone': '057-1234567'},
-            {'name': 'Nakuru Branch', 'address': 'Kenyatta Avenue', 'city': 'Nakuru', 'state': 'Rift Valley', 'zip_code': '20100', 'phone': '051-1234567'}
+            {'name': 'Nairobi CBD Branch', 'address': 'Kenyatta Avenue, ICEA Building', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00100', 'phone': '020-1234567', 'lat': -1.2864, 'lon': 36.8172},
+            {'name': 'JKIA Airport Branch', 'address': 'Jomo Kenyatta International Airport', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00501', 'phone': '020-2345678', 'lat': -1.3192, 'lon': 36.9278},
+            {'name': 'Mombasa Branch', 'address': 'Moi Avenue, Nyali', 'city': 'Mombasa', 'state': 'Coast', 'zip_code': '80100', 'phone': '041-1234567', 'lat': -4.0435, 'lon': 39.6682},
+            {'name': 'Kisumu Branch', 'address': 'Oginga Odinga Road', 'city': 'Kisumu', 'state': 'Nyanza', 'zip_code': '40100', 'phone': '057-1234567', 'lat': -0.0917, 'lon': 34.7680},
+            {'name': 'Nakuru Branch', 'address': 'Kenyatta Avenue', 'city': 'Nakuru', 'state': 'Rift Valley', 'zip_code': '20100', 'phone': '051-1234567', 'lat': -0.3031, 'lon': 36.0800}
         ]
         
         location_ids = []
@@ -75,6 +75,23 @@ class DebugHelper:
             except Exception as e:
                 print(f"Error creating vehicle {vehicle['license_plate']}: {e}")
         
+        # Insure every sample vehicle for a year from the start of this month
+        cover_start = datetime.now().date().replace(day=1)
+        insurers = ['Jubilee Insurance', 'Britam', 'CIC Insurance', 'APA Insurance']
+        for index, vehicle_id in enumerate(vehicle_ids):
+            policy = {
+                'vehicle_id': vehicle_id, 'provider': insurers[index % len(insurers)],
+                'policy_number': f"POL-{cover_start.year}-{vehicle_id:04d}", 'coverage_type': 'comprehensive',
+                'premium': 45000.00, 'deductible': 10000.00,
+                'start_date': cover_start.strftime('%Y-%m-%d'),
+                'end_date': (cover_start + timedelta(days=364)).strftime('%Y-%m-%d')
+            }
+            try:
+                policy_id = CarRentalORM.create('insurance', policy)
+                print(f"Created insurance policy: {policy['policy_number']} for vehicle {vehicle_id} (ID: {policy_id})")
+            except Exception as e:
+                print(f"Error creating insurance policy for vehicle {vehicle_id}: {e}")
+        
         # Create sample customers with Kenyan names
         customers_data = [
             {'first_name': 'John', 'last_name': 'Kamau', 'email': 'john.kamau@email.com', 'phone': '0712-345678', 'license_number': 'A1234567', 'date_of_birth': '1985-03-15', 'is_vip': 1},
@@ -182,6 +199,23 @@ class DebugHelper:
         # Display stats
         DebugHelper.display_database_stats()
 
+    @staticmethod
+    def run_isolated_tests():
+        """Run the checks, writes included, on a private in-memory copy of the sample data"""
+        from fixtures import template
+        print("Running tests on an isolated copy of the sample data...")
+        with template.isolated():
+            passed = DebugHelper.test_database_connection()
+            customer_id = CarRentalORM.create('customers', {
+                'first_name': 'Test', 'last_name': 'Customer', 'email': 'selftest@example.com',
+                'phone': '0700000000', 'license_number': 'SELFTEST001'
+            })
+            found = CarRentalORM.find_customer_by_email('selftest@example.com')
+            write_passed = found is not None and found['id'] == customer_id
+            print(f"Write/read round trip: {'PASSED' if write_passed else 'FAILED'}")
+        print("The live database was not touched.")
+        return passed and write_passed
+
     @staticmethod
     def reset_database():
         """Reset the database (DANGEROUS - for development only)"""
@@ -192,7 +226,7 @@ class DebugHelper:
                 cursor = conn.cursor()
                 
                 # Drop all tables in correct order (respecting foreign keys)
-                tables = ['insurance', 'maintenance_records', 'rentals', 'vehicles', 'customers', 'locations']
+                tables = ['change_log', 'sync_state', 'sync_peers', 'sync_id_map', 'customer_stats', 'documents', 'document_blobs', 'vehicle_telemetry', 'rental_events', 'insurance', 'maintenance_records', 'rentals', 'vehicles', 'customers', 'locations', 'locations_rtree']
                 
                 for table in tables:
                     cursor.execute(f'DROP TABLE IF EXISTS {table}')
@@ -221,6 +255,7 @@ def debug_menu():
         print("3. Test Database Connection")
         print("4. Display Database Statistics")
         print("5. Reset Database (DANGEROUS)")
+        print("6. Run Tests on an Isolated Copy")
         print("0. Exit Debug Menu")
         print("="*50)
         
@@ -236,6 +271,8 @@ def debug_menu():
             DebugHelper.display_database_stats()
         elif choice == "5":
             DebugHelper.reset_database()
+        elif choice == "6":
+            DebugHelper.run_isolated_tests()
         elif choice == "0":
             print("Exiting debug menu...")
             break
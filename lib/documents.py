@@ -0,0 +1,197 @@
+"""
+Documents - license scans and inspection photos attached to customers,
+vehicles and rentals.
+
+Content lives in ``document_blobs`` once per SHA-256, so uploading the same
+file again only adds a ``documents`` row. Files are written and read in
+chunks through ``Connection.blobopen`` (a ``zeroblob`` of the right size is
+inserted first), so a multi-megabyte scan is never held in memory whole.
+``blobopen`` needs Python 3.11; older versions append and read the chunks
+with SQL (``||`` and ``substr()``), which keeps memory bounded but makes
+SQLite rewrite the value once per chunk while storing.
+"""
+
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import tempfile
+
+from database import db
+
+CHUNK_SIZE = 64 * 1024
+
+# Incremental blob I/O (Connection.blobopen) arrived in Python 3.11
+INCREMENTAL_IO = hasattr(sqlite3.Connection, 'blobopen')
+
+# owner_type -> table the owner_id refers to
+OWNER_TABLES = {'customer': 'customers', 'vehicle': 'vehicles', 'rental': 'rentals'}
+
+KINDS = ('license_scan', 'pickup_inspection', 'return_inspection', 'damage_photo', 'other')
+
+def _digest(stream):
+    """SHA-256 and size of the rest of ``stream``, read in chunks"""
+    digest, size = hashlib.sha256(), 0
+    while chunk := stream.read(CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+def _write_content(conn, blob_id, stream, size):
+    """Copy ``size`` bytes of ``stream`` into a stored blob; returns their SHA-256"""
+    written = hashlib.sha256()
+    if INCREMENTAL_IO:
+        with conn.blobopen('document_blobs', 'content', blob_id) as blob:
+            while chunk := stream.read(min(CHUNK_SIZE, size - blob.tell())):
+                written.update(chunk)
+                blob.write(chunk)
+        return written.hexdigest()
+    conn.execute("UPDATE document_blobs SET content = X'' WHERE id = ?", (blob_id,))
+    remaining = size
+    while remaining and (chunk := stream.read(min(CHUNK_SIZE, remaining))):
+        written.update(chunk)
+        # || works on text, so cast back to keep the bytes a BLOB
+        conn.execute("UPDATE document_blobs SET content = CAST(content || ? AS BLOB) WHERE id = ?", (chunk, blob_id))
+        remaining -= len(chunk)
+    return written.hexdigest()
+
+def _read_content(conn, blob_id, chunk_size):
+    """Yield a stored blob's bytes in chunks"""
+    if INCREMENTAL_IO:
+        with conn.blobopen('document_blobs', 'content', blob_id, readonly=True) as blob:
+            while chunk := blob.read(chunk_size):
+                yield chunk
+        return
+    offset = 1
+    while chunk := conn.execute("SELECT substr(content, ?, ?) FROM document_blobs WHERE id = ?",
+                                (offset, chunk_size, blob_id)).fetchone()[0]:
+        yield chunk
+        offset += len(chunk)
+
+def _seekable(stream):
+    """``stream`` itself when it can be read twice, otherwise a spooled copy"""
+    if stream.seekable():
+        return stream
+    spool = tempfile.SpooledTemporaryFile(max_size=4 * CHUNK_SIZE)
+    while chunk := stream.read(CHUNK_SIZE):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+class DocumentStore:
+    """Store, list, stream and delete documents (classmethods on the shared ``db``)"""
+
+    @classmethod
+    def store(cls, owner_type, owner_id, kind, source, filename=None, content_type=None):
+        """Attach a file (path or binary stream) to an owner; returns ``(document_id, reused)``.
+
+        ``reused`` is True when identical content was already stored and
+        only a new reference was added.
+        """
+        db.require_sqlite("Document storage")
+        if owner_type not in OWNER_TABLES:
+            raise ValueError(f"Unknown owner type '{owner_type}' (choose from {', '.join(OWNER_TABLES)})")
+        if kind not in KINDS:
+            raise ValueError(f"Unknown document kind '{kind}' (choose from {', '.join(KINDS)})")
+        if isinstance(source, (str, os.PathLike)):
+            filename = filename or os.path.basename(source)
+            with open(source, 'rb') as stream:
+                return cls._store(owner_type, owner_id, kind, stream, filename, content_type)
+        return cls._store(owner_type, owner_id, kind, source, filename or 'upload', content_type)
+
+    @classmethod
+    def _store(cls, owner_type, owner_id, kind, stream, filename, content_type):
+        stream = _seekable(stream)
+        start = stream.tell()
+        sha256, size = _digest(stream)
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        with db.transaction() as conn:
+            owner = db.execute(conn, f"SELECT 1 FROM {OWNER_TABLES[owner_type]} WHERE id = ?", (owner_id,)).fetchone()
+            if not owner:
+                raise ValueError(f"{owner_type.capitalize()} {owner_id} not found!")
+            # The UNIQUE sha256 decides between concurrent uploads of the same content
+            cursor = db.execute(conn, """
+                INSERT INTO document_blobs (sha256, size, content) VALUES (?, ?, zeroblob(?))
+                ON CONFLICT (sha256) DO NOTHING
+            """, (sha256, size, size))
+            reused = cursor.rowcount == 0
+            if reused:
+                blob_id = db.execute(conn, "SELECT id FROM document_blobs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+            else:
+                blob_id = cursor.lastrowid
+                stream.seek(start)
+                if _write_content(conn, blob_id, stream, size) != sha256:
+                    raise ValueError(f"{filename} changed while it was being stored")
+            document_id = db.insert(conn, 'documents', {
+                'owner_type': owner_type, 'owner_id': owner_id, 'kind': kind,
+                'filename': filename, 'content_type': content_type, 'blob_id': blob_id,
+            })
+        return document_id, reused
+
+    @staticmethod
+    def find_by_owner(owner_type, owner_id):
+        """Documents of one owner, newest first (without content)"""
+        return db.fetch_all("""
+            SELECT d.id, d.kind, d.filename, d.content_type, d.created_at, b.size, b.sha256
+            FROM documents d JOIN document_blobs b ON b.id = d.blob_id
+            WHERE d.owner_type = ? AND d.owner_id = ?
+            ORDER BY d.id DESC
+        """, (owner_type, owner_id))
+
+    @staticmethod
+    def find_by_id(document_id):
+        return db.fetch_one("""
+            SELECT d.*, b.size, b.sha256
+            FROM documents d JOIN document_blobs b ON b.id = d.blob_id
+            WHERE d.id = ?
+        """, (document_id,))
+
+    @staticmethod
+    def iter_content(document_id, chunk_size=CHUNK_SIZE):
+        """Yield a document's bytes in chunks; the connection closes when exhausted"""
+        db.require_sqlite("Document storage")
+        conn = db.get_connection()
+        try:
+            row = db.execute(conn, "SELECT blob_id FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if not row:
+                raise ValueError("Document not found!")
+            yield from _read_content(conn, row[0], chunk_size)
+        finally:
+            conn.close()
+
+    @classmethod
+    def export(cls, document_id, path):
+        """Write a document's content to ``path``; returns the number of bytes"""
+        if not cls.find_by_id(document_id):
+            raise ValueError("Document not found!")
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in cls.iter_content(document_id):
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+    @staticmethod
+    def delete(document_id):
+        """Remove a document, and its content once nothing else refers to it"""
+        with db.transaction() as conn:
+            row = db.execute(conn, "SELECT blob_id FROM documents WHERE id = ?", (document_id,)).fetchone()
+            if not row:
+                raise ValueError("Document not found!")
+            db.execute(conn, "DELETE FROM documents WHERE id = ?", (document_id,))
+            db.execute(conn, """
+                DELETE FROM document_blobs WHERE id = ?
+                AND NOT EXISTS (SELECT 1 FROM documents WHERE blob_id = ?)
+            """, (row[0], row[0]))
+
+    @staticmethod
+    def storage_stats():
+        """Documents, distinct contents and bytes referenced vs bytes actually stored"""
+        return db.fetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM documents) AS documents,
+                (SELECT COUNT(*) FROM document_blobs) AS contents,
+                (SELECT COALESCE(SUM(b.size), 0) FROM documents d JOIN document_blobs b ON b.id = d.blob_id) AS referenced_bytes,
+                (SELECT COALESCE(SUM(size), 0) FROM document_blobs) AS stored_bytes
+        """)
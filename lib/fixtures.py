@@ -0,0 +1,79 @@
+"""
+Isolated databases for tests and checks - a seeded template is built once per
+process in memory and cloned into a private database for each use with the
+SQLite backup API, so nothing touches car_rental.db.
+
+    # conftest.py
+    import pytest
+    from fixtures import template
+
+    @pytest.fixture
+    def isolated_db():
+        with template.isolated() as database:
+            yield database
+
+Each test then sees its own copy of the sample data through the shared
+``db`` (and so through CarRentalORM and the CLI commands). Template and
+clones are per process, so parallel test workers never share state.
+"""
+
+import contextlib
+import io
+import threading
+
+from database import db, Database, MEMORY
+from models.orm import CarRentalORM
+from models.spatial import BranchLocator
+
+TABLES = ('locations', 'vehicles', 'customers', 'rentals', 'maintenance_records', 'insurance')
+
+def reset_caches():
+    """Forget rows cached from whichever database ``db`` pointed at before"""
+    for table in TABLES:
+        CarRentalORM.notify(table)
+    BranchLocator._has_rtree = None
+
+def seed_sample_data():
+    """The Kenyan sample data from the debug menu, without its console output"""
+    from debug import DebugHelper
+    with contextlib.redirect_stdout(io.StringIO()):
+        DebugHelper.setup_sample_data()
+
+class DatabaseTemplate:
+    """A seeded in-memory database that is copied, never modified"""
+
+    def __init__(self, seed=seed_sample_data):
+        self.seed = seed
+        self.database = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Create and seed the template on first use"""
+        with self.lock:
+            if self.database is None:
+                database = Database(MEMORY)
+                with db.redirect(database):
+                    reset_caches()
+                    self.seed()
+                reset_caches()
+                self.database = database
+            return self.database
+
+    def clone(self, temporary=False):
+        """A fresh copy of the template; ``temporary`` puts it in a file other processes can open"""
+        return self.build().clone(temporary)
+
+    @contextlib.contextmanager
+    def isolated(self, temporary=False):
+        """Point the shared ``db`` at a fresh copy of the template for the block"""
+        copy = self.clone(temporary)
+        try:
+            with db.redirect(copy):
+                reset_caches()
+                yield copy
+        finally:
+            reset_caches()
+            copy.close()
+
+# Shared sample-data template for the process
+template = DatabaseTemplate()
@@ -1,4 +1,12 @@
 from models.orm import CarRentalORM
+from models.events import RentalEventLog, RentalProjector
+from models.allocation import ReservationAllocator
+from models.forecast import MaintenanceForecaster
+from models.coverage import audit_coverage, audit_rows, coverage_index
+from cache import fleet_cache
+from telemetry import latest_readings
+from documents import DocumentStore
+from models.loyalty import LoyaltyTiers
 from datetime import datetime
 
 def exit_program():
@@ -7,13 +15,13 @@ def exit_program():
 
 # Vehicle functions
 def list_vehicles():
-    vehicles = CarRentalORM.get_all('vehicles')
+    vehicles = fleet_cache.get_all('vehicles')
     for vehicle in vehicles:
-        status = "Available" if vehicle['available'] else "Not Available"
+        status = vehicle['status'].capitalize()
         print(f"{vehicle['id']}: {vehicle['year']} {vehicle['make']} {vehicle['model']} - KES {vehicle['daily_rate']}/day - {status}")
 
 def find_available_vehicles():
-    vehicles = CarRentalORM.find_available_vehicles()
+    vehicles = fleet_cache.available_vehicles()
     for vehicle in vehicles:
         print(f"{vehicle['id']}: {vehicle['year']} {vehicle['make']} {vehicle['model']} - KES {vehicle['daily_rate']}/day")
 
@@ -27,7 +35,7 @@ def create_vehicle():
     color = input("Color: ")
     vehicle_type = input("Type: ")
     
-    locations = CarRentalORM.get_all('locations')
+    locations = fleet_cache.get_all('locations')
     for loc in locations:
         print(f"{loc['id']}: {loc['name']}")
     
@@ -46,20 +54,20 @@ def create_vehicle():
 def update_vehicle_status():
     list_vehicles()
     vehicle_id = int(input("Enter vehicle ID to update: "))
-    new_status = input("Set as available? (y/n): ").lower()
+    new_status = input("Set as in service? (y/n): ").lower()
     available = 1 if new_status == 'y' else 0
     CarRentalORM.update('vehicles', vehicle_id, {'available': available})
     print("Vehicle status updated!")
 
 def find_vehicle_by_type():
     vehicle_type = input("Vehicle type: ")
-    vehicles = CarRentalORM.find_vehicles_by_type(vehicle_type)
+    vehicles = fleet_cache.vehicles_by_type(vehicle_type)
     for vehicle in vehicles:
         print(f"{vehicle['id']}: {vehicle['make']} {vehicle['model']} - KES {vehicle['daily_rate']}/day")
 
 # Customer functions
 def list_customers():
-    customers = CarRentalORM.get_all('customers')
+    customers = fleet_cache.get_all('customers')
     for customer in customers:
         print(f"{customer['id']}: {customer['first_name']} {customer['last_name']} - {customer['email']}")
 
@@ -84,13 +92,14 @@ def find_customer_by_email():
     customer = CarRentalORM.find_customer_by_email(email)
     if customer:
         print(f"Found: {customer['first_name']} {customer['last_name']} - {customer['email']}")
+        show_customer_status(customer['id'])
 
 # Rental functions
 def list_rentals():
     rentals = CarRentalORM.get_all('rentals')
     for rental in rentals:
-        customer = CarRentalORM.find_by_id('customers', rental['customer_id'])
-        vehicle = CarRentalORM.find_by_id('vehicles', rental['vehicle_id'])
+        customer = fleet_cache.find_by_id('customers', rental['customer_id'])
+        vehicle = fleet_cache.find_by_id('vehicles', rental['vehicle_id'])
         if customer and vehicle:
             print(f"{rental['id']}: {customer['first_name']} - {vehicle['make']} {vehicle['model']} - {rental['status']}")
 
@@ -102,13 +111,13 @@ def find_active_rentals():
 def create_rental():
     print("Create Rental:")
     
-    customers = CarRentalORM.get_all('customers')
+    customers = fleet_cache.get_all('customers')
     for customer in customers:
         print(f"{customer['id']}: {customer['first_name']} {customer['last_name']}")
     
     customer_id = int(input("Customer ID: "))
     
-    vehicles = CarRentalORM.find_available_vehicles()
+    vehicles = fleet_cache.available_vehicles()
     for vehicle in vehicles:
         print(f"{vehicle['id']}: {vehicle['make']} {vehicle['model']} - KES {vehicle['daily_rate']}/day")
     
@@ -116,20 +125,28 @@ def create_rental():
     start_date = input("Start Date (YYYY-MM-DD): ")
     end_date = input("End Date (YYYY-MM-DD): ")
     
-    vehicle = CarRentalORM.find_by_id('vehicles', vehicle_id)
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d')
-    days = (end - start).days
-    total = days * vehicle['daily_rate']
-    
-    data = {
-        'customer_id': customer_id, 'vehicle_id': vehicle_id,
-        'start_date': start_date, 'end_date': end_date,
-        'total_amount': total, 'status': 'active'
-    }
-    
-    rental_id = CarRentalORM.create('rentals', data)
+    try:
+        rental_id, total = CarRentalORM.book_rental(customer_id, vehicle_id, start_date, end_date)
+    except ValueError as e:
+        print(e)
+        return
     print(f"Rental created! ID: {rental_id}, Total: KES {total}")
+    warn_if_uninsured(vehicle_id, start_date, end_date)
+
+def warn_if_uninsured(vehicle_id, start_date, end_date):
+    for first, last in coverage_index.gaps(vehicle_id, start_date, end_date):
+        print(f"Warning: vehicle {vehicle_id} is not insured from {first} to {last}")
+
+def show_rental_quote(vehicle_id, start_date, end_date):
+    try:
+        vehicle, total, nights = CarRentalORM.quote_rental(vehicle_id, start_date, end_date)
+    except ValueError as e:
+        print(e)
+        return
+    print(f"{vehicle['make']} {vehicle['model']} - base KES {vehicle['daily_rate']:,.2f}/day")
+    for night in nights:
+        print(f"{night['date']}: KES {night['price']:,.2f} ({night['tier']}, {night['utilization']:.0%} booked)")
+    print(f"Total: KES {total:,.2f}")
 
 def process_return():
     rentals = CarRentalORM.find_active_rentals()
@@ -138,19 +155,49 @@ def process_return():
     
     rental_id = int(input("Rental ID to return: "))
     
-    CarRentalORM.update('rentals', rental_id, {
-        'status': 'completed',
-        'actual_return_date': datetime.now().strftime('%Y-%m-%d')
-    })
-    
-    rental = CarRentalORM.find_by_id('rentals', rental_id)
-    CarRentalORM.update('vehicles', rental['vehicle_id'], {'available': 1})
+    try:
+        CarRentalORM.return_rental(rental_id)
+    except ValueError as e:
+        print(e)
+        return
     
     print("Vehicle returned!")
 
+def show_rental_history(rental_id):
+    events = RentalEventLog.find_by_rental(rental_id)
+    if not events:
+        print("No history found for that rental.")
+        return
+    for event in events:
+        print(f"{event['event_date']}: {event['event_type']} - {event['start_date']} to {event['end_date']} - KES {event['total_amount'] or 0:,.2f}")
+
+def show_fleet_snapshot(as_of=None):
+    snapshot = RentalProjector.snapshot(as_of)
+    print(f"Fleet state as of {as_of or 'now'}:")
+    for vehicle_id, rental_id in sorted(snapshot['vehicles_out'].items()):
+        state = snapshot['rentals'][rental_id]
+        print(f"Vehicle {vehicle_id}: rental {rental_id} ({state['status']}) - {state['start_date']} to {state['end_date']}")
+    print(f"Vehicles out: {len(snapshot['vehicles_out'])}")
+
+def show_allocation(requests, assignments, unassigned, rental_ids=()):
+    for assignment in assignments:
+        request, vehicle = assignment['request'], assignment['vehicle']
+        transfer = " (transfer)" if assignment['transfer'] else ""
+        print(f"Customer {request['customer_id']}: {request['start_date']} to {request['end_date']} -> "
+              f"{vehicle['id']}: {vehicle['make']} {vehicle['model']}{transfer}")
+    for request in unassigned:
+        print(f"Customer {request['customer_id']}: {request['start_date']} to {request['end_date']} -> no {request['vehicle_type']} free")
+    
+    transfers = sum(1 for a in assignments if a['transfer'])
+    print(f"Assigned: {len(assignments)}/{len(requests)}, transfers: {transfers}, "
+          f"vehicle-days: {sum(a['days'] for a in assignments)}")
+    
+    if rental_ids:
+        print(f"Reservations created: {len(rental_ids)}")
+
 # Location functions
 def list_locations():
-    locations = CarRentalORM.get_all('locations')
+    locations = fleet_cache.get_all('locations')
     for location in locations:
         print(f"{location['id']}: {location['name']} - {location['city']}")
 
@@ -161,41 +208,201 @@ def create_location():
     city = input("City: ")
     state = input("State: ")
     zip_code = input("ZIP: ")
+    lat = input("Latitude (optional): ")
+    lon = input("Longitude (optional): ")
     
     data = {
         'name': name, 'address': address,
         'city': city, 'state': state, 'zip_code': zip_code
     }
+    if lat and lon:
+        data.update({'lat': float(lat), 'lon': float(lon)})
     
     location_id = CarRentalORM.create('locations', data)
     print(f"Location added! ID: {location_id}")
 
+def find_vehicles_near(lat, lon, vehicle_type=None, limit=5):
+    branches = CarRentalORM.find_vehicles_near(lat, lon, vehicle_type, limit)
+    if not branches:
+        print("No branch with available vehicles found.")
+        return
+    for branch in branches:
+        print(f"{branch['distance_km']:,.1f} km: {branch['name']} ({branch['city']}) - "
+              f"{branch['available_vehicles']} available")
+
 # Maintenance functions
 def list_maintenance():
     records = CarRentalORM.get_all('maintenance_records')
     for record in records:
-        vehicle = CarRentalORM.find_by_id('vehicles', record['vehicle_id'])
+        vehicle = fleet_cache.find_by_id('vehicles', record['vehicle_id'])
         if vehicle:
             print(f"{record['id']}: {vehicle['make']} {vehicle['model']} - {record['maintenance_type']}")
 
+def forecast_maintenance(horizon_days=None, dry_run=False):
+    if dry_run:
+        forecasts = MaintenanceForecaster.forecast()
+    else:
+        forecasts = MaintenanceForecaster.run(horizon_days)
+    for forecast in sorted(forecasts, key=lambda f: f['due_date']):
+        vehicle = fleet_cache.find_by_id('vehicles', forecast['vehicle_id'])
+        if vehicle:
+            print(f"{forecast['due_date']}: {vehicle['make']} {vehicle['model']} ({vehicle['license_plate']}) - "
+                  f"{forecast['used_since_service']} rental days since service, {forecast['used_recently']} in the last 90")
+    if dry_run:
+        print(f"{len(forecasts)} vehicles forecast (not saved)")
+    else:
+        print(f"{len(forecasts)} next service dates predicted")
+
 # Insurance functions
 def list_insurance():
     policies = CarRentalORM.get_all('insurance')
     for policy in policies:
-        vehicle = CarRentalORM.find_by_id('vehicles', policy['vehicle_id'])
+        vehicle = fleet_cache.find_by_id('vehicles', policy['vehicle_id'])
         if vehicle:
             print(f"{policy['id']}: {vehicle['make']} {vehicle['model']} - {policy['provider']}")
 
+def create_insurance():
+    print("Add Insurance Policy:")
+    list_vehicles()
+    vehicle_id = int(input("Vehicle ID: "))
+    provider = input("Provider: ")
+    policy_number = input("Policy Number: ")
+    coverage_type = input("Coverage (comprehensive/third-party/liability): ")
+    premium = float(input("Premium: "))
+    start_date = input("Start Date (YYYY-MM-DD): ")
+    end_date = input("End Date (YYYY-MM-DD): ")
+    
+    data = {
+        'vehicle_id': vehicle_id, 'provider': provider, 'policy_number': policy_number,
+        'coverage_type': coverage_type, 'premium': premium,
+        'start_date': start_date, 'end_date': end_date
+    }
+    
+    policy_id = CarRentalORM.create('insurance', data)
+    print(f"Insurance policy added! ID: {policy_id}")
+
+def show_coverage_audit(horizon_days=90):
+    report = audit_coverage(horizon_days)
+    print(f"Insurance audit for the next {horizon_days} days:")
+    for vehicle in report['uncovered']:
+        print(f"No cover: vehicle {vehicle['vehicle_id']} ({vehicle['license_plate']})")
+    for gap in report['gaps']:
+        print(f"Gap: vehicle {gap['vehicle_id']} ({gap['license_plate']}) uninsured {gap['from']} to {gap['to']}")
+    for overlap in report['overlaps']:
+        print(f"Overlap: vehicle {overlap['vehicle_id']} policies {overlap['policy_ids'][0]} and {overlap['policy_ids'][1]} "
+              f"both cover {overlap['from']} to {overlap['to']}")
+    for rental in report['rentals_at_risk']:
+        print(f"At risk: rental {rental['rental_id']} (vehicle {rental['vehicle_id']}, {rental['start_date']} to {rental['end_date']}) is not fully insured")
+    if not any(report.values()):
+        print("Every vehicle is covered with no gaps or overlaps.")
+
+# Telemetry functions
+def show_telemetry(vehicle_id, limit=20):
+    readings = latest_readings(vehicle_id, limit)
+    if not readings:
+        print("No telemetry for that vehicle.")
+        return
+    for reading in readings:
+        recorded = datetime.fromtimestamp(reading['recorded_ms'] / 1000).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{recorded}: odometer {reading['odometer_km']} km, fuel {reading['fuel_pct']}%, "
+              f"position {reading['lat']}, {reading['lon']}")
+
+def show_metrics(summary):
+    print(f"{'operation':<32}{'count':>8}{'errors':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in summary:
+        print(f"{row['operation']:<32}{row['count']:>8}{row['errors']:>8}{row['mean_ms']:>10.3f}"
+              f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+def show_history_summary(summary, by):
+    if not summary:
+        print("No rentals in that period.")
+        return
+    print(f"{by:<24}{'rentals':>10}{'days':>10}{'revenue (KES)':>18}{'per day':>12}")
+    for group in summary:
+        print(f"{str(group[by]):<24}{group['rentals']:>10}{group['rental_days']:>10}"
+              f"{group['revenue']:>18,.2f}{group['revenue_per_day']:>12,.2f}")
+
+def show_rebalance_plan(plan):
+    print(f"{'branch':<24}{'type':<12}{'stock':>7}{'forecast':>10}{'target':>8}{'after':>7}")
+    for position in plan['branches']:
+        print(f"{position['branch']:<24}{position['vehicle_type']:<12}{position['stock']:>7}"
+              f"{position['forecast']:>10.2f}{position['target']:>8}{position['after']:>7}")
+    if not plan['moves']:
+        print("\nNo transfers needed.")
+    else:
+        print("\nTransfers:")
+        for move in plan['moves']:
+            print(f"  {move['vehicles']} x {move['vehicle_type']}: {move['from_branch']} -> {move['to_branch']} "
+                  f"({move['distance_km']} km) {move['license_plates']}")
+        print(f"Total distance: {plan['distance_km']:,} km")
+    if plan['shortfall']:
+        print(f"Still short after transfers: {plan['shortfall']} vehicles")
+
 # Reporting functions
 def generate_revenue_report():
     data = CarRentalORM.get_revenue_report()
     if data:
         print(f"Total Revenue: KES {data['total_revenue'] or 0:,.2f}")
         print(f"Completed Rentals: {data['completed_rentals']}")
+        print(f"Rental Days: {data['rental_days'] or 0}")
+        print(f"Late Days: {data['late_days'] or 0}")
 
 def generate_utilization_report():
     data = CarRentalORM.get_utilization_report()
     if data:
         print(f"Total Vehicles: {data['total_vehicles']}")
         print(f"Available: {data['available_vehicles']}")
-        print(f"Rented: {data['rented_vehicles']}")
\ No newline at end of file
+        print(f"Rented/Reserved: {data['rented_vehicles']}")
+        print(f"In Maintenance: {data['maintenance_vehicles']}")
+
+def generate_historical_utilization_report(start_date, end_date):
+    data = RentalProjector.utilization(start_date, end_date)
+    for day, on_rent in data['daily']:
+        print(f"{day}: {on_rent}/{data['fleet_size']} vehicles on rent")
+    print(f"Vehicle-days rented: {data['vehicle_days']}")
+    print(f"Utilization: {data['utilization']:.1f}%")
+
+# Document functions
+def show_documents(owner_type, owner_id):
+    documents = DocumentStore.find_by_owner(owner_type, owner_id)
+    if not documents:
+        print(f"No documents for that {owner_type}.")
+        return
+    for document in documents:
+        print(f"{document['id']}: {document['kind']} - {document['filename']} ({document['content_type']}, "
+              f"{document['size']:,} bytes) - {document['created_at']}")
+
+def show_document_storage():
+    stats = DocumentStore.storage_stats()
+    saved = stats['referenced_bytes'] - stats['stored_bytes']
+    print(f"{stats['documents']:,} documents, {stats['contents']:,} distinct files")
+    print(f"{stats['stored_bytes']:,} bytes stored for {stats['referenced_bytes']:,} bytes attached "
+          f"({saved:,} saved by deduplication)")
+
+def show_duplicate_customers(proposals, stats):
+    print(f"Scanned {stats['customers']:,} customers: {stats['compared_pairs']:,} pairs compared, "
+          f"{stats['matches']:,} matches ({stats['oversize_blocks']:,} oversized blocks skipped)")
+    if not proposals:
+        print("No likely duplicates found.")
+        return
+    for proposal in proposals:
+        duplicates = ', '.join(f"{customer_id} {name}" for customer_id, name in zip(proposal['merge_ids'], proposal['merge_names']))
+        print(f"Keep {proposal['keep_id']} {proposal['keep_name']} <- {duplicates} "
+              f"(score {proposal['score']:.2f}, {proposal['rentals']} rentals to move)")
+
+def show_customer_status(customer_id):
+    status = LoyaltyTiers.status(customer_id)
+    if not status:
+        print("Customer not found!")
+        return
+    last = status['last_rental_date'] or 'never'
+    print(f"{status['first_name']} {status['last_name']}: {status['tier'].capitalize()}{' (VIP)' if status['is_vip'] else ''} - "
+          f"{status['rentals']} rentals, KES {status['total_spend']:,.2f} spent, "
+          f"{status['late_returns']} late returns, last rental {last}")
+
+def run_loyalty_tiering():
+    result = LoyaltyTiers.run()
+    for change in result['changed']:
+        print(f"Customer {change['customer_id']}: {change['from']} -> {change['to']}")
+    print(f"Evaluated {result['evaluated']} customers, {len(result['changed'])} tier changes, "
+          f"{result['vip_updated']} VIP flags updated")
@@ -0,0 +1,136 @@
+"""
+Database housekeeping: archiving old history, online backups, vacuum and planner statistics.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from database import db, epoch_day
+
+# Completed history that can leave the hot tables: table -> condition on day numbers
+ARCHIVE_RULES = {
+    'rentals': "status IN ('completed', 'cancelled') AND COALESCE(return_day, end_day) < ?",
+    'maintenance_records': "status = 'completed' AND maintenance_day < ?",
+    'insurance': "end_day < ?",
+}
+
+def _months_ago(months):
+    today = datetime.now().date()
+    month_index = today.year * 12 + (today.month - 1) - months
+    year, month = divmod(month_index, 12)
+    return today.replace(year=year, month=month + 1, day=min(today.day, 28))
+
+class DatabaseMaintenance:
+    """Housekeeping for the SQLite database file"""
+
+    @staticmethod
+    def _columns(conn, schema, table):
+        return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+    @classmethod
+    def _ensure_archive_table(cls, conn, table):
+        columns = cls._columns(conn, 'main', table)
+        if not cls._columns(conn, 'archive', table):
+            conn.execute(f"CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+        archived = cls._columns(conn, 'archive', table)
+        for column in columns:
+            if column not in archived:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column}")
+        return ', '.join(columns)
+
+    @classmethod
+    def archive(cls, months, archive_path, batch_size=5000):
+        """Move history older than ``months`` into ``archive_path``.
+
+        Rows are moved in short batches (copy then delete, one transaction
+        each) so other connections can keep writing in between. The rental
+        event log is left in place as the permanent history, and archived
+        rentals stay counted in ``customer_stats``.
+        """
+        db.require_sqlite("Database maintenance")
+        cutoff = epoch_day(_months_ago(months))
+        moved = {}
+        conn = db.get_connection()
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            # Remembered so customer stats can be rebuilt from the archived rentals too
+            conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('archive_db', ?)",
+                         (os.path.abspath(archive_path),))
+            for table, condition in ARCHIVE_RULES.items():
+                columns = cls._ensure_archive_table(conn, table)
+                conn.commit()
+                moved[table] = 0
+                while True:
+                    ids = [row[0] for row in conn.execute(
+                        f"SELECT id FROM main.{table} WHERE {condition} LIMIT ?", (cutoff, batch_size)
+                    ).fetchall()]
+                    if not ids:
+                        break
+                    placeholders = ', '.join('?' for _ in ids)
+                    conn.execute(f"INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})", ids)
+                    # Set and cleared inside the batch, so only these deletes skip the customer stats trigger
+                    conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('archiving', 1)")
+                    conn.execute(f"DELETE FROM main.{table} WHERE id IN ({placeholders})", ids)
+                    conn.execute("DELETE FROM sync_state WHERE key = 'archiving'")
+                    conn.commit()
+                    moved[table] += len(ids)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return moved
+
+    @classmethod
+    def backup(cls, destination, pages=256, sleep=0.01, progress=None):
+        """Copy the live database with the SQLite online backup API.
+
+        The copy advances ``pages`` pages per step and sleeps between steps,
+        so the source is only locked briefly and writers are not held up.
+        """
+        db.require_sqlite("Database maintenance")
+        source = db.get_connection()
+        target = sqlite3.connect(destination)
+        try:
+            source.backup(target, pages=pages, sleep=sleep, progress=progress)
+        finally:
+            target.close()
+            source.close()
+        return os.path.getsize(destination)
+
+    @classmethod
+    def vacuum(cls, pages=None):
+        """Reclaim free pages incrementally; the first run switches the file to incremental auto-vacuum"""
+        db.require_sqlite("Database maintenance")
+        conn = db.get_connection()
+        try:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode != 2:
+                # auto_vacuum only changes after a full VACUUM rebuilds the file
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                converted = True
+            else:
+                # The pragma frees one page per step; executescript runs it to completion
+                pragma = f"PRAGMA incremental_vacuum({int(pages)})" if pages else "PRAGMA incremental_vacuum"
+                conn.executescript(f"{pragma};")
+                converted = False
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+        return {'free_pages_before': before, 'free_pages_after': after, 'converted': converted}
+
+    @classmethod
+    def analyze(cls):
+        """Refresh query planner statistics"""
+        db.require_sqlite("Database maintenance")
+        conn = db.get_connection()
+        try:
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+            conn.commit()
+            return conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+        finally:
+            conn.close()
@@ -0,0 +1,280 @@
+"""
+Index advisor - captures the ORM workload, reads EXPLAIN QUERY PLAN for each
+statement and proposes (or applies) covering indexes, with before/after
+timings against a generated benchmark dataset.
+"""
+
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from database import db, Database
+from models.orm import CarRentalORM
+
+KEYWORDS = {'WHERE', 'JOIN', 'LEFT', 'INNER', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'AS', 'AND', 'OR'}
+TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+PREDICATE = re.compile(r'(?:\b(\w+)\.)?\b(\w+)\s*(=|<=|>=|<|>|\bIN\b|\bBETWEEN\b)', re.IGNORECASE)
+CLAUSE_END = re.compile(r'\b(?:GROUP BY|ORDER BY|LIMIT|HAVING)\b', re.IGNORECASE)
+COLUMN_REF = re.compile(r'\b(?:(\w+)\.)?(\w+)\b')
+SELECT_ALL = re.compile(r'(?:\bSELECT\s+(?:DISTINCT\s+)?|,\s*)(?:(\w+)\.)?\*', re.IGNORECASE)
+LITERAL = re.compile(r"'[^']*'")
+# Widest index proposed; a statement reading more columns of a table only gets its filter columns indexed
+MAX_INDEX_COLUMNS = 6
+
+def representative_workload():
+    """Run the ORM finders and reports the front desk and nightly jobs use"""
+    sample = db.fetch_one("SELECT * FROM customers LIMIT 1")
+    CarRentalORM.find_available_vehicles()
+    CarRentalORM.find_vehicles_by_type('SUV')
+    CarRentalORM.find_vehicles_by_location(1)
+    CarRentalORM.find_active_rentals()
+    CarRentalORM.find_overdue_rentals()
+    CarRentalORM.find_rentals_by_customer(sample['id'] if sample else 1)
+    if sample:
+        CarRentalORM.find_customer_by_email(sample['email'])
+        CarRentalORM.find_customer_by_license(sample['license_number'])
+    CarRentalORM.find_overdue_maintenance()
+    CarRentalORM.find_scheduled_maintenance()
+    CarRentalORM.find_expiring_insurance()
+    CarRentalORM.get_revenue_report()
+    CarRentalORM.get_utilization_report()
+
+def build_benchmark_database(path, rentals=20000, seed=42):
+    """Copy the live schema into ``path`` and fill it with synthetic fleet history"""
+    source = db.get_connection()
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+
+    rng = random.Random(seed)
+    types = ['sedan', 'SUV', 'hatchback', 'minivan', 'pickup', 'luxury']
+    today = date.today()
+    location_ids = [row[0] for row in target.execute("SELECT id FROM locations").fetchall()] or [None]
+
+    vehicle_count, customer_count = max(rentals // 20, 10), max(rentals // 4, 10)
+    target.executemany(
+        "INSERT INTO vehicles (make, model, year, license_plate, vehicle_type, daily_rate, location_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [('Toyota', 'Bench', 2020, f'BENCH{i:07d}', rng.choice(types), rng.randint(15, 80) * 100, rng.choice(location_ids))
+         for i in range(vehicle_count)])
+    target.executemany(
+        "INSERT INTO customers (first_name, last_name, email, phone, license_number) VALUES (?, ?, ?, ?, ?)",
+        [('Bench', f'Customer{i}', f'bench{i}@example.com', f'07{i:08d}', f'BENCH{i:08d}') for i in range(customer_count)])
+    vehicle_ids = [row[0] for row in target.execute("SELECT id FROM vehicles").fetchall()]
+    customer_ids = [row[0] for row in target.execute("SELECT id FROM customers").fetchall()]
+
+    def rental(_):
+        start = today - timedelta(days=rng.randint(0, 1500))
+        end = start + timedelta(days=rng.randint(1, 14))
+        status = 'completed' if end < today else rng.choice(['active', 'reserved'])
+        return (rng.choice(customer_ids), rng.choice(vehicle_ids), start.isoformat(), end.isoformat(),
+                rng.randint(2, 50) * 1000, status)
+    target.executemany(
+        "INSERT INTO rentals (customer_id, vehicle_id, start_date, end_date, total_amount, status) VALUES (?, ?, ?, ?, ?, ?)",
+        [rental(i) for i in range(rentals)])
+    target.executemany(
+        "INSERT INTO maintenance_records (vehicle_id, maintenance_type, cost, maintenance_date, next_maintenance_date, status) VALUES (?, ?, ?, ?, ?, ?)",
+        [(rng.choice(vehicle_ids), 'routine', 5000, (today - timedelta(days=rng.randint(0, 700))).isoformat(),
+          (today + timedelta(days=rng.randint(-60, 120))).isoformat(), rng.choice(['scheduled', 'completed', 'completed']))
+         for _ in range(rentals // 5)])
+    target.executemany(
+        "INSERT INTO insurance (vehicle_id, provider, policy_number, coverage_type, premium, start_date, end_date, deductible) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(vehicle_id, 'Bench Insurance', f'BENCH-POL-{vehicle_id}', 'comprehensive', 100000,
+          (today - timedelta(days=rng.randint(0, 364))).isoformat(),
+          (today + timedelta(days=rng.randint(1, 365))).isoformat(), 50000)
+         for vehicle_id in vehicle_ids])
+    target.commit()
+    target.execute("ANALYZE")
+    target.close()
+
+class IndexAdvisor:
+    """Proposes covering indexes: the filter columns first, then every other column the statement reads.
+
+    A statement that selects ``*`` (or ``alias.*``) from a table, or reads
+    more than ``MAX_INDEX_COLUMNS`` of its columns, cannot be covered and gets
+    an index on its filter columns only.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def plan(self, statement, params):
+        return [row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {statement}", params).fetchall()]
+
+    @staticmethod
+    def _aliases(statement):
+        aliases = {}
+        for table, alias in TABLE_REF.findall(statement):
+            aliases[table] = table
+            if alias and alias.upper() not in KEYWORDS:
+                aliases[alias] = table
+        return aliases
+
+    def _indexes(self, table):
+        """Column lists of the table's existing indexes"""
+        return [
+            [column[2] for column in self.conn.execute(f"PRAGMA index_info({index[1]})").fetchall()]
+            for index in self.conn.execute(f"PRAGMA index_list({table})").fetchall()
+        ]
+
+    def _columns(self, table):
+        """``(columns, rowid alias)``; the rowid is part of every index, so it never needs covering"""
+        info = self.conn.execute(f"PRAGMA table_info({table})").fetchall()
+        keys = [row for row in info if row[5]]
+        rowid = keys[0][1] if len(keys) == 1 and keys[0][2].upper() == 'INTEGER' else None
+        return [row[1] for row in info], rowid
+
+    @staticmethod
+    def _read_columns(statement, table, aliases, columns):
+        """Columns of ``table`` the statement reads, in order of appearance; None when it selects them all"""
+        for qualifier in SELECT_ALL.findall(statement):
+            if not qualifier or aliases.get(qualifier) == table:
+                return None
+        found = []
+        for qualifier, column in COLUMN_REF.findall(LITERAL.sub("''", statement)):
+            if qualifier:
+                owner = aliases.get(qualifier)
+            else:
+                # Unqualified names belong to the one table of the statement that has such a column
+                owners = [name for name, names in columns.items() if column in names]
+                owner = owners[0] if len(owners) == 1 else None
+            if owner == table and column not in found:
+                found.append(column)
+        return found
+
+    def propose(self, statement):
+        """Index proposals ``(table, columns)`` for the filtered tables of one statement"""
+        aliases = self._aliases(statement)
+        tables = set(aliases.values())
+        where = re.split(r'\bWHERE\b', statement, maxsplit=1, flags=re.IGNORECASE)
+        where = CLAUSE_END.split(where[1])[0] if len(where) > 1 else ''
+        columns = {table: self._columns(table)[0] for table in tables}
+
+        proposals = []
+        for table in sorted(tables):
+            table_columns, rowid = self._columns(table)
+            equality, ranges = [], []
+            for qualifier, column, operator in PREDICATE.findall(where):
+                owner = aliases.get(qualifier) if qualifier else (table if len(tables) == 1 else None)
+                if owner != table or column not in table_columns or column in equality + ranges:
+                    continue
+                (equality if operator.upper() in ('=', 'IN') else ranges).append(column)
+
+            # Equality columns first, then a single range column
+            filters = equality + ranges[:1]
+            if not filters or rowid in filters:
+                continue
+            read = self._read_columns(statement, table, aliases, columns)
+            leading = set(equality or ranges[:1])
+            existing = [index for index in self._indexes(table) if index[0] in leading]
+            covering = None if read is None else filters + [c for c in read if c not in filters and c != rowid]
+            if covering is None or len(covering) > MAX_INDEX_COLUMNS:
+                # Not coverable: an index led by any equality column (or the range column) already serves the filter
+                if existing:
+                    continue
+                proposals.append((table, tuple(filters)))
+            elif not any(set(covering) <= set(index) for index in existing):
+                proposals.append((table, tuple(covering)))
+        return proposals
+
+    @staticmethod
+    def index_name(table, columns):
+        return f"idx_advisor_{table}_{'_'.join(columns)}"
+
+    @classmethod
+    def index_sql(cls, table, columns):
+        return f"CREATE INDEX IF NOT EXISTS {cls.index_name(table, columns)} ON {table} ({', '.join(columns)})"
+
+def _time_statement(conn, statement, params, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(statement, params).fetchall()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def _capture_workload():
+    """Run the representative workload on this process's ``db`` and return the captured statements"""
+    with db.capture_workload() as workload:
+        representative_workload()
+    return workload
+
+def capture_workload_on(database):
+    """Capture the representative workload against ``database`` (a file) in a spawned process.
+
+    The ORM always goes through the global ``db``; a spawned worker imports
+    ``database`` afresh, so the URL decides which file its ``db`` opens and
+    this process's ``db`` is never pointed elsewhere.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        saved_url = os.environ.get('CAR_RENTAL_DATABASE_URL')
+        os.environ['CAR_RENTAL_DATABASE_URL'] = database.db_name
+        try:
+            # The worker process starts here and inherits the environment as it is now
+            future = pool.submit(_capture_workload)
+        finally:
+            if saved_url is None:
+                del os.environ['CAR_RENTAL_DATABASE_URL']
+            else:
+                os.environ['CAR_RENTAL_DATABASE_URL'] = saved_url
+        return future.result()
+
+def advise(rentals=20000, repeat=5):
+    """Capture the workload on a benchmark copy and measure the proposed indexes.
+
+    Returns ``(statements, proposals)``: one result per captured SELECT with
+    plans and timings before/after, and the CREATE INDEX statements proposed.
+    """
+    db.require_sqlite("The index advisor")
+    bench = Database.temporary(initialize=False)
+    try:
+        build_benchmark_database(bench.db_name, rentals)
+        workload = capture_workload_on(bench)
+
+        conn = bench.get_connection()
+        advisor = IndexAdvisor(conn)
+        selects = [(s, entry['params']) for s, entry in workload.items() if s.upper().startswith('SELECT')]
+
+        results = []
+        candidates = {}
+        for statement, params in selects:
+            found = advisor.propose(statement)
+            for table, columns in found:
+                candidates[IndexAdvisor.index_sql(table, columns)] = IndexAdvisor.index_name(table, columns)
+            results.append({
+                'statement': statement,
+                'plan_before': advisor.plan(statement, params),
+                'ms_before': _time_statement(conn, statement, params, repeat),
+                'proposed': [IndexAdvisor.index_sql(t, c) for t, c in found],
+            })
+
+        for sql in candidates:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        # Per candidate index: [time before, time after] of the statements that use it
+        gains = {name: [0.0, 0.0] for name in candidates.values()}
+        for result, (statement, params) in zip(results, selects):
+            result['plan_after'] = advisor.plan(statement, params)
+            result['ms_after'] = _time_statement(conn, statement, params, repeat)
+            for name in gains:
+                if any(name in step for step in result['plan_after']):
+                    gains[name][0] += result['ms_before']
+                    gains[name][1] += result['ms_after']
+        conn.close()
+
+        # Keep only indexes the planner chose and that made those statements clearly (20%+) faster
+        proposals = [sql for sql, name in candidates.items() if gains[name][1] and gains[name][1] < gains[name][0] * 0.8]
+        for result in results:
+            result['proposed'] = [sql for sql in result['proposed'] if sql in proposals]
+        return results, proposals
+    finally:
+        bench.close()
+
+def apply_indexes(statements):
+    """Create the proposed indexes on the live database"""
+    db.require_sqlite("The index advisor")
+    with db.transaction() as conn:
+        for sql in statements:
+            db.execute(conn, sql)
@@ -0,0 +1,140 @@
+"""
+Operational metrics - per-operation counters and latency histograms, exported
+in the Prometheus text format (endpoint, text file) and as a summary table.
+"""
+
+import atexit
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Histogram upper bounds in seconds: 0.1 ms growing by sqrt(2) up to ~52 s
+BUCKETS = tuple(round(0.0001 * 2 ** (i / 2), 7) for i in range(39))
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket, as histogram_quantile() does"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+class MetricsRegistry:
+    """Thread-safe store of one Histogram per operation name"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def _histogram(self, operation):
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            histogram = self.histograms.setdefault(operation, Histogram())
+        return histogram
+
+    def observe(self, operation, seconds, failed=False):
+        with self.lock:
+            histogram = self._histogram(operation)
+            histogram.observe(seconds)
+            if failed:
+                histogram.errors += 1
+
+    @contextmanager
+    def timer(self, operation):
+        """Time the enclosed block; exceptions are counted as errors and re-raised"""
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(operation, time.perf_counter() - started, failed)
+
+    def timed(self, operation):
+        """Decorator form of ``timer``"""
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(operation):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def summary(self):
+        """One dict per operation: count, errors, mean and p50/p95/p99 in milliseconds"""
+        with self.lock:
+            return [{
+                'operation': operation,
+                'count': h.count,
+                'errors': h.errors,
+                'mean_ms': round(h.total / h.count * 1000, 3) if h.count else 0.0,
+                'p50_ms': round(h.quantile(0.50) * 1000, 3),
+                'p95_ms': round(h.quantile(0.95) * 1000, 3),
+                'p99_ms': round(h.quantile(0.99) * 1000, 3),
+            } for operation, h in sorted(self.histograms.items())]
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP car_rental_operation_seconds Latency of car rental operations.',
+            '# TYPE car_rental_operation_seconds histogram',
+        ]
+        errors = [
+            '# HELP car_rental_operation_errors_total Operations that raised an error.',
+            '# TYPE car_rental_operation_errors_total counter',
+        ]
+        with self.lock:
+            for operation, h in sorted(self.histograms.items()):
+                label = f'operation="{operation}"'
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, h.counts):
+                    cumulative += bucket_count
+                    lines.append(f'car_rental_operation_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+                lines.append(f'car_rental_operation_seconds_bucket{{{label},le="+Inf"}} {h.count}')
+                lines.append(f'car_rental_operation_seconds_sum{{{label}}} {h.total:.6f}')
+                lines.append(f'car_rental_operation_seconds_count{{{label}}} {h.count}')
+                errors.append(f'car_rental_operation_errors_total{{{label}}} {h.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+    def write_textfile(self, path):
+        """Atomically write the Prometheus text (for node_exporter's textfile collector)"""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
+
+# Shared registry for the process
+metrics = MetricsRegistry()
+
+# Any process (CLI, interactive session, API server) can leave its metrics behind on exit
+if os.environ.get('CAR_RENTAL_METRICS_FILE'):
+    atexit.register(metrics.write_textfile, os.environ['CAR_RENTAL_METRICS_FILE'])
@@ -0,0 +1,270 @@
+import csv
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from database import db, epoch_day
+from models.orm import CarRentalORM, MAINTENANCE_WINDOW_DAYS, MAINTENANCE_WINDOWS
+from models import coverage
+from models.coverage import coverage_index
+
+REQUEST_FIELDS = ('customer_id', 'location_id', 'vehicle_type', 'start_date', 'end_date')
+
+# Free-from day of a vehicle with no bookings at all (idle for ever)
+NEVER_BOOKED = float('-inf')
+
+class VehicleSchedule:
+    """Sorted, non-overlapping busy periods of one vehicle as [start, end) day numbers"""
+
+    def __init__(self, vehicle):
+        self.vehicle = vehicle
+        self.starts = []
+        self.ends = []
+
+    def book(self, start, end):
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+
+    def idle_before(self, start, end):
+        """Idle days between the previous booking and ``start``, or None if [start, end) clashes"""
+        index = bisect_left(self.starts, start)
+        if index < len(self.starts) and self.starts[index] < end:
+            return None
+        if index > 0:
+            if self.ends[index - 1] > start:
+                return None
+            return start - self.ends[index - 1]
+        return float('inf')
+
+    @property
+    def free_from(self):
+        """End of the last busy period (NEVER_BOOKED when there is none)"""
+        return max(self.ends, default=NEVER_BOOKED)
+
+class FreeIndex:
+    """Vehicles ordered by the day they are free from, overall and per branch.
+
+    Only holds vehicles whose bookings all end by the request being placed,
+    so a vehicle is free for ``[start, end)`` exactly when its free-from day
+    is at most ``start``, and the tightest fit is the one just below it.
+    """
+
+    def __init__(self):
+        self.all = []
+        self.by_location = {}
+
+    def _entry(self, schedule):
+        # Walked downwards, so ties on the free-from day come out lowest id first
+        return (schedule.free_from, -schedule.vehicle['id'], schedule)
+
+    def add(self, schedule):
+        entry = self._entry(schedule)
+        insort(self.all, entry)
+        insort(self.by_location.setdefault(schedule.vehicle['location_id'], []), entry)
+
+    def remove(self, schedule):
+        entry = self._entry(schedule)
+        for entries in (self.all, self.by_location[schedule.vehicle['location_id']]):
+            del entries[bisect_left(entries, entry)]
+
+    def first_fit(self, start, accept, location_id=None):
+        """Tightest-fitting vehicle free by ``start`` that ``accept`` takes, optionally at one branch"""
+        entries = self.all if location_id is None else self.by_location.get(location_id, [])
+        for index in range(bisect_right(entries, (start, float('inf'))) - 1, -1, -1):
+            if accept(entries[index][2]):
+                return entries[index][2]
+        return None
+
+class ReservationAllocator:
+    """Assigns vehicles to a batch of reservation requests.
+
+    Requests are processed in order of end date and each one goes to the
+    compatible vehicle that has been idle for the shortest time before it
+    (best fit), which is the classic greedy for packing the most intervals
+    onto a fixed set of machines. Insured vehicles come first, then
+    vehicles at the requested branch; another branch is only used when none
+    is free there.
+
+    Because requests arrive by end date, every vehicle's bookings from this
+    batch end by the current request, and a ``FreeIndex`` per vehicle type
+    (split by whether the vehicle has any cover at all) finds the best fit
+    with a bisect instead of a scan of the fleet. Vehicles that still have
+    an existing booking or service ending later wait in a heap keyed by
+    that end and are checked one by one until the batch passes it.
+    """
+
+    def __init__(self):
+        self.schedules = {}
+        self.free = {}
+        self.waiting = {}
+        self.insured = coverage_index.insured_vehicles()
+        self._load_fleet()
+
+    def _load_fleet(self):
+        vehicles = db.fetch_all("SELECT * FROM vehicles WHERE available = 1 AND status != 'maintenance'")
+        for vehicle in vehicles:
+            self.schedules[vehicle['id']] = VehicleSchedule(vehicle)
+
+        today = epoch_day()
+        bookings = db.fetch_all("""
+            SELECT vehicle_id, start_day, end_day FROM rentals
+            WHERE status IN ('active', 'reserved') AND end_day >= ?
+        """, (today,))
+        for booking in bookings:
+            schedule = self.schedules.get(booking['vehicle_id'])
+            if schedule:
+                schedule.book(booking['start_day'], booking['end_day'])
+
+        # Scheduled and predicted services block the vehicle like a booking, including one already under way
+        services = db.fetch_all(f"""
+            SELECT w.vehicle_id, w.start_day FROM ({MAINTENANCE_WINDOWS}) w
+            WHERE w.start_day + {MAINTENANCE_WINDOW_DAYS} > ?
+        """, (today,))
+        for service in services:
+            schedule = self.schedules.get(service['vehicle_id'])
+            if schedule:
+                schedule.book(service['start_day'], service['start_day'] + MAINTENANCE_WINDOW_DAYS)
+
+        for vehicle_id, schedule in self.schedules.items():
+            heapq.heappush(self.waiting.setdefault(schedule.vehicle['vehicle_type'], []),
+                           (schedule.free_from, vehicle_id, schedule))
+
+    def _free_index(self, schedule):
+        key = (schedule.vehicle['vehicle_type'], schedule.vehicle['id'] in self.insured)
+        return self.free.setdefault(key, FreeIndex())
+
+    def _release_waiting(self, vehicle_type, end):
+        """Move vehicles whose bookings all end by ``end`` into the free indexes"""
+        waiting = self.waiting.get(vehicle_type, [])
+        while waiting and waiting[0][0] <= end:
+            schedule = heapq.heappop(waiting)[2]
+            self._free_index(schedule).add(schedule)
+
+    def _best_fit(self, request, start, end):
+        """Vehicle for a request, preferring insured, then local, then the tightest fit"""
+        vehicle_type, location_id = request['vehicle_type'], request['location_id']
+        candidates = []
+
+        def covered(schedule):
+            return coverage_index.is_covered(schedule.vehicle['id'], request['start_date'], request['end_date'])
+
+        def consider(schedule, is_covered):
+            if schedule is not None and (is_covered or not coverage.REQUIRE_COVER):
+                rank = (not is_covered, schedule.vehicle['location_id'] != location_id,
+                        schedule.idle_before(start, end))
+                candidates.append((rank, schedule.vehicle['id'], schedule))
+
+        def elsewhere(schedule):
+            return schedule.vehicle['location_id'] != location_id
+
+        for at in (location_id, None):
+            accept = (lambda schedule: True) if at is not None else elsewhere
+            insured = self.free.get((vehicle_type, True))
+            if insured:
+                consider(insured.first_fit(start, lambda s: accept(s) and covered(s), at), True)
+                fallback = insured.first_fit(start, accept, at)
+                consider(fallback, fallback is not None and covered(fallback))
+            uninsured = self.free.get((vehicle_type, False))
+            if uninsured:
+                consider(uninsured.first_fit(start, accept, at), False)
+
+        # Vehicles with a later booking still ahead may have a gap that fits
+        for _, _, schedule in self.waiting.get(vehicle_type, []):
+            if schedule.idle_before(start, end) is not None:
+                consider(schedule, covered(schedule))
+        return min(candidates, key=lambda c: c[:2])[2] if candidates else None
+
+    @staticmethod
+    def load_requests(path):
+        """Read reservation requests from a CSV file with REQUEST_FIELDS columns"""
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            missing = set(REQUEST_FIELDS) - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+            requests = []
+            for line, row in enumerate(reader, start=2):
+                try:
+                    for field in ('start_date', 'end_date'):
+                        epoch_day(row[field])
+                    requests.append({
+                        'customer_id': int(row['customer_id']),
+                        'location_id': int(row['location_id']),
+                        'vehicle_type': row['vehicle_type'],
+                        'start_date': row['start_date'],
+                        'end_date': row['end_date'],
+                    })
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"Line {line}: {e}") from e
+            return requests
+
+    def allocate(self, requests):
+        """Return ``(assignments, unassigned)`` for a list of request dicts"""
+        assignments = []
+        unassigned = []
+        ordered = sorted(requests, key=lambda r: (r['end_date'], r['start_date']))
+
+        for request in ordered:
+            start, end = epoch_day(request['start_date']), epoch_day(request['end_date'])
+            if end <= start:
+                unassigned.append(request)
+                continue
+
+            self._release_waiting(request['vehicle_type'], end)
+            schedule = self._best_fit(request, start, end)
+            if schedule is None:
+                unassigned.append(request)
+                continue
+
+            if schedule.free_from <= end:
+                # In a free index: re-file it under its new free-from day
+                self._free_index(schedule).remove(schedule)
+                schedule.book(start, end)
+                self._free_index(schedule).add(schedule)
+            else:
+                schedule.book(start, end)
+            assignments.append({
+                'request': request,
+                'vehicle': schedule.vehicle,
+                'transfer': schedule.vehicle['location_id'] != request['location_id'],
+                'days': end - start,
+            })
+
+        return assignments, unassigned
+
+    @staticmethod
+    def result_rows(assignments, unassigned, rental_ids=()):
+        """One row per request: the vehicle it got (None if unassigned) and the reservation created"""
+        rental_ids = dict(enumerate(rental_ids))
+        rows = []
+        for index, assignment in enumerate(assignments):
+            rows.append({**assignment['request'], 'vehicle_id': assignment['vehicle']['id'],
+                         'transfer': int(assignment['transfer']), 'days': assignment['days'],
+                         'rental_id': rental_ids.get(index)})
+        for request in unassigned:
+            rows.append({**request, 'vehicle_id': None, 'transfer': 0, 'days': 0, 'rental_id': None})
+        return rows
+
+    @staticmethod
+    def commit(assignments):
+        """Create reserved rentals, demand-priced like any booking, for every assignment in one transaction.
+
+        Raises ValueError, writing nothing, if a vehicle was booked elsewhere
+        since the batch was allocated.
+        """
+        # Priced up front so a failing quote leaves nothing half-written
+        priced = []
+        for assignment in assignments:
+            request, vehicle = assignment['request'], assignment['vehicle']
+            _, total, _ = CarRentalORM.quote_rental(vehicle['id'], request['start_date'], request['end_date'])
+            priced.append((request, vehicle, total))
+        rental_ids = []
+        with db.transaction(immediate=True) as conn:
+            for request, vehicle, total in priced:
+                CarRentalORM.check_vehicle_free(conn, vehicle['id'], request['start_date'], request['end_date'])
+                data = {
+                    'customer_id': request['customer_id'], 'vehicle_id': vehicle['id'],
+                    'start_date': request['start_date'], 'end_date': request['end_date'],
+                    'total_amount': total, 'status': 'reserved'
+                }
+                rental_ids.append(CarRentalORM.create('rentals', data, conn=conn))
+        return rental_ids
@@ -0,0 +1,178 @@
+import os
+import threading
+from bisect import bisect_right
+from datetime import date
+
+from database import db, epoch_day, EPOCH_ORDINAL
+
+# Refuse bookings on uninsured dates only when asked to; until every vehicle
+# has policies entered, an uninsured booking is allowed and reported instead
+REQUIRE_COVER = os.environ.get('CAR_RENTAL_REQUIRE_INSURANCE') == '1'
+
+def _day_date(day):
+    return date.fromordinal(day + EPOCH_ORDINAL).isoformat()
+
+class CoverageIndex:
+    """Per-vehicle interval index of insurance cover.
+
+    Policies are inclusive ``[start_day, end_day]``; each vehicle keeps its
+    cover merged into sorted, disjoint half-open runs ``[start, end)`` held
+    in two parallel lists, so "is [A, B] covered" is one bisect. The index is
+    built lazily in one ordered pass and rebuilt after writes to insurance.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = None
+
+    def invalidate(self):
+        with self.lock:
+            self.runs = None
+
+    def on_write(self, table):
+        """ORM write listener"""
+        if table in ('insurance', 'vehicles'):
+            self.invalidate()
+
+    def _build(self):
+        runs = {}
+        policies = db.fetch_all("""
+            SELECT vehicle_id, start_day, end_day FROM insurance
+            WHERE start_day IS NOT NULL AND end_day IS NOT NULL
+            ORDER BY vehicle_id, start_day
+        """)
+        for policy in policies:
+            starts, ends = runs.setdefault(policy['vehicle_id'], ([], []))
+            start, end = policy['start_day'], policy['end_day'] + 1
+            # Policies arrive sorted by start, so a run only ever grows at the tail
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return runs
+
+    def _runs(self):
+        with self.lock:
+            if self.runs is None:
+                self.runs = self._build()
+            return self.runs
+
+    def insured_vehicles(self):
+        """Ids of vehicles with at least one dated policy; no other vehicle is ever covered"""
+        return set(self._runs())
+
+    def is_covered(self, vehicle_id, start_date, end_date):
+        """True when one continuous run of cover spans every day from start_date to end_date inclusive"""
+        starts, ends = self._runs().get(vehicle_id, ((), ()))
+        start, end = epoch_day(start_date), epoch_day(end_date) + 1
+        index = bisect_right(starts, start) - 1
+        return index >= 0 and ends[index] >= end
+
+    def gaps(self, vehicle_id, start_date, end_date):
+        """Uncovered ``(first_day, last_day)`` date pairs between two dates (inclusive)"""
+        starts, ends = self._runs().get(vehicle_id, ((), ()))
+        cursor, end = epoch_day(start_date), epoch_day(end_date) + 1
+        found = []
+        for index in range(max(bisect_right(starts, cursor) - 1, 0), len(starts)):
+            if starts[index] >= end:
+                break
+            if starts[index] > cursor:
+                found.append((_day_date(cursor), _day_date(starts[index] - 1)))
+            cursor = max(cursor, ends[index])
+        if cursor < end:
+            found.append((_day_date(cursor), _day_date(end - 1)))
+        return found
+
+def audit_coverage(horizon_days=90):
+    """Fleet-wide insurance audit in one sorted sweep over policies and open rentals.
+
+    Checks every in-service vehicle from today to ``horizon_days`` ahead and
+    returns ``{'uncovered': [...], 'gaps': [...], 'overlaps': [...],
+    'rentals_at_risk': [...]}``.
+    """
+    today = epoch_day()
+    horizon = today + horizon_days + 1
+    # Rows arrive grouped by vehicle and sorted by start day, policies first on ties
+    rows = db.fetch_all("""
+        SELECT v.id AS vehicle_id, v.license_plate, e.kind, e.record_id, e.start_day, e.end_day
+        FROM vehicles v
+        LEFT JOIN (
+            SELECT vehicle_id, 0 AS kind, id AS record_id, start_day, end_day + 1 AS end_day
+            FROM insurance WHERE end_day >= ?
+            UNION ALL
+            SELECT vehicle_id, 1 AS kind, id AS record_id, start_day, end_day + 1 AS end_day
+            FROM rentals WHERE status IN ('active', 'reserved') AND end_day >= ?
+        ) e ON e.vehicle_id = v.id
+        WHERE v.available = 1
+        ORDER BY v.id, e.start_day, e.kind
+    """, (today, today))
+
+    report = {'uncovered': [], 'gaps': [], 'overlaps': [], 'rentals_at_risk': []}
+
+    def finish(vehicle):
+        if not vehicle['runs']:
+            report['uncovered'].append({'vehicle_id': vehicle['vehicle_id'], 'license_plate': vehicle['license_plate']})
+        cursor = today
+        for run_start, run_end in vehicle['runs'] + [[horizon, horizon]]:
+            if run_start > cursor and vehicle['runs'] and cursor < horizon:
+                report['gaps'].append({'vehicle_id': vehicle['vehicle_id'], 'license_plate': vehicle['license_plate'],
+                                       'from': _day_date(cursor), 'to': _day_date(min(run_start, horizon) - 1)})
+            cursor = max(cursor, run_end)
+        starts = [run[0] for run in vehicle['runs']]
+        for rental in vehicle['rentals']:
+            start = max(rental['start_day'], today)
+            index = bisect_right(starts, start) - 1
+            if index < 0 or vehicle['runs'][index][1] < rental['end_day']:
+                report['rentals_at_risk'].append({
+                    'rental_id': rental['record_id'], 'vehicle_id': vehicle['vehicle_id'],
+                    'start_date': _day_date(rental['start_day']), 'end_date': _day_date(rental['end_day'] - 1)})
+
+    vehicle = None
+    for row in rows:
+        if vehicle is None or row['vehicle_id'] != vehicle['vehicle_id']:
+            if vehicle is not None:
+                finish(vehicle)
+            vehicle = {'vehicle_id': row['vehicle_id'], 'license_plate': row['license_plate'],
+                       'runs': [], 'rentals': [], 'last_policy': None, 'last_end': None}
+        if row['kind'] == 1:
+            vehicle['rentals'].append(row)
+        elif row['kind'] == 0:
+            if vehicle['last_end'] is not None and row['start_day'] < vehicle['last_end']:
+                report['overlaps'].append({
+                    'vehicle_id': row['vehicle_id'], 'policy_ids': [vehicle['last_policy'], row['record_id']],
+                    'from': _day_date(row['start_day']), 'to': _day_date(min(vehicle['last_end'], row['end_day']) - 1)})
+            if vehicle['last_end'] is None or row['end_day'] > vehicle['last_end']:
+                vehicle['last_policy'], vehicle['last_end'] = row['record_id'], row['end_day']
+            # Merge into the cover runs (clipped to today)
+            start = max(row['start_day'], today)
+            runs = vehicle['runs']
+            if runs and start <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], row['end_day'])
+            else:
+                runs.append([start, row['end_day']])
+    if vehicle is not None:
+        finish(vehicle)
+    return report
+
+def audit_rows(report):
+    """``audit_coverage`` findings flattened to one row per issue"""
+    rows = []
+    def add(issue, finding, **extra):
+        rows.append({
+            'issue': issue, 'vehicle_id': finding['vehicle_id'], 'license_plate': finding.get('license_plate'),
+            'rental_id': finding.get('rental_id'), 'policy_ids': extra.get('policy_ids'),
+            'from': extra.get('start', finding.get('from')), 'to': extra.get('end', finding.get('to')),
+        })
+    for finding in report['uncovered']:
+        add('uncovered', finding)
+    for finding in report['gaps']:
+        add('gap', finding)
+    for finding in report['overlaps']:
+        add('overlap', finding, policy_ids=' '.join(map(str, finding['policy_ids'])))
+    for finding in report['rentals_at_risk']:
+        add('rental_at_risk', finding, start=finding['start_date'], end=finding['end_date'])
+    return rows
+
+# Shared coverage index for the process
+coverage_index = CoverageIndex()
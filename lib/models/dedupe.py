@@ -0,0 +1,290 @@
+import random
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+from database import db
+from models.orm import CarRentalORM
+
+# MinHash signature length and LSH banding: names sharing all rows of any band become candidates
+NUM_HASHES = 15
+BAND_ROWS = 3
+
+# Universal hash family (a * x + b) mod p, one (a, b) per signature position
+_PRIME = (1 << 61) - 1
+_HASH_PARAMS = [tuple(random.Random(index).randrange(1, _PRIME) for _ in range(2)) for index in range(NUM_HASHES)]
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+def normalize_text(value):
+    """Lowercase ASCII letters, digits and single spaces"""
+    value = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', value.lower()).split())
+
+def normalize_phone(value):
+    """National significant number: digits without the +254 / 0 prefix"""
+    digits = re.sub(r'\D', '', value or '')
+    if digits.startswith('254'):
+        digits = digits[3:]
+    return digits.lstrip('0')
+
+def normalize_email(value):
+    """Mailbox part of an address without dots or +tags"""
+    local = (value or '').lower().split('@')[0]
+    return local.split('+')[0].replace('.', '')
+
+def soundex(word):
+    """American Soundex code (letter + 3 digits) of the first word, '' for no letters"""
+    letters = re.sub(r'[^a-z]', '', word.lower())
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+@lru_cache(maxsize=1 << 16)
+def _shingle_hashes(shingle):
+    # Names share a small vocabulary of trigrams, so each is hashed once
+    value = zlib.crc32(shingle.encode())
+    return tuple((a * value + b) % _PRIME for a, b in _HASH_PARAMS)
+
+def minhash(shingles):
+    """MinHash signature of a set of strings: per hash function, the smallest hash of any member"""
+    if not shingles:
+        return (0,) * NUM_HASHES
+    return tuple(map(min, zip(*map(_shingle_hashes, shingles))))
+
+def _agreement(a, b):
+    """Share of equal MinHash positions: an estimate of the Jaccard similarity of the two sets"""
+    return sum(map(int.__eq__, a, b)) / NUM_HASHES
+
+def _ratio(a, b):
+    return 1.0 if a == b else SequenceMatcher(None, a, b).ratio()
+
+def _one_edit_apart(a, b):
+    """True when one substitution, insertion, deletion or swap of neighbours turns ``a`` into ``b``"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    swapped = a[i:i + 1] == b[i + 1:i + 2] and a[i + 1:i + 2] == b[i:i + 1]
+    return a[i + 1:] == b[i + 1:] or (swapped and a[i + 2:] == b[i + 2:])
+
+def _identifier_match(a, b):
+    """1.0 for equal identifiers, 0.8 for a single typo, otherwise 0"""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    return 0.8 if _one_edit_apart(a, b) else 0.0
+
+class CustomerDeduplicator:
+    """Finds customers that are probably the same person.
+
+    Every customer gets a few blocking keys: the phone number, the mailbox,
+    the Soundex codes of both names (in either order) and LSH bands of a
+    MinHash over the name's character trigrams. Only customers sharing a
+    key are compared, so the work grows with the number of customers rather
+    than the number of pairs; keys shared by more than ``max_block``
+    customers (e.g. a common surname) are skipped, and name-based pairs
+    whose signatures agree on less than ``min_agreement`` are dropped
+    before scoring. Pairs scoring at least ``threshold`` are grouped into
+    merge proposals that keep the customer with the most rentals.
+    """
+
+    NAME_WEIGHT = 0.6  # the rest of the score is the best-matching identifier
+
+    def __init__(self, threshold=0.85, max_block=50, min_agreement=0.4):
+        self.threshold = threshold
+        self.max_block = max_block
+        self.min_agreement = min_agreement
+        self.stats = {}
+
+    @staticmethod
+    def _profile(row):
+        first, last = normalize_text(row['first_name']), normalize_text(row['last_name'])
+        name = f'{first} {last}'.strip()
+        return {
+            'id': row['id'], 'name': f"{row['first_name']} {row['last_name']}",
+            'name_key': ' '.join(sorted(name.split())), 'signature': minhash(trigrams(name)),
+            'phone': normalize_phone(row['phone']), 'email': normalize_email(row['email']),
+            'license': normalize_text(row['license_number']).replace(' ', ''),
+            'date_of_birth': row['date_of_birth'],
+            'soundex': ' '.join(sorted((soundex(first), soundex(last)))),
+        }
+
+    @staticmethod
+    def _blocking_keys(profile):
+        """``(kind, ...)`` tuples; 'soundex' and 'band' keys only say the names look alike"""
+        keys = []
+        if len(profile['phone']) >= 7:
+            keys.append(('phone', profile['phone']))
+        if profile['email']:
+            keys.append(('email', profile['email']))
+        if profile['soundex'].strip():
+            keys.append(('soundex', profile['soundex']))
+        signature = profile['signature']
+        for start in range(0, NUM_HASHES, BAND_ROWS):
+            keys.append(('band', start, signature[start:start + BAND_ROWS]))
+        return keys
+
+    @staticmethod
+    def _identifiers(a, b):
+        """Strongest identifier match of two profiles, between 0 and 1.
+
+        Emails and license numbers are unique, so a duplicate always differs
+        in them somewhere; only equal or one-typo-apart values count.
+        """
+        return max(_identifier_match(a['phone'], b['phone']), _identifier_match(a['license'], b['license']),
+                   _identifier_match(a['email'], b['email']))
+
+    @classmethod
+    def score(cls, a, b, identifiers=None):
+        """Match score between 0 and 1: name similarity plus the strongest identifier match.
+
+        A shared name alone never reaches a useful score; different dates
+        of birth halve it.
+        """
+        if identifiers is None:
+            identifiers = cls._identifiers(a, b)
+        score = cls.NAME_WEIGHT * _ratio(a['name_key'], b['name_key']) + (1 - cls.NAME_WEIGHT) * identifiers
+        if a['date_of_birth'] and b['date_of_birth'] and a['date_of_birth'] != b['date_of_birth']:
+            score *= 0.5
+        return score
+
+    def find_duplicates(self):
+        """Merge proposals: ``[{'keep_id', 'keep_name', 'merge_ids', 'merge_names', 'score', 'rentals'}]``"""
+        profiles = {}
+        blocks = defaultdict(list)
+        for row in db.iter_rows("SELECT id, first_name, last_name, email, phone, license_number, date_of_birth FROM customers"):
+            profile = self._profile(row)
+            profiles[profile['id']] = profile
+            for key in self._blocking_keys(profile):
+                blocks[key].append(profile['id'])
+
+        # Cheap checks first: identifiers bound the score, MinHash agreement stands in for the name
+        needed = (self.threshold - self.NAME_WEIGHT) / (1 - self.NAME_WEIGHT)
+        seen, candidates = set(), {}
+        oversize = 0
+        for key, members in blocks.items():
+            if len(members) > self.max_block:
+                oversize += 1
+                continue
+            by_name = key[0] in ('soundex', 'band')
+            for i, a in enumerate(members):
+                for b in members[i + 1:]:
+                    if (a, b) in seen:
+                        continue
+                    seen.add((a, b))
+                    identifiers = self._identifiers(profiles[a], profiles[b])
+                    if identifiers < needed:
+                        continue
+                    if by_name and _agreement(profiles[a]['signature'], profiles[b]['signature']) < self.min_agreement:
+                        continue
+                    candidates[(a, b)] = identifiers
+
+        # Union-find over the matching pairs
+        parent = {}
+        def find(node):
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+        weakest = {}
+        matches = 0
+        for (a, b), identifiers in candidates.items():
+            score = self.score(profiles[a], profiles[b], identifiers)
+            if score < self.threshold:
+                continue
+            matches += 1
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+                weakest[root_a] = min(weakest.get(root_a, 1.0), weakest.pop(root_b, 1.0), score)
+            else:
+                weakest[root_a] = min(weakest.get(root_a, 1.0), score)
+
+        clusters = defaultdict(list)
+        for node in list(parent):
+            clusters[find(node)].append(node)
+
+        rentals = {row['customer_id']: row['rentals'] for row in db.fetch_all(
+            "SELECT customer_id, COUNT(*) AS rentals FROM rentals GROUP BY customer_id")}
+        proposals = []
+        for root, members in clusters.items():
+            members.sort(key=lambda customer_id: (-rentals.get(customer_id, 0), customer_id))
+            keep, duplicates = members[0], sorted(members[1:])
+            proposals.append({
+                'keep_id': keep, 'keep_name': profiles[keep]['name'],
+                'merge_ids': duplicates, 'merge_names': [profiles[d]['name'] for d in duplicates],
+                'score': round(weakest[root], 3),
+                'rentals': sum(rentals.get(d, 0) for d in duplicates),
+            })
+
+        self.stats = {
+            'customers': len(profiles), 'blocks': len(blocks), 'oversize_blocks': oversize,
+            'compared_pairs': len(seen), 'candidate_pairs': len(candidates), 'matches': matches, 'proposals': len(proposals),
+        }
+        return sorted(proposals, key=lambda p: (-p['score'], p['keep_id']))
+
+    @staticmethod
+    def merge(keep_id, duplicate_ids):
+        """Fold duplicates into ``keep_id`` in one transaction; returns the number of rentals moved.
+
+        Rentals and customer documents are re-pointed, VIP status and a
+        missing phone or date of birth are carried over, then the
+        duplicates are deleted. The rental event log keeps the customer
+        IDs it recorded at the time.
+        """
+        # Customer documents move too, and they only exist on SQLite
+        db.require_sqlite("Merging customers")
+        duplicate_ids = sorted(set(duplicate_ids) - {keep_id})
+        if not duplicate_ids:
+            raise ValueError("Nothing to merge!")
+        placeholders = ', '.join('?' for _ in duplicate_ids)
+        with db.transaction() as conn:
+            found = db.execute(conn, f"SELECT COUNT(*) FROM customers WHERE id IN (?, {placeholders})",
+                               (keep_id, *duplicate_ids)).fetchone()[0]
+            if found != len(duplicate_ids) + 1:
+                raise ValueError("Customer not found!")
+            moved = db.execute(conn, f"UPDATE rentals SET customer_id = ? WHERE customer_id IN ({placeholders})",
+                               (keep_id, *duplicate_ids)).rowcount
+            db.execute(conn, f"""
+                UPDATE documents SET owner_id = ? WHERE owner_type = 'customer' AND owner_id IN ({placeholders})
+            """, (keep_id, *duplicate_ids))
+            db.execute(conn, f"""
+                UPDATE customers SET
+                    is_vip = CASE WHEN EXISTS (SELECT 1 FROM customers WHERE id IN ({placeholders}) AND is_vip = 1)
+                                  THEN 1 ELSE is_vip END,
+                    phone = COALESCE(phone, (SELECT phone FROM customers WHERE id IN ({placeholders}) AND phone IS NOT NULL)),
+                    date_of_birth = COALESCE(date_of_birth, (SELECT date_of_birth FROM customers
+                                                             WHERE id IN ({placeholders}) AND date_of_birth IS NOT NULL))
+                WHERE id = ?
+            """, (*duplicate_ids, *duplicate_ids, *duplicate_ids, keep_id))
+            db.execute(conn, f"DELETE FROM customers WHERE id IN ({placeholders})", tuple(duplicate_ids))
+        CarRentalORM.notify('rentals')
+        CarRentalORM.notify('customers')
+        return moved
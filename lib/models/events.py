@@ -0,0 +1,178 @@
+from database import db
+from metrics import metrics
+from datetime import datetime, timedelta
+
+# Rental status reached after each event type
+EVENT_STATUS = {
+    'reserved': 'reserved',
+    'picked_up': 'active',
+    'returned': 'completed',
+    'cancelled': 'cancelled',
+}
+
+INSERT_EVENT = """
+    INSERT INTO rental_events
+        (rental_id, vehicle_id, customer_id, event_type, event_date, start_date, end_date, total_amount)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+class RentalEventLog:
+    """Append-only history of rental state changes.
+
+    Events are written on the caller's connection so they commit (or roll
+    back) together with the change to ``rentals`` that produced them.
+    """
+
+    @staticmethod
+    def append(conn, rental, event_type, event_date=None):
+        """Append a single event for a rental row"""
+        db.execute(conn, INSERT_EVENT, (
+            rental['id'], rental['vehicle_id'], rental['customer_id'], event_type,
+            event_date or _today(), rental['start_date'], rental['end_date'], rental['total_amount']
+        ))
+
+    @classmethod
+    def record_created(cls, conn, rental_id):
+        """Record the events implied by a newly inserted rental"""
+        rental = db.execute(conn, "SELECT * FROM rentals WHERE id = ?", (rental_id,)).fetchone()
+        # A back-dated rental was reserved no later than it started
+        cls.append(conn, rental, 'reserved', min(_today(), rental['start_date'][:10]))
+        cls._record_transition(conn, rental, 'reserved', created=True)
+
+    @classmethod
+    def record_updated(cls, conn, before, rental_id):
+        """Record the events implied by an update to a rental"""
+        rental = db.execute(conn, "SELECT * FROM rentals WHERE id = ?", (rental_id,)).fetchone()
+        if before is None or rental is None:
+            return
+        if rental['status'] == before['status'] and rental['end_date'] != before['end_date']:
+            cls.append(conn, rental, 'extended')
+        cls._record_transition(conn, rental, before['status'])
+
+    @classmethod
+    def _record_transition(cls, conn, rental, old_status, created=False):
+        new_status = rental['status']
+        if new_status == old_status:
+            return
+
+        if new_status == 'cancelled':
+            cls.append(conn, rental, 'cancelled')
+            return
+
+        # Rentals entered directly as active/completed were picked up on their start date
+        if new_status in ('active', 'completed') and old_status == 'reserved':
+            pickup_date = rental['start_date'] if created or new_status == 'completed' else _today()
+            cls.append(conn, rental, 'picked_up', pickup_date)
+
+        if new_status == 'completed':
+            return_date = rental['actual_return_date'] or (rental['end_date'] if created else _today())
+            cls.append(conn, rental, 'returned', return_date)
+
+    @staticmethod
+    def find_by_rental(rental_id):
+        """Full event history for one rental"""
+        query = "SELECT * FROM rental_events WHERE rental_id = ? ORDER BY id"
+        return db.fetch_all(query, (rental_id,))
+
+class RentalProjector:
+    """Rebuilds rental and vehicle state by replaying ``rental_events``"""
+
+    @staticmethod
+    @metrics.timed('report_fleet_snapshot')
+    def snapshot(as_of=None):
+        """State of every rental as it stood at the end of ``as_of`` (default: now).
+
+        Returns ``{'rentals': {rental_id: state}, 'vehicles_out': {vehicle_id: rental_id}}``
+        where ``vehicles_out`` holds the vehicles that were reserved or on rent.
+        """
+        if as_of:
+            events = db.fetch_all("SELECT * FROM rental_events WHERE event_date <= ? ORDER BY id", (as_of,))
+        else:
+            events = db.fetch_all("SELECT * FROM rental_events ORDER BY id")
+
+        rentals = {}
+        for event in events:
+            state = rentals.setdefault(event['rental_id'], {
+                'rental_id': event['rental_id'],
+                'vehicle_id': event['vehicle_id'],
+                'customer_id': event['customer_id'],
+            })
+            state['start_date'] = event['start_date']
+            state['end_date'] = event['end_date']
+            state['total_amount'] = event['total_amount']
+            if event['event_type'] in EVENT_STATUS:
+                state['status'] = EVENT_STATUS[event['event_type']]
+
+        vehicles_out = {
+            state['vehicle_id']: rental_id
+            for rental_id, state in rentals.items()
+            if state.get('status') in ('reserved', 'active')
+        }
+        return {'rentals': rentals, 'vehicles_out': vehicles_out}
+
+    @classmethod
+    def vehicles_out(cls, as_of=None):
+        """Rows for the vehicles reserved or on rent at ``as_of``, by vehicle ID"""
+        snapshot = cls.snapshot(as_of)
+        return [{
+            'vehicle_id': vehicle_id, 'rental_id': rental_id, 'customer_id': state['customer_id'],
+            'status': state.get('status'), 'start_date': state['start_date'], 'end_date': state['end_date'],
+            'total_amount': state['total_amount'],
+        } for vehicle_id, rental_id in sorted(snapshot['vehicles_out'].items())
+          for state in [snapshot['rentals'][rental_id]]]
+
+    @staticmethod
+    @metrics.timed('report_historical_utilization')
+    def utilization(start_date, end_date):
+        """Daily count of vehicles on rent between two dates (inclusive).
+
+        Only events dated up to ``end_date`` are read, via the event_date index.
+        """
+        query = """
+            SELECT rental_id, vehicle_id,
+                MIN(CASE WHEN event_type = 'picked_up' THEN event_date END) as out_date,
+                MAX(CASE WHEN event_type IN ('returned', 'cancelled') THEN event_date END) as in_date
+            FROM rental_events
+            WHERE event_date <= ?
+            GROUP BY rental_id
+            HAVING out_date IS NOT NULL AND (in_date IS NULL OR in_date >= ?)
+        """
+        periods = db.fetch_all(query, (end_date, start_date))
+        fleet = db.fetch_one("SELECT COUNT(*) as total FROM vehicles")
+        fleet_size = fleet['total'] if fleet else 0
+
+        # Sweep: +1 on the day a vehicle goes out, -1 on the day it comes back
+        changes = {}
+        for period in periods:
+            out_date = max(period['out_date'], start_date)
+            changes[out_date] = changes.get(out_date, 0) + 1
+            if period['in_date'] is not None:
+                changes[period['in_date']] = changes.get(period['in_date'], 0) - 1
+
+        daily = []
+        on_rent = 0
+        day = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+        while day <= end:
+            current = day.strftime('%Y-%m-%d')
+            on_rent += changes.get(current, 0)
+            daily.append((current, on_rent))
+            day += timedelta(days=1)
+
+        vehicle_days = sum(count for _, count in daily)
+        capacity = fleet_size * len(daily)
+        return {
+            'daily': daily,
+            'fleet_size': fleet_size,
+            'vehicle_days': vehicle_days,
+            'utilization': (vehicle_days / capacity * 100) if capacity else 0.0,
+        }
+
+    @classmethod
+    def utilization_rows(cls, start_date, end_date):
+        """``utilization`` as one row per day"""
+        data = cls.utilization(start_date, end_date)
+        return [{'date': day, 'on_rent': on_rent, 'fleet_size': data['fleet_size']} for day, on_rent in data['daily']]
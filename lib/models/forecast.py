@@ -0,0 +1,139 @@
+from datetime import date
+
+from database import db, epoch_day, EPOCH_ORDINAL
+from models.orm import CarRentalORM, MAINTENANCE_WINDOW_DAYS
+
+# Rental days a vehicle can run between routine services, and the calendar limit regardless of use
+SERVICE_INTERVAL_RENTAL_DAYS = 90
+SERVICE_INTERVAL_CALENDAR_DAYS = 180
+# Days of recent history used to estimate how hard a vehicle is being used
+USAGE_LOOKBACK_DAYS = 90
+# Slowest assumed usage (rented days per calendar day), so idle cars still come due on the calendar
+MIN_USAGE_RATE = 0.05
+
+# Fleet-wide usage features in one set-based pass: one row per vehicle
+USAGE_FEATURES = """
+    WITH last_service AS (
+        SELECT vehicle_id, MAX(maintenance_day) AS last_day
+        FROM maintenance_records
+        WHERE status = 'completed'
+        GROUP BY vehicle_id
+    ),
+    pending AS (
+        SELECT DISTINCT vehicle_id
+        FROM maintenance_records
+        WHERE status IN ('scheduled', 'in-progress') AND forecast = 0
+    ),
+    -- Each rental clipped to today, from the later of its start and the last service / the lookback start
+    usage AS (
+        SELECT r.vehicle_id,
+            CASE WHEN COALESCE(r.return_day, r.end_day) < ? THEN COALESCE(r.return_day, r.end_day) ELSE ? END AS until_day,
+            CASE WHEN s.last_day > r.start_day THEN s.last_day ELSE r.start_day END AS since_service,
+            CASE WHEN ? > r.start_day THEN ? ELSE r.start_day END AS since_lookback
+        FROM rentals r
+        LEFT JOIN last_service s ON s.vehicle_id = r.vehicle_id
+        WHERE r.status != 'cancelled' AND r.start_day < ?
+    )
+    SELECT
+        v.id AS vehicle_id,
+        s.last_day,
+        (SELECT m.id FROM maintenance_records m
+         WHERE m.vehicle_id = v.id AND m.status = 'completed'
+         ORDER BY m.maintenance_day DESC, m.id DESC LIMIT 1) AS record_id,
+        p.vehicle_id IS NOT NULL AS has_pending,
+        COALESCE(SUM(CASE WHEN u.until_day > u.since_service THEN u.until_day - u.since_service ELSE 0 END), 0)
+            AS used_since_service,
+        COALESCE(SUM(CASE WHEN u.until_day > u.since_lookback THEN u.until_day - u.since_lookback ELSE 0 END), 0)
+            AS used_recently
+    FROM vehicles v
+    LEFT JOIN last_service s ON s.vehicle_id = v.id
+    LEFT JOIN pending p ON p.vehicle_id = v.id
+    LEFT JOIN usage u ON u.vehicle_id = v.id
+    WHERE v.available = 1
+    GROUP BY v.id, s.last_day, p.vehicle_id
+"""
+
+def predict_service_day(features, today):
+    """Day number a vehicle is next due for service, from its usage features"""
+    remaining = SERVICE_INTERVAL_RENTAL_DAYS - features['used_since_service']
+    if remaining <= 0:
+        return today
+    usage_rate = max(features['used_recently'] / USAGE_LOOKBACK_DAYS, MIN_USAGE_RATE)
+    by_usage = today + int(-(-remaining // usage_rate))
+    by_calendar = (features['last_day'] if features['last_day'] is not None else today) + SERVICE_INTERVAL_CALENDAR_DAYS
+    return max(min(by_usage, by_calendar), today)
+
+def fit_around_bookings(due, bookings, today):
+    """Start day of a service window clear of ``bookings`` (sorted ``(start_day, end_day)`` pairs).
+
+    The latest clear day not after ``due`` is preferred, so the service is
+    still on time; failing that (nothing clear from today), the first clear
+    day after it.
+    """
+    day = due
+    for start, end in reversed(bookings):
+        if start < day + MAINTENANCE_WINDOW_DAYS and end > day:
+            day = start - MAINTENANCE_WINDOW_DAYS
+    if day >= today:
+        return day
+    day = due
+    for start, end in bookings:
+        if start < day + MAINTENANCE_WINDOW_DAYS and end > day:
+            day = end
+    return day
+
+class MaintenanceForecaster:
+    """Predicts the next routine service of every in-service vehicle from its rental history.
+
+    The predicted day is written to ``next_maintenance_date`` of the
+    vehicle's latest completed service record, flagged ``forecast = 1``, and
+    all predictions are replaced wholesale on every run. A prediction never
+    lands on the vehicle's reserved or active rentals, and blocks a
+    ``MAINTENANCE_WINDOW_DAYS`` window like a scheduled service until a newer
+    record supersedes it. Vehicles that already have manually scheduled or
+    in-progress work are left alone, and vehicles never serviced have no
+    record to carry a prediction.
+    """
+
+    @staticmethod
+    def forecast():
+        """Predicted service date per vehicle, as a list of dicts"""
+        today = epoch_day()
+        lookback = today - USAGE_LOOKBACK_DAYS
+        features = db.fetch_all(USAGE_FEATURES, (today, today, lookback, lookback, today))
+        bookings = {}
+        for rental in db.fetch_all("""
+            SELECT vehicle_id, start_day, end_day FROM rentals
+            WHERE status IN ('active', 'reserved') AND end_day > ?
+            ORDER BY vehicle_id, start_day
+        """, (today,)):
+            bookings.setdefault(rental['vehicle_id'], []).append((rental['start_day'], rental['end_day']))
+        forecasts = []
+        for row in features:
+            if row['has_pending']:
+                continue
+            day = fit_around_bookings(predict_service_day(row, today), bookings.get(row['vehicle_id'], []), today)
+            forecasts.append({
+                'vehicle_id': row['vehicle_id'],
+                'record_id': row['record_id'],
+                'used_since_service': row['used_since_service'],
+                'used_recently': row['used_recently'],
+                'due_date': date.fromordinal(day + EPOCH_ORDINAL).isoformat(),
+            })
+        return forecasts
+
+    @classmethod
+    def run(cls, horizon_days=None):
+        """Replace the stored predictions; only services due within ``horizon_days`` are kept when given"""
+        forecasts = [f for f in cls.forecast() if f['record_id'] is not None]
+        if horizon_days is not None:
+            last = date.fromordinal(epoch_day() + horizon_days + EPOCH_ORDINAL).isoformat()
+            forecasts = [f for f in forecasts if f['due_date'] <= last]
+        with db.transaction() as conn:
+            # Earlier versions stored forecasts as scheduled rows of their own
+            db.execute(conn, "DELETE FROM maintenance_records WHERE forecast = 1 AND status = 'scheduled'")
+            db.execute(conn, "UPDATE maintenance_records SET next_maintenance_date = NULL, forecast = 0 WHERE forecast = 1")
+            db.backend.executemany(conn, "UPDATE maintenance_records SET next_maintenance_date = ?, forecast = 1 WHERE id = ?",
+                                   [(f['due_date'], f['record_id']) for f in forecasts])
+        CarRentalORM.notify('maintenance_records')
+        return forecasts
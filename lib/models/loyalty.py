@@ -0,0 +1,119 @@
+import os
+from datetime import date, timedelta
+
+from database import db
+from models.orm import CarRentalORM
+
+# (tier, minimum rentals, minimum lifetime spend in KES), best first; anyone else is 'standard'
+TIERS = (
+    ('gold', 10, 150000),
+    ('silver', 5, 50000),
+)
+VIP_TIERS = ('gold', 'silver')
+
+# Customers returning more than this share of rentals late stay standard
+MAX_LATE_SHARE = 0.2
+
+# A tier lapses when the last rental is older than this
+LAPSE_DAYS = 365
+
+class LoyaltyTiers:
+    """Loyalty tiers evaluated against ``customer_stats`` (kept current by triggers on rentals).
+
+    Looking a customer up is a primary-key read. ``run`` only visits
+    customers whose figures changed since the last run, plus holders of a
+    tier whose last rental has since lapsed, and sets ``customers.is_vip``
+    to match the tier.
+    """
+
+    @staticmethod
+    def tier_for(stats, today=None):
+        """Tier earned by one ``customer_stats`` row (None for a customer without rentals)"""
+        if not stats or not stats['rentals']:
+            return 'standard'
+        today = today or date.today()
+        if stats['last_rental_date'] is None or stats['last_rental_date'][:10] < (today - timedelta(days=LAPSE_DAYS)).isoformat():
+            return 'standard'
+        if stats['late_returns'] > MAX_LATE_SHARE * stats['rentals']:
+            return 'standard'
+        for tier, min_rentals, min_spend in TIERS:
+            if stats['rentals'] >= min_rentals and stats['total_spend'] >= min_spend:
+                return tier
+        return 'standard'
+
+    @staticmethod
+    def status(customer_id):
+        """A customer's figures and tier for the front desk"""
+        stats = db.fetch_one("""
+            SELECT c.id AS customer_id, c.first_name, c.last_name, c.is_vip,
+                   COALESCE(s.rentals, 0) AS rentals, COALESCE(s.total_spend, 0) AS total_spend,
+                   COALESCE(s.late_returns, 0) AS late_returns, s.last_rental_date,
+                   COALESCE(s.tier, 'standard') AS tier, COALESCE(s.needs_tiering, 0) AS needs_tiering
+            FROM customers c LEFT JOIN customer_stats s ON s.customer_id = c.id
+            WHERE c.id = ?
+        """, (customer_id,))
+        return dict(stats) if stats else None
+
+    @classmethod
+    def run(cls, today=None):
+        """Re-evaluate changed and lapsing customers; returns ``{'evaluated': n, 'changed': [...], 'vip_updated': n}``"""
+        today = today or date.today()
+        cutoff = (today - timedelta(days=LAPSE_DAYS)).isoformat()
+        placeholders = ', '.join('?' for _ in VIP_TIERS)
+        changed = []
+        vip_updated = 0
+        with db.transaction() as conn:
+            # VIPs without a rental have no stats row yet; give them one so their flag is checked
+            db.execute(conn, """
+                INSERT INTO customer_stats (customer_id)
+                SELECT id FROM customers WHERE is_vip = 1 AND id NOT IN (SELECT customer_id FROM customer_stats)
+            """)
+            rows = db.execute(conn, f"""
+                SELECT * FROM customer_stats WHERE needs_tiering = 1
+                UNION
+                SELECT * FROM customer_stats WHERE tier IN ({placeholders}) AND last_rental_date < ?
+            """, (*VIP_TIERS, cutoff)).fetchall()
+            for stats in rows:
+                tier = cls.tier_for(stats, today)
+                if tier != stats['tier']:
+                    changed.append({'customer_id': stats['customer_id'], 'from': stats['tier'], 'to': tier})
+                # Also corrects VIP flags set by hand that the tier does not back; this
+                # comes first because changing is_vip flags the customer again
+                vip = int(tier in VIP_TIERS)
+                vip_updated += db.execute(conn, "UPDATE customers SET is_vip = ? WHERE id = ? AND is_vip != ?",
+                                          (vip, stats['customer_id'], vip)).rowcount
+                db.execute(conn, "UPDATE customer_stats SET tier = ?, needs_tiering = 0 WHERE customer_id = ?",
+                           (tier, stats['customer_id']))
+        if vip_updated:
+            CarRentalORM.notify('customers')
+        return {'evaluated': len(rows), 'changed': changed, 'vip_updated': vip_updated}
+
+    @staticmethod
+    def rebuild(archive_path=None):
+        """Recompute every customer's figures from rentals (after bulk loads that bypassed the ORM).
+
+        Rentals moved out by ``maintenance archive`` are included; the
+        archive last written to is used unless ``archive_path`` is given.
+        """
+        db.require_sqlite("Rebuilding customer stats")
+        if archive_path is None:
+            row = db.fetch_one("SELECT value FROM sync_state WHERE key = 'archive_db'")
+            archive_path = row['value'] if row else None
+        conn = db.get_connection()
+        attached = archived = False
+        try:
+            if archive_path and os.path.exists(archive_path):
+                db.execute(conn, "ATTACH DATABASE ? AS archive", (archive_path,))
+                attached = True
+                archived = db.execute(conn, """
+                    SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'rentals'
+                """).fetchone() is not None
+            db.backfill_customer_stats(conn.cursor(), archived)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if attached:
+                db.execute(conn, "DETACH DATABASE archive")
+            conn.close()
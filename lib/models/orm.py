@@ -1,30 +1,82 @@
-from database import db
-from datetime import datetime, timedelta
+from database import db, epoch_day
+from models.events import RentalEventLog
+from models.pricing import demand_pricing
+from models import coverage
+from models.coverage import coverage_index
+from models.spatial import BranchLocator
+from metrics import metrics
+from datetime import datetime
+
+# Days a scheduled service keeps a vehicle out of the rental pool
+MAINTENANCE_WINDOW_DAYS = 2
+
+# First day of every service window, (vehicle_id, start_day): scheduled services, and the next
+# service predicted by models.forecast on a vehicle's latest record (until a newer record supersedes it)
+MAINTENANCE_WINDOWS = """
+    SELECT vehicle_id, maintenance_day AS start_day FROM maintenance_records
+    WHERE status = 'scheduled'
+    UNION ALL
+    SELECT m.vehicle_id, m.next_maintenance_day AS start_day FROM maintenance_records m
+    WHERE m.forecast = 1 AND m.next_maintenance_day IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM maintenance_records n
+        WHERE n.vehicle_id = m.vehicle_id AND n.id != m.id
+          AND (n.maintenance_day > m.maintenance_day OR (n.maintenance_day = m.maintenance_day AND n.id > m.id))
+    )
+"""
 
 class CarRentalORM:
     
+    # Callbacks invoked with the table name after every write
+    _listeners = []
+    
+    @classmethod
+    def add_listener(cls, callback):
+        """Register a callback for write notifications"""
+        cls._listeners.append(callback)
+    
+    @classmethod
+    def remove_listener(cls, callback):
+        """Unregister a write notification callback"""
+        if callback in cls._listeners:
+            cls._listeners.remove(callback)
+    
+    @classmethod
+    def notify(cls, table):
+        """Tell the listeners ``table`` was written (for writes made outside the ORM's own methods)"""
+        for callback in cls._listeners:
+            callback(table)
+    
+    @staticmethod
+    def _rows(query, params=(), stream=False):
+        """All rows as a list, or a generator streaming from the cursor when ``stream`` is set"""
+        if stream:
+            return db.iter_rows(query, params)
+        return db.fetch_all(query, params)
+    
     # Generic CRUD operations
     @classmethod
-    def create(cls, table, data):
+    def create(cls, table, data, conn=None):
         """Create a new record"""
-        columns = ', '.join(data.keys())
-        placeholders = ', '.join(['?' for _ in data])
-        query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-        
-        cursor = db.execute_query(query, tuple(data.values()))
-        return cursor.lastrowid
+        with db.transaction(conn) as conn:
+            record_id = db.insert(conn, table, data)
+            if table == 'rentals':
+                RentalEventLog.record_created(conn, record_id)
+        cls.notify(table)
+        return record_id
     
     @classmethod
-    def delete(cls, table, record_id):
+    def delete(cls, table, record_id, conn=None):
         """Delete a record by ID"""
         query = f"DELETE FROM {table} WHERE id = ?"
-        db.execute_query(query, (record_id,))
+        with db.transaction(conn) as conn:
+            db.execute(conn, query, (record_id,))
+        cls.notify(table)
     
     @classmethod
-    def get_all(cls, table):
+    def get_all(cls, table, stream=False):
         """Get all records from a table"""
         query = f"SELECT * FROM {table}"
-        return db.fetch_all(query)
+        return cls._rows(query, stream=stream)
     
     @classmethod
     def find_by_id(cls, table, record_id):
@@ -33,58 +85,72 @@ class CarRentalORM:
         return db.fetch_one(query, (record_id,))
     
     @classmethod
-    def update(cls, table, record_id, data):
+    def update(cls, table, record_id, data, conn=None):
         """Update a record"""
         set_clause = ', '.join([f"{key} = ?" for key in data.keys()])
         query = f"UPDATE {table} SET {set_clause} WHERE id = ?"
         params = tuple(data.values()) + (record_id,)
-        db.execute_query(query, params)
+        with db.transaction(conn) as conn:
+            before = None
+            if table == 'rentals':
+                before = db.execute(conn, "SELECT * FROM rentals WHERE id = ?", (record_id,)).fetchone()
+            db.execute(conn, query, params)
+            if table == 'rentals':
+                RentalEventLog.record_updated(conn, before, record_id)
+        cls.notify(table)
     
     # Vehicle-specific operations
     @classmethod
-    def find_available_vehicles(cls):
-        """Find all available vehicles"""
+    @metrics.timed('availability_search')
+    def find_available_vehicles(cls, stream=False):
+        """Find all available vehicles (served by the partial status index)"""
         query = """
             SELECT v.*, l.name as location_name, l.city 
             FROM vehicles v 
             LEFT JOIN locations l ON v.location_id = l.id 
-            WHERE v.available = 1 
-            AND v.id NOT IN (
-                SELECT vehicle_id FROM rentals 
-                WHERE status IN ('active', 'reserved')
-            )
+            WHERE v.status = 'available'
         """
-        return db.fetch_all(query)
+        return cls._rows(query, stream=stream)
     
     @classmethod
-    def find_vehicles_by_type(cls, vehicle_type):
+    @metrics.timed('availability_search_by_type')
+    def find_vehicles_by_type(cls, vehicle_type, stream=False):
         """Find vehicles by type"""
         query = """
             SELECT v.*, l.name as location_name, l.city 
             FROM vehicles v 
             LEFT JOIN locations l ON v.location_id = l.id 
-            WHERE v.vehicle_type = ? AND v.available = 1
-            AND v.id NOT IN (
-                SELECT vehicle_id FROM rentals 
-                WHERE status IN ('active', 'reserved')
-            )
+            WHERE v.vehicle_type = ? AND v.status = 'available'
         """
-        return db.fetch_all(query, (vehicle_type,))
+        return cls._rows(query, (vehicle_type,), stream)
     
     @classmethod
-    def find_vehicles_by_location(cls, location_id):
+    def find_vehicles_by_location(cls, location_id, stream=False):
         """Find vehicles by location"""
         query = """
             SELECT v.*, l.name as location_name, l.city 
             FROM vehicles v 
             LEFT JOIN locations l ON v.location_id = l.id 
-            WHERE v.location_id = ? AND v.available = 1
-            AND v.id NOT IN (
-                SELECT vehicle_id FROM rentals 
-                WHERE status IN ('active', 'reserved')
-            )
+            WHERE v.location_id = ? AND v.status = 'available'
         """
-        return db.fetch_all(query, (location_id,))
+        return cls._rows(query, (location_id,), stream)
+    
+    @classmethod
+    @metrics.timed('availability_search_near')
+    def find_vehicles_near(cls, lat, lon, vehicle_type=None, limit=5):
+        """Closest branches with available vehicles, ranked by distance"""
+        return BranchLocator.nearest(lat, lon, vehicle_type, limit)
+    
+    @classmethod
+    def find_rentals_with_details(cls, stream=False):
+        """All rentals with customer and vehicle names"""
+        query = """
+            SELECT r.*, c.first_name, c.last_name, v.make, v.model, v.year 
+            FROM rentals r
+            JOIN customers c ON r.customer_id = c.id
+            JOIN vehicles v ON r.vehicle_id = v.id
+        """
+        return cls._rows(query, stream=stream)
     
     # Customer-specific operations
     @classmethod
@@ -101,7 +167,7 @@ class CarRentalORM:
     
     # Rental-specific operations
     @classmethod
-    def find_active_rentals(cls):
+    def find_active_rentals(cls, stream=False):
         """Find all active rentals"""
         query = """
             SELECT r.*, c.first_name, c.last_name, v.make, v.model, v.year 
@@ -110,23 +176,23 @@ class CarRentalORM:
             JOIN vehicles v ON r.vehicle_id = v.id
             WHERE r.status IN ('active', 'reserved')
         """
-        return db.fetch_all(query)
+        return cls._rows(query, stream=stream)
     
     @classmethod
-    def find_overdue_rentals(cls):
+    @metrics.timed('report_overdue_rentals')
+    def find_overdue_rentals(cls, stream=False):
         """Find overdue rentals"""
-        today = datetime.now().strftime('%Y-%m-%d')
         query = """
             SELECT r.*, c.first_name, c.last_name, v.make, v.model, v.year 
             FROM rentals r
             JOIN customers c ON r.customer_id = c.id
             JOIN vehicles v ON r.vehicle_id = v.id
-            WHERE r.status = 'active' AND r.end_date < ?
+            WHERE r.status = 'active' AND r.end_day < ?
         """
-        return db.fetch_all(query, (today,))
+        return cls._rows(query, (epoch_day(),), stream)
     
     @classmethod
-    def find_rentals_by_customer(cls, customer_id):
+    def find_rentals_by_customer(cls, customer_id, stream=False):
         """Find rentals by customer"""
         query = """
             SELECT r.*, v.make, v.model, v.year 
@@ -134,20 +200,105 @@ class CarRentalORM:
             JOIN vehicles v ON r.vehicle_id = v.id
             WHERE r.customer_id = ?
         """
-        return db.fetch_all(query, (customer_id,))
+        return cls._rows(query, (customer_id,), stream)
+    
+    @classmethod
+    @metrics.timed('rental_quote')
+    def quote_rental(cls, vehicle_id, start_date, end_date):
+        """Demand-priced quote for a vehicle; returns ``(vehicle, total, nights)``"""
+        vehicle = cls.find_by_id('vehicles', vehicle_id)
+        if not vehicle:
+            raise ValueError("Vehicle not found!")
+        
+        if epoch_day(end_date) - epoch_day(start_date) <= 0:
+            raise ValueError("Invalid date range!")
+        
+        if cls.has_maintenance_window(vehicle_id, start_date, end_date):
+            raise ValueError("Vehicle is scheduled for maintenance during those dates!")
+        
+        total, nights = demand_pricing.quote(vehicle, start_date, end_date)
+        return vehicle, total, nights
+    
+    @classmethod
+    @metrics.timed('rental_create')
+    def book_rental(cls, customer_id, vehicle_id, start_date, end_date, status='active'):
+        """Create a rental priced by demand for each night (see models.pricing).
+        
+        Returns ``(rental_id, total)``; raises ValueError for an unknown
+        vehicle, an empty date range, a maintenance clash, a vehicle out of
+        service or already booked for any of the nights or, when
+        ``CAR_RENTAL_REQUIRE_INSURANCE=1``, a vehicle that is not insured for
+        every day of the rental. The availability checks and the insert run
+        under one write lock, so two counters cannot book the same nights.
+        """
+        _, total, _ = cls.quote_rental(vehicle_id, start_date, end_date)
+        if coverage.REQUIRE_COVER and not coverage_index.is_covered(vehicle_id, start_date, end_date):
+            raise ValueError("Vehicle is not insured for the whole rental period!")
+        data = {
+            'customer_id': customer_id, 'vehicle_id': vehicle_id,
+            'start_date': start_date, 'end_date': end_date,
+            'total_amount': total, 'status': status
+        }
+        with db.transaction(immediate=True) as conn:
+            cls.check_vehicle_free(conn, vehicle_id, start_date, end_date)
+            rental_id = cls.create('rentals', data, conn=conn)
+        return rental_id, total
+    
+    @classmethod
+    def check_vehicle_free(cls, conn, vehicle_id, start_date, end_date):
+        """Raise ValueError unless the vehicle is in service and has no reserved or active rental overlapping [start_date, end_date)"""
+        vehicle = db.execute(conn, "SELECT status FROM vehicles WHERE id = ?", (vehicle_id,)).fetchone()
+        if vehicle['status'] == 'maintenance':
+            raise ValueError("Vehicle is out of service for maintenance!")
+        # Served by idx_rentals_vehicle_days
+        clash = db.execute(conn, """
+            SELECT id FROM rentals
+            WHERE vehicle_id = ? AND start_day < ? AND end_day > ? AND status IN ('active', 'reserved')
+            LIMIT 1
+        """, (vehicle_id, epoch_day(end_date), epoch_day(start_date))).fetchone()
+        if clash:
+            raise ValueError(f"Vehicle is already booked for those dates (rental {clash['id']})!")
+    
+    @classmethod
+    @metrics.timed('rental_return')
+    def return_rental(cls, rental_id, return_date=None):
+        """Complete an active or reserved rental and record the return in one transaction"""
+        return_date = return_date or datetime.now().strftime('%Y-%m-%d')
+        with db.transaction() as conn:
+            rental = db.execute(conn, "SELECT * FROM rentals WHERE id = ?", (rental_id,)).fetchone()
+            if not rental:
+                raise ValueError("Rental not found!")
+            if rental['status'] not in ('active', 'reserved'):
+                raise ValueError(f"Rental {rental_id} is already {rental['status']}!")
+            # Triggers on rentals release the vehicle (vehicles.status)
+            cls.update('rentals', rental_id, {
+                'status': 'completed',
+                'actual_return_date': return_date
+            }, conn=conn)
+        return rental
     
     # Maintenance-specific operations
     @classmethod
+    @metrics.timed('report_overdue_maintenance')
     def find_overdue_maintenance(cls):
         """Find overdue maintenance records"""
-        today = datetime.now().strftime('%Y-%m-%d')
         query = """
             SELECT m.*, v.make, v.model, v.year 
             FROM maintenance_records m
             JOIN vehicles v ON m.vehicle_id = v.id
-            WHERE m.next_maintenance_date < ? AND m.status != 'completed'
+            WHERE m.next_maintenance_day < ? AND m.status != 'completed'
         """
-        return db.fetch_all(query, (today,))
+        return db.fetch_all(query, (epoch_day(),))
+    
+    @classmethod
+    def has_maintenance_window(cls, vehicle_id, start_date, end_date):
+        """True when a scheduled or predicted service window overlaps [start_date, end_date)"""
+        query = f"""
+            SELECT 1 FROM ({MAINTENANCE_WINDOWS}) w
+            WHERE w.vehicle_id = ? AND w.start_day < ? AND w.start_day + {MAINTENANCE_WINDOW_DAYS} > ?
+            LIMIT 1
+        """
+        return db.fetch_one(query, (vehicle_id, epoch_day(end_date), epoch_day(start_date))) is not None
     
     @classmethod
     def find_scheduled_maintenance(cls):
@@ -162,20 +313,21 @@ class CarRentalORM:
     
     # Insurance-specific operations
     @classmethod
+    @metrics.timed('report_expiring_insurance')
     def find_expiring_insurance(cls, days=30):
         """Find insurance policies expiring soon"""
-        future_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
-        today = datetime.now().strftime('%Y-%m-%d')
+        today = epoch_day()
         query = """
             SELECT i.*, v.make, v.model, v.year 
             FROM insurance i
             JOIN vehicles v ON i.vehicle_id = v.id
-            WHERE i.end_date <= ? AND i.end_date >= ?
+            WHERE i.end_day BETWEEN ? AND ?
         """
-        return db.fetch_all(query, (future_date, today))
+        return db.fetch_all(query, (today, today + days))
     
     # Reporting operations
     @classmethod
+    @metrics.timed('report_revenue')
     def get_revenue_report(cls):
         """Generate revenue report"""
         query = """
@@ -183,55 +335,57 @@ class CarRentalORM:
                 COUNT(*) as total_rentals,
                 SUM(total_amount) as total_revenue,
                 SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed_rentals,
-                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_rentals
+                SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) as active_rentals,
+                SUM(end_day - start_day) as rental_days,
+                SUM(CASE WHEN return_day > end_day THEN return_day - end_day ELSE 0 END) as late_days
             FROM rentals
             WHERE total_amount IS NOT NULL
         """
         return db.fetch_one(query)
     
     @classmethod
+    @metrics.timed('report_utilization')
     def get_utilization_report(cls):
         """Generate vehicle utilization report"""
         query = """
             SELECT 
                 COUNT(*) as total_vehicles,
-                SUM(available) as available_vehicles,
-                COUNT(*) - SUM(available) as rented_vehicles
+                SUM(CASE WHEN status = 'available' THEN 1 ELSE 0 END) as available_vehicles,
+                SUM(CASE WHEN status IN ('rented', 'reserved') THEN 1 ELSE 0 END) as rented_vehicles,
+                SUM(CASE WHEN status = 'maintenance' THEN 1 ELSE 0 END) as maintenance_vehicles
             FROM vehicles
         """
         return db.fetch_one(query)
 
+# Keep demand counters in step with bookings made through the ORM
+CarRentalORM.add_listener(demand_pricing.on_write)
+CarRentalORM.add_listener(coverage_index.on_write)
+
 # Utility functions
 def calculate_rental_total(vehicle_daily_rate, start_date, end_date, actual_return_date=None):
     """Calculate rental total with potential late fees"""
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d')
+    start = epoch_day(start_date)
+    end = epoch_day(end_date)
     
     # Base rental days
-    rental_days = (end - start).days
+    rental_days = end - start
     base_cost = rental_days * vehicle_daily_rate
     
     # Late fees
     late_fee = 0
     if actual_return_date:
-        actual_return = datetime.strptime(actual_return_date, '%Y-%m-%d')
+        actual_return = epoch_day(actual_return_date)
         if actual_return > end:
-            overdue_days = (actual_return - end).days
+            overdue_days = actual_return - end
             late_fee = overdue_days * vehicle_daily_rate * 1.5  # 50% late fee
     
     return base_cost + late_fee
 
 def is_vehicle_available(vehicle_id):
     """Check if a vehicle is available for rental"""
-    query = """
-        SELECT available FROM vehicles WHERE id = ?
-        AND id NOT IN (
-            SELECT vehicle_id FROM rentals 
-            WHERE status IN ('active', 'reserved')
-        )
-    """
+    query = "SELECT status FROM vehicles WHERE id = ?"
     result = db.fetch_one(query, (vehicle_id,))
-    return result and result['available'] == 1
+    return bool(result) and result['status'] == 'available'
 
 def can_customer_rent(customer_id):
     """Check if customer can rent (no active rentals)"""
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import date
+
+from database import db, epoch_day, EPOCH_ORDINAL
+
+# (minimum utilization, multiplier, label), checked from the top
+PRICING_TIERS = [
+    (0.90, 1.50, 'peak'),
+    (0.75, 1.25, 'surge'),
+    (0.40, 1.00, 'standard'),
+    (0.00, 0.85, 'off-peak'),
+]
+
+# Days either side of a date whose demand is averaged into its rate
+DEMAND_WINDOW = 3
+
+def _day_date(day):
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+class DemandPricing:
+    """Daily rate multipliers from live utilization per (location, vehicle type).
+
+    Booked-vehicle counters per ``(location_id, vehicle_type, day)`` are
+    built once from open rentals and then kept current by applying only the
+    rental events recorded since the last refresh; counters for days already
+    past are dropped once a day. Computed rates are cached per
+    ``(location_id, vehicle_type, day)`` and evicted after ``ttl`` seconds,
+    as soon as a booking changes demand for that key, or least recently
+    used first once ``max_entries`` are held.
+    """
+
+    def __init__(self, ttl=300, max_entries=50000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.stale = False
+        self.polled_at = 0.0
+        self.fleet = Counter()
+        self.vehicles = {}
+        self.booked = Counter()
+        self.open_rentals = {}
+        self.last_event_id = 0
+        self.pruned_day = None
+        self.rates = OrderedDict()
+
+    # Counters
+    def _load(self):
+        vehicles = db.fetch_all("SELECT id, location_id, vehicle_type, available FROM vehicles")
+        self.vehicles = {v['id']: (v['location_id'], v['vehicle_type']) for v in vehicles}
+        self.fleet = Counter(self.vehicles[v['id']] for v in vehicles if v['available'])
+        self.booked.clear()
+        self.open_rentals.clear()
+        self.rates.clear()
+        today = epoch_day()
+        self.last_event_id = (db.fetch_one("SELECT MAX(id) as last_id FROM rental_events") or {'last_id': 0})['last_id'] or 0
+        rentals = db.fetch_all(
+            "SELECT id, vehicle_id, start_day, end_day FROM rentals WHERE status IN ('active', 'reserved') AND end_day >= ?",
+            (today,))
+        for rental in rentals:
+            self._book(rental['id'], rental['vehicle_id'], rental['start_day'], rental['end_day'])
+        self.pruned_day = today
+        self.loaded = True
+        self.stale = False
+        self.polled_at = time.monotonic()
+
+    def _book(self, rental_id, vehicle_id, start_day, end_day):
+        key = self.vehicles.get(vehicle_id)
+        if key is None or start_day is None or end_day is None:
+            return
+        self._release(rental_id)
+        # Only today onwards is priced, so past nights are never counted
+        start_day = max(start_day, epoch_day())
+        self.open_rentals[rental_id] = (key, start_day, end_day)
+        for day in range(start_day, end_day):
+            self.booked[key + (day,)] += 1
+        self._evict(key, start_day, end_day)
+
+    def _release(self, rental_id):
+        booking = self.open_rentals.pop(rental_id, None)
+        if booking is None:
+            return
+        key, start_day, end_day = booking
+        for day in range(start_day, end_day):
+            if self.booked.get(key + (day,)):
+                self.booked[key + (day,)] -= 1
+                if not self.booked[key + (day,)]:
+                    del self.booked[key + (day,)]
+        self._evict(key, start_day, end_day)
+
+    def _prune(self, today):
+        """Forget counters for days already past, and rentals with no nights left"""
+        self.booked = Counter({key: count for key, count in self.booked.items() if key[2] >= today})
+        self.open_rentals = {rental_id: booking for rental_id, booking in self.open_rentals.items()
+                             if booking[2] > today}
+        self.pruned_day = today
+
+    def _evict(self, key, start_day, end_day):
+        # Rates average demand over a window, so neighbouring days change too
+        for day in range(start_day - DEMAND_WINDOW, end_day + DEMAND_WINDOW + 1):
+            self.rates.pop(key + (day,), None)
+
+    def _apply_new_events(self):
+        events = db.fetch_all("SELECT * FROM rental_events WHERE id > ? ORDER BY id", (self.last_event_id,))
+        for event in events:
+            if event['event_type'] in ('reserved', 'extended'):
+                self._book(event['rental_id'], event['vehicle_id'],
+                           epoch_day(event['start_date']), epoch_day(event['end_date']))
+            elif event['event_type'] in ('returned', 'cancelled'):
+                self._release(event['rental_id'])
+            self.last_event_id = event['id']
+
+    def invalidate(self):
+        """Rebuild counters and rates on the next quote (after writes this process was not told about)"""
+        with self.lock:
+            self.loaded = False
+
+    def on_write(self, table):
+        """ORM write listener: pick up new bookings (and fleet changes) on the next quote"""
+        with self.lock:
+            if table in ('vehicles', 'locations', 'maintenance_records'):
+                self.loaded = False
+            elif table == 'rentals':
+                self.stale = True
+
+    def _refresh(self):
+        if not self.loaded:
+            self._load()
+            return
+        if self.pruned_day != epoch_day():
+            self._prune(epoch_day())
+        if self.stale or time.monotonic() - self.polled_at > self.ttl:
+            # Also poll every ``ttl`` seconds to see bookings made by other processes
+            self._apply_new_events()
+            self.stale = False
+            self.polled_at = time.monotonic()
+
+    # Rates
+    def _compute_rate(self, location_id, vehicle_type, day):
+        key = (location_id, vehicle_type)
+        fleet = self.fleet.get(key, 0)
+        if not fleet:
+            return {'multiplier': 1.0, 'utilization': 0.0, 'tier': 'standard'}
+        days = range(day - DEMAND_WINDOW, day + DEMAND_WINDOW + 1)
+        # The day itself counts double against its neighbours
+        weighted = sum(self.booked.get(key + (d,), 0) * (2 if d == day else 1) for d in days)
+        utilization = min(weighted / (fleet * (len(days) + 1)), 1.0)
+        for threshold, multiplier, label in PRICING_TIERS:
+            if utilization >= threshold:
+                return {'multiplier': multiplier, 'utilization': round(utilization, 3), 'tier': label}
+
+    def rate(self, location_id, vehicle_type, day):
+        """Cached rate entry (multiplier, utilization, tier) for one day number"""
+        with self.lock:
+            self._refresh()
+            key = (location_id, vehicle_type, day)
+            now = time.monotonic()
+            entry = self.rates.get(key)
+            if entry is None or entry[0] <= now:
+                entry = (now + self.ttl, self._compute_rate(location_id, vehicle_type, day))
+                self.rates[key] = entry
+                while len(self.rates) > self.max_entries:
+                    self.rates.popitem(last=False)
+            self.rates.move_to_end(key)
+            return entry[1]
+
+    def quote(self, vehicle, start_date, end_date):
+        """Price a rental night by night; returns ``(total, nights)``"""
+        nights = []
+        total = 0
+        for day in range(epoch_day(start_date), epoch_day(end_date)):
+            rate = self.rate(vehicle['location_id'], vehicle['vehicle_type'], day)
+            price = round(vehicle['daily_rate'] * rate['multiplier'], 2)
+            total += price
+            nights.append({'date': _day_date(day).isoformat(), 'price': price, **rate})
+        return round(total, 2), nights
+
+# Shared pricing state for the process
+demand_pricing = DemandPricing()
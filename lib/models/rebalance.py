@@ -0,0 +1,236 @@
+import heapq
+import math
+from collections import defaultdict
+from statistics import NormalDist
+
+from database import db, epoch_day
+from models.spatial import haversine_km
+
+# Cost of a transfer between branches without coordinates
+UNKNOWN_DISTANCE_KM = 1000
+
+class MinCostFlow:
+    """Min-cost max-flow by successive shortest paths (Dijkstra with potentials).
+
+    Costs must be non-negative integers. Each edge is stored as
+    ``[to, residual capacity, cost, index of the reverse edge]``.
+    """
+
+    def __init__(self, nodes):
+        self.graph = [[] for _ in range(nodes)]
+
+    def add_edge(self, source, target, capacity, cost):
+        """Add an edge; returns a handle for ``flow_on``"""
+        self.graph[source].append([target, capacity, cost, len(self.graph[target])])
+        self.graph[target].append([source, 0, -cost, len(self.graph[source]) - 1])
+        return source, len(self.graph[source]) - 1
+
+    def flow_on(self, handle):
+        node, index = handle
+        target, _, _, reverse = self.graph[node][index]
+        return self.graph[target][reverse][1]
+
+    def solve(self, source, sink):
+        """Push as much flow as possible at the least total cost; returns ``(flow, cost)``"""
+        graph = self.graph
+        potential = [0] * len(graph)
+        flow = cost = 0
+        while True:
+            dist = [math.inf] * len(graph)
+            previous = [None] * len(graph)
+            dist[source] = 0
+            heap = [(0, source)]
+            while heap:
+                d, node = heapq.heappop(heap)
+                if d > dist[node]:
+                    continue
+                for index, (target, capacity, edge_cost, _) in enumerate(graph[node]):
+                    if capacity <= 0:
+                        continue
+                    candidate = d + edge_cost + potential[node] - potential[target]
+                    if candidate < dist[target]:
+                        dist[target] = candidate
+                        previous[target] = (node, index)
+                        heapq.heappush(heap, (candidate, target))
+            if dist[sink] == math.inf:
+                return flow, cost
+            for node, d in enumerate(dist):
+                if d < math.inf:
+                    potential[node] += d
+
+            push, node = math.inf, sink
+            while node != source:
+                parent, index = previous[node]
+                push = min(push, graph[parent][index][1])
+                node = parent
+            node = sink
+            while node != source:
+                parent, index = previous[node]
+                edge = graph[parent][index]
+                edge[1] -= push
+                graph[node][edge[3]][1] += push
+                node = parent
+            flow += push
+            cost += push * (potential[sink] - potential[source])
+
+def poisson_quantile(mean, level):
+    """Smallest k with P(X <= k) >= level for X ~ Poisson(mean)"""
+    if mean <= 0:
+        return 0
+    if mean > 100:
+        # Normal approximation; exp(-mean) would underflow
+        return math.ceil(mean + NormalDist().inv_cdf(level) * math.sqrt(mean))
+    k, term = 0, math.exp(-mean)
+    total = term
+    while total < level:
+        k += 1
+        term *= mean / k
+        total += term
+    return k
+
+class FleetRebalancer:
+    """Plans vehicle transfers between branches for the coming ``horizon_days``.
+
+    Demand per (branch, vehicle type) is the recency-weighted weekly pickup
+    rate over ``lookback_days`` times the mean rental length (vehicles out
+    at once, by Little's law); the stock target covers that demand at
+    ``service_level`` under a Poisson model. Rentals do not record their
+    pickup branch, so a rental counts towards the branch its vehicle is
+    based at. Only vehicles that are in service, free now and not booked
+    or due for service within the horizon are moved, each donor keeps
+    ``keep`` of every type it has, and the transfers are a min-cost flow
+    over road distance, so the most shortfall is covered with the fewest
+    kilometres driven.
+    """
+
+    WEEKLY_WEIGHT = 0.3  # exponential smoothing: share of the newest week
+
+    def __init__(self, horizon_days=7, lookback_days=56, service_level=0.9, keep=1, max_km=None):
+        self.horizon_days = horizon_days
+        self.lookback_days = lookback_days
+        self.service_level = service_level
+        self.keep = keep
+        self.max_km = max_km
+
+    def forecast(self):
+        """{(location_id, vehicle_type): expected vehicles out at once}"""
+        today = epoch_day()
+        start = today - self.lookback_days
+        weeks = max(self.lookback_days // 7, 1)
+        rows = db.fetch_all("""
+            SELECT v.location_id, v.vehicle_type, (r.start_day - ?) / 7 AS week,
+                   COUNT(*) AS pickups, SUM(CASE WHEN r.end_day - r.start_day > 1 THEN r.end_day - r.start_day ELSE 1 END) AS days
+            FROM rentals r JOIN vehicles v ON v.id = r.vehicle_id
+            WHERE r.start_day >= ? AND r.start_day < ? AND r.status != 'cancelled'
+            GROUP BY v.location_id, v.vehicle_type, week
+        """, (start, start, today))
+
+        weekly = defaultdict(lambda: [0] * weeks)
+        days = defaultdict(lambda: [0, 0])
+        for row in rows:
+            key = (row['location_id'], row['vehicle_type'])
+            weekly[key][min(row['week'], weeks - 1)] += row['pickups']
+            days[key][0] += row['days']
+            days[key][1] += row['pickups']
+
+        demand = {}
+        for key, counts in weekly.items():
+            smoothed = counts[0]
+            for count in counts[1:]:
+                smoothed += self.WEEKLY_WEIGHT * (count - smoothed)
+            # Little's law: vehicles out at once = pickups per day x days each rental lasts
+            demand[key] = smoothed / 7 * (days[key][0] / days[key][1])
+        return demand
+
+    def _fleet(self):
+        today = epoch_day()
+        horizon = today + self.horizon_days
+        # "+r.start_day" keeps SQLite on idx_rentals_vehicle_status: open bookings
+        # are few per vehicle, while its whole history matches the day range
+        vehicles = db.fetch_all("""
+            SELECT v.id, v.license_plate, v.location_id, v.vehicle_type,
+                   v.status = 'available'
+                   AND NOT EXISTS (SELECT 1 FROM rentals r WHERE r.vehicle_id = v.id
+                                   AND r.status IN ('reserved', 'active') AND +r.start_day < ?)
+                   AND NOT EXISTS (SELECT 1 FROM maintenance_records m WHERE m.vehicle_id = v.id
+                                   AND m.status = 'scheduled' AND m.maintenance_day < ?) AS movable
+            FROM vehicles v
+            WHERE v.available = 1 AND v.location_id IS NOT NULL
+            ORDER BY v.id
+        """, (horizon, horizon))
+        branches = {row['id']: row for row in db.fetch_all("SELECT id, name, city, lat, lon FROM locations")}
+        return vehicles, branches
+
+    def _distance_km(self, a, b):
+        if a['lat'] is None or a['lon'] is None or b['lat'] is None or b['lon'] is None:
+            return UNKNOWN_DISTANCE_KM
+        return round(haversine_km(a['lat'], a['lon'], b['lat'], b['lon']))
+
+    def plan(self):
+        """``{'moves': [...], 'branches': [...], 'shortfall': n, 'distance_km': n}``"""
+        demand = self.forecast()
+        vehicles, branches = self._fleet()
+
+        stock = defaultdict(list)
+        for vehicle in vehicles:
+            stock[(vehicle['location_id'], vehicle['vehicle_type'])].append(vehicle)
+
+        positions = []
+        for key in sorted(set(stock) | set(demand), key=lambda k: (k[1] or '', k[0] or 0)):
+            location_id, vehicle_type = key
+            if location_id not in branches:
+                continue
+            on_hand = stock.get(key, [])
+            target = poisson_quantile(demand.get(key, 0.0), self.service_level)
+            movable = [v for v in on_hand if v['movable']]
+            positions.append({
+                'location_id': location_id, 'branch': branches[location_id]['name'], 'vehicle_type': vehicle_type,
+                'stock': len(on_hand), 'after': len(on_hand), 'forecast': round(demand.get(key, 0.0), 2), 'target': target,
+                'surplus': max(min(len(on_hand) - max(target, self.keep), len(movable)), 0),
+                'deficit': max(target - len(on_hand), 0),
+                'movable': movable,
+            })
+
+        # Nodes: 0 source, 1 sink, then one per position
+        network = MinCostFlow(len(positions) + 2)
+        for index, position in enumerate(positions, start=2):
+            if position['surplus']:
+                network.add_edge(0, index, position['surplus'], 0)
+            if position['deficit']:
+                network.add_edge(index, 1, position['deficit'], 0)
+        edges = []
+        for i, donor in enumerate(positions, start=2):
+            if not donor['surplus']:
+                continue
+            for j, taker in enumerate(positions, start=2):
+                if not taker['deficit'] or taker['vehicle_type'] != donor['vehicle_type']:
+                    continue
+                km = self._distance_km(branches[donor['location_id']], branches[taker['location_id']])
+                if self.max_km is None or km <= self.max_km:
+                    edges.append((donor, taker, km, network.add_edge(i, j, donor['surplus'], km)))
+        network.solve(0, 1)
+
+        moves = []
+        for donor, taker, km, handle in edges:
+            count = network.flow_on(handle)
+            if not count:
+                continue
+            chosen, donor['movable'] = donor['movable'][:count], donor['movable'][count:]
+            moves.append({
+                'vehicle_type': donor['vehicle_type'],
+                'from_branch': donor['branch'], 'to_branch': taker['branch'],
+                'vehicles': count, 'distance_km': km,
+                'license_plates': ' '.join(v['license_plate'] for v in chosen),
+            })
+            donor['after'] -= count
+            taker['after'] += count
+
+        for position in positions:
+            del position['movable']
+            position['shortfall'] = max(position['target'] - position['after'], 0)
+        return {
+            'moves': sorted(moves, key=lambda m: (m['vehicle_type'], m['from_branch'], m['to_branch'])),
+            'branches': positions,
+            'shortfall': sum(p['shortfall'] for p in positions),
+            'distance_km': sum(m['vehicles'] * m['distance_km'] for m in moves),
+        }
@@ -0,0 +1,70 @@
+import math
+
+from database import db
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def _bounding_box(lat, lon, radius_km):
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+class BranchLocator:
+    """Nearest branches with available stock, searched through the locations R*Tree.
+
+    The search box starts at ``start_radius_km`` and doubles until enough
+    branches lie within the radius itself (a box corner can hold a farther
+    branch than the next ring), so only nearby index pages are read.
+    """
+
+    _has_rtree = None
+
+    @classmethod
+    def _spatial_source(cls):
+        if cls._has_rtree is None:
+            cls._has_rtree = db.fetch_one(
+                "SELECT 1 FROM sqlite_master WHERE name = 'locations_rtree'") is not None
+        if cls._has_rtree:
+            # CROSS JOIN pins the join order: box search first, then stock per branch
+            return ("locations_rtree r CROSS JOIN locations l ON l.id = r.id",
+                    "r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?")
+        return ("locations l", "l.lat BETWEEN ? AND ? AND l.lon BETWEEN ? AND ?")
+
+    @classmethod
+    def _in_box(cls, box, vehicle_type):
+        source, condition = cls._spatial_source()
+        params = list(box)
+        type_filter = ""
+        if vehicle_type:
+            type_filter = "AND v.vehicle_type = ?"
+            params = [vehicle_type] + params
+        query = f"""
+            SELECT l.id, l.name, l.city, l.lat, l.lon, COUNT(v.id) AS available_vehicles
+            FROM {source}
+            CROSS JOIN vehicles v ON v.location_id = l.id AND v.status = 'available' {type_filter}
+            WHERE {condition}
+            GROUP BY l.id
+        """
+        return db.fetch_all(query, tuple(params))
+
+    @classmethod
+    def nearest(cls, lat, lon, vehicle_type=None, limit=5, start_radius_km=25, max_radius_km=20000):
+        """Closest ``limit`` branches with available vehicles (of ``vehicle_type``), nearest first"""
+        radius = start_radius_km
+        while True:
+            branches = [
+                dict(branch, distance_km=round(haversine_km(lat, lon, branch['lat'], branch['lon']), 2))
+                for branch in cls._in_box(_bounding_box(lat, lon, radius), vehicle_type)
+            ]
+            within = [branch for branch in branches if branch['distance_km'] <= radius]
+            if len(within) >= limit or radius >= max_radius_km:
+                return sorted(within or branches, key=lambda b: b['distance_km'])[:limit]
+            radius *= 2
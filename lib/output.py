@@ -0,0 +1,69 @@
+"""
+Machine-readable output for the CLI - JSON, JSON Lines and CSV written
+straight from ORM rows, in batches, without per-row string formatting.
+"""
+
+import csv
+import json
+import os
+import sys
+
+FORMATS = ('text', 'json', 'jsonl', 'csv')
+
+# One reusable encoder: compact separators, no ASCII escaping, no cycle checks on flat rows
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, check_circular=False, default=str)
+
+def _values(row):
+    """Row values in column order for sqlite3.Row, dict rows and plain tuples"""
+    return row.values() if isinstance(row, dict) else row
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _write_json(rows, fmt, out, batch_size):
+    encode = _encoder.encode
+    separator = '\n' if fmt == 'jsonl' else ','
+    keys = None
+    first = True
+    if fmt == 'json':
+        out.write('[')
+    for batch in _batches(rows, batch_size):
+        if keys is None:
+            keys = tuple(batch[0].keys())
+        chunk = separator.join(encode(dict(zip(keys, _values(row)))) for row in batch)
+        if not first:
+            chunk = separator + chunk
+        out.write(chunk)
+        first = False
+    out.write(']\n' if fmt == 'json' else ('' if first else '\n'))
+
+def _write_csv(rows, out, batch_size):
+    writer = csv.writer(out, lineterminator='\n')
+    header_written = False
+    for batch in _batches(rows, batch_size):
+        if not header_written:
+            writer.writerow(batch[0].keys())
+            header_written = True
+        writer.writerows(_values(row) for row in batch)
+
+def write_rows(rows, fmt, out=None, batch_size=1000):
+    """Stream ``rows`` (any iterable of sqlite3.Row or dicts) to ``out`` as json, jsonl or csv"""
+    out = out or sys.stdout
+    try:
+        if fmt == 'csv':
+            _write_csv(rows, out, batch_size)
+        else:
+            _write_json(rows, fmt, out, batch_size)
+        out.flush()
+    except BrokenPipeError:
+        # Downstream closed early (e.g. `| head`); silence the flush at interpreter exit
+        if out is sys.stdout:
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
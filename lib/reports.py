@@ -0,0 +1,123 @@
+"""
+Report runner - executes every report as an independent task across a process pool.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from backends import backend_from_url
+from database import db
+from models.orm import CarRentalORM
+from models.events import RentalProjector
+
+def table_counts():
+    """Row count of every table"""
+    tables = ['locations', 'vehicles', 'customers', 'rentals', 'maintenance_records', 'insurance', 'rental_events', 'vehicle_telemetry', 'documents']
+    return {table: db.fetch_one(f"SELECT COUNT(*) as total FROM {table}")['total'] for table in tables}
+
+def utilization_last_30_days():
+    """Historical utilization over the last 30 days"""
+    today = datetime.now().date()
+    start = (today - timedelta(days=29)).strftime('%Y-%m-%d')
+    return RentalProjector.utilization(start, today.strftime('%Y-%m-%d'))
+
+# Independent report tasks, looked up by name inside the worker processes
+REPORT_TASKS = {
+    'revenue': CarRentalORM.get_revenue_report,
+    'utilization': CarRentalORM.get_utilization_report,
+    'utilization_30d': utilization_last_30_days,
+    'table_counts': table_counts,
+    'available_vehicles': CarRentalORM.find_available_vehicles,
+    'active_rentals': CarRentalORM.find_active_rentals,
+    'overdue_rentals': CarRentalORM.find_overdue_rentals,
+    'overdue_maintenance': CarRentalORM.find_overdue_maintenance,
+    'scheduled_maintenance': CarRentalORM.find_scheduled_maintenance,
+    'expiring_insurance': CarRentalORM.find_expiring_insurance,
+}
+
+def _plain(value):
+    """Convert sqlite3.Row results into picklable, JSON-friendly values"""
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+def _worker_target():
+    """Database target the workers open: the same file or server as this process"""
+    if db.backend.name == 'sqlite':
+        if db.db_name == ':memory:' or 'mode=memory' in db.db_name:
+            raise ValueError("Reports cannot run in parallel on an in-memory database (other processes cannot see it)")
+        # URIs are passed through as they are; plain paths are made absolute
+        return db.db_name if db.db_name.startswith('file:') else os.path.abspath(db.db_name)
+    if db.backend.name == 'postgresql':
+        return db.db_name
+    raise ValueError(f"Reports cannot run in parallel on the {db.backend.name} backend")
+
+def _init_worker(target):
+    # Each worker opens its own read-only connections to the same database
+    db.backend, target = backend_from_url(target)
+    db.pool = None
+    db.open_read_only(target)
+
+def _run_task(name):
+    started = time.perf_counter()
+    outcome = {}
+    try:
+        outcome['result'] = _plain(REPORT_TASKS[name]())
+    except Exception as e:
+        # A failed report carries the error instead of a result, so it cannot pass for an empty one
+        outcome['error'] = f"{type(e).__name__}: {e}"
+        outcome['traceback'] = traceback.format_exc()
+    return {
+        **outcome,
+        'seconds': round(time.perf_counter() - started, 6),
+        'pid': os.getpid(),
+    }
+
+class ReportRunner:
+    """Runs report tasks in parallel and merges them into one document.
+
+    A task that fails is reported with an ``error`` instead of a ``result``
+    and listed under ``failed``; the other reports still complete.
+    """
+
+    def __init__(self, workers=None, tasks=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.tasks = tasks or list(REPORT_TASKS)
+
+    def run(self):
+        unknown = [name for name in self.tasks if name not in REPORT_TASKS]
+        if unknown:
+            raise ValueError(f"Unknown reports: {', '.join(unknown)}")
+
+        started = time.perf_counter()
+        target = _worker_target()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(target,)) as pool:
+            futures = {name: pool.submit(_run_task, name) for name in self.tasks}
+            reports = {name: future.result() for name, future in futures.items()}
+
+        return {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'database': target if db.backend.name == 'sqlite' else db.backend.name,
+            'workers': self.workers,
+            'elapsed_seconds': round(time.perf_counter() - started, 6),
+            'failed': [name for name, report in reports.items() if 'error' in report],
+            'reports': reports,
+        }
+
+    def write(self, document, output=None):
+        """Write the merged document as JSON to a file or stdout"""
+        text = json.dumps(document, indent=2, default=str)
+        if output:
+            with open(output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
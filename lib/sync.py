@@ -0,0 +1,468 @@
+"""
+Offline branch terminals - each terminal works on a local SQLite replica and
+exchanges only changed rows with the central database.
+
+Triggers append ``(table, row id)`` to ``change_log`` whenever a synced row
+is written. A sync pushes the rows the terminal changed, then pulls the rows
+changed centrally since the terminal's last sync. Rows created offline get
+provisional IDs (from LOCAL_ID_BASE up) that are swapped for the central IDs
+once pushed.
+
+When both sides changed the same row since the terminal last synced:
+
+- rentals: the further-progressed status wins (reserved < active <
+  completed/cancelled) together with its return date, so a pickup or
+  return recorded anywhere is never undone, while the other columns keep
+  their central values; an offline booking that overlaps a central booking of the same
+  vehicle is kept as cancelled and reported back as rejected
+- vehicles and every other table: the central copy wins (head office owns
+  the fleet record); derived columns such as vehicles.status are never
+  sent, each side recomputes them
+- new rows matching an existing row's natural key (customer email or
+  licence, licence plate, policy number) are merged into that row
+
+The rental event log is written centrally only. A terminal records no events
+of its own (a trigger drops them); it pulls the central events, IDs and all,
+so every replica holds the same append-only history. An offline booking's
+history appears once it has been pushed and has its central ID.
+"""
+
+import gzip
+import json
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from database import db, Database, SYNCED_TABLES, DERIVED_COLUMNS, epoch_day
+from models.events import RentalEventLog
+from models.orm import CarRentalORM
+
+# Provisional IDs for rows created on a terminal, far above any central ID
+LOCAL_ID_BASE = 1 << 40
+
+# Rental statuses by how far the rental has progressed
+PROGRESS = {'reserved': 0, 'active': 1, 'completed': 2, 'cancelled': 2}
+# Columns a further-progressed terminal rental brings along in a conflict
+PROGRESS_COLUMNS = ('status', 'actual_return_date')
+
+NATURAL_KEYS = {
+    'customers': ('email', 'license_number'),
+    'vehicles': ('license_plate',),
+    'insurance': ('policy_number',),
+}
+
+# Columns that follow a provisional ID without a FOREIGN KEY constraint
+LOOSE_REFERENCES = {
+    'locations': [('locations_rtree', 'id')],
+}
+
+EVENT_COLUMNS = ('id', 'rental_id', 'vehicle_id', 'customer_id', 'event_type', 'event_date',
+                 'start_date', 'end_date', 'total_amount', 'recorded_at')
+
+def _state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def _set_state(conn, key, value):
+    if value is None:
+        conn.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+    else:
+        conn.execute("INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                     "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+
+def _last_seq(conn):
+    # AUTOINCREMENT keeps counting after old entries are pruned
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+            if row[1] not in DERIVED_COLUMNS.get(table, ())]
+
+def _foreign_keys(conn, table):
+    """{column: parent table} for the table's FOREIGN KEY constraints"""
+    return {row[3]: row[2] for row in conn.execute(f"PRAGMA foreign_key_list({table})")}
+
+def _references(conn, parent):
+    """Every (table, column) pointing at ``parent`` rows"""
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    found = [(table, column) for table in tables if not table.startswith('sqlite_')
+             for column, target in _foreign_keys(conn, table).items() if target == parent]
+    return found + [(table, column) for table, column in LOOSE_REFERENCES.get(parent, []) if table in tables]
+
+def _latest_changes(conn, after, upto, exclude_origin=None):
+    """Latest ``(table, row id, op)`` per row logged in ``(after, upto]``.
+
+    Without ``exclude_origin`` only local changes (no origin) are returned.
+    """
+    origin = "c.origin IS NOT ?" if exclude_origin else "c.origin IS NULL"
+    params = (after, upto, exclude_origin) if exclude_origin else (after, upto)
+    return conn.execute(f"""
+        SELECT c.table_name, c.row_id, c.op
+        FROM (SELECT MAX(seq) AS seq FROM change_log WHERE seq > ? AND seq <= ? GROUP BY table_name, row_id) latest
+        JOIN change_log c ON c.seq = latest.seq
+        WHERE {origin}
+    """, params).fetchall()
+
+def _export(conn, changes, skip_provisional_deletes=False):
+    """Current contents of changed rows per table: {table: {'columns', 'rows', 'deleted'}}"""
+    tables = {}
+    for table in SYNCED_TABLES:
+        ids = [row_id for name, row_id, op in changes if name == table and op == 'upsert']
+        deleted = [row_id for name, row_id, op in changes if name == table and op == 'delete'
+                   and not (skip_provisional_deletes and row_id >= LOCAL_ID_BASE)]
+        if not ids and not deleted:
+            continue
+        columns = _columns(conn, table)
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows += [[row[column] for column in columns] for row in conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)]
+        tables[table] = {'columns': columns, 'rows': rows, 'deleted': deleted}
+    return tables
+
+def _write_row(database, conn, table, row_id, row, record_events=True):
+    """Insert or update one row by ID, recording rental events like the ORM does (central side only)"""
+    current = conn.execute(f"SELECT * FROM {table} WHERE id = ?", (row_id,)).fetchone()
+    if current is None:
+        database.insert(conn, table, dict(row, id=row_id))
+        if table == 'rentals' and record_events:
+            RentalEventLog.record_created(conn, row_id)
+    elif row:
+        assignments = ', '.join(f"{column} = ?" for column in row)
+        conn.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", tuple(row.values()) + (row_id,))
+        if table == 'rentals' and record_events:
+            RentalEventLog.record_updated(conn, current, row_id)
+
+def _pack(payload):
+    return gzip.compress(json.dumps(payload, separators=(',', ':'), default=str).encode())
+
+def _unpack(body):
+    return json.loads(gzip.decompress(body))
+
+class CentralSync:
+    """The central database's side: creates replicas, applies pushes and serves deltas"""
+
+    def __init__(self, database=None):
+        self.database = database or db
+        self.database.require_sqlite("Branch sync")
+
+    def register(self, terminal, replica_path):
+        """Write a full replica for a new terminal (the only full copy it ever receives)"""
+        with self.database.transaction() as conn:
+            _set_state(conn, 'role', 'central')
+            seq = _last_seq(conn)
+            conn.execute("""
+                INSERT INTO sync_peers (terminal, pulled_seq, last_sync) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (terminal) DO UPDATE SET pulled_seq = excluded.pulled_seq, last_sync = excluded.last_sync
+            """, (terminal, seq))
+
+        replica = Database(replica_path, initialize=False)
+        source = self.database.get_connection()
+        target = replica.get_connection()
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+        with replica.transaction() as conn:
+            _set_state(conn, 'role', 'terminal')
+            _set_state(conn, 'terminal', terminal)
+            _set_state(conn, 'pulled_seq', seq)
+            _set_state(conn, 'pulled_event', conn.execute("SELECT COALESCE(MAX(id), 0) FROM rental_events").fetchone()[0])
+            for table in ('change_log', 'sync_peers', 'sync_id_map'):
+                conn.execute(f"DELETE FROM {table}")
+            for table in SYNCED_TABLES:
+                conn.execute("INSERT OR IGNORE INTO sqlite_sequence (name, seq) "
+                             "SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)", (table, table))
+                conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (LOCAL_ID_BASE, table))
+        return seq
+
+    def peers(self):
+        return self.database.fetch_all("SELECT * FROM sync_peers ORDER BY terminal")
+
+    def changes_since(self, terminal, since, events_since=None):
+        """Rows changed centrally after ``since``, minus the ones ``terminal`` pushed itself.
+
+        With ``events_since``, rental events with a higher ID come along too.
+        """
+        with self.database.transaction() as conn:
+            # Pulling from ``since`` acknowledges everything up to it
+            conn.execute("UPDATE sync_peers SET pulled_seq = MAX(pulled_seq, ?), last_sync = CURRENT_TIMESTAMP "
+                         "WHERE terminal = ?", (since, terminal))
+            conn.execute("DELETE FROM change_log WHERE seq <= (SELECT MIN(pulled_seq) FROM sync_peers)")
+            seq = _last_seq(conn)
+            changes = _latest_changes(conn, since, seq, exclude_origin=terminal)
+            delta = {'seq': seq, 'tables': _export(conn, changes)}
+            if events_since is not None:
+                delta['events'] = {'columns': EVENT_COLUMNS, 'rows': [list(row) for row in conn.execute(
+                    f"SELECT {', '.join(EVENT_COLUMNS)} FROM rental_events WHERE id > ? ORDER BY id", (events_since,))]}
+            return delta
+
+    def apply_push(self, payload):
+        """Apply a terminal's changed rows under the conflict rules.
+
+        Returns ``{'ids': [[table, provisional id, central id], ...],
+        'rejected': [provisional ids of bookings kept as cancelled]}``.
+        """
+        terminal, since = payload['terminal'], payload['since']
+        ids, rejected, touched = [], [], set()
+        with self.database.transaction() as conn:
+            _set_state(conn, 'origin', terminal)
+            known = {(row[0], row[1]): row[2] for row in conn.execute(
+                "SELECT table_name, local_id, central_id FROM sync_id_map WHERE terminal = ?", (terminal,))}
+
+            for table in SYNCED_TABLES:
+                delta = payload['tables'].get(table)
+                if not delta:
+                    continue
+                touched.add(table)
+                columns = set(_columns(conn, table))
+                foreign_keys = _foreign_keys(conn, table)
+                for values in delta['rows']:
+                    row = {column: value for column, value in zip(delta['columns'], values) if column in columns}
+                    for column, parent in foreign_keys.items():
+                        row[column] = known.get((parent, row.get(column)), row.get(column))
+                    row_id = row.pop('id')
+                    if row_id >= LOCAL_ID_BASE:
+                        if (table, row_id) not in known:
+                            known[(table, row_id)] = self._insert(conn, table, row, row_id, rejected)
+                            conn.execute("INSERT INTO sync_id_map VALUES (?, ?, ?, ?)",
+                                         (terminal, table, row_id, known[(table, row_id)]))
+                        else:
+                            self._update(conn, table, known[(table, row_id)], row, terminal, since)
+                        ids.append([table, row_id, known[(table, row_id)]])
+                    else:
+                        self._update(conn, table, row_id, row, terminal, since)
+
+            # Children before parents
+            for table in reversed(SYNCED_TABLES):
+                for row_id in payload['tables'].get(table, {}).get('deleted', []):
+                    row_id = known.get((table, row_id), row_id)
+                    if not self._changed_centrally(conn, table, row_id, terminal, since):
+                        conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+            _set_state(conn, 'origin', None)
+
+        for table in touched:
+            CarRentalORM.notify(table)
+        return {'ids': ids, 'rejected': rejected}
+
+    @staticmethod
+    def _changed_centrally(conn, table, row_id, terminal, since):
+        return conn.execute(
+            "SELECT 1 FROM change_log WHERE table_name = ? AND row_id = ? AND seq > ? AND origin IS NOT ? LIMIT 1",
+            (table, row_id, since, terminal)).fetchone() is not None
+
+    def _insert(self, conn, table, row, provisional_id, rejected):
+        for key in NATURAL_KEYS.get(table, ()):
+            if row.get(key) is not None:
+                match = conn.execute(f"SELECT id FROM {table} WHERE {key} = ?", (row[key],)).fetchone()
+                if match:
+                    return match[0]
+        if table == 'rentals' and row.get('status') in ('reserved', 'active'):
+            clash = conn.execute("""
+                SELECT 1 FROM rentals
+                WHERE vehicle_id = ? AND status IN ('reserved', 'active') AND start_day < ? AND end_day > ?
+                LIMIT 1
+            """, (row['vehicle_id'], epoch_day(row['end_date']), epoch_day(row['start_date']))).fetchone()
+            if clash:
+                row['status'] = 'cancelled'
+                rejected.append(provisional_id)
+        central_id = self.database.insert(conn, table, row)
+        if table == 'rentals':
+            RentalEventLog.record_created(conn, central_id)
+        return central_id
+
+    def _update(self, conn, table, row_id, row, terminal, since):
+        current = conn.execute(f"SELECT * FROM {table} WHERE id = ?", (row_id,)).fetchone()
+        if current is None:
+            # Deleted centrally: the deletion stands
+            return
+        if self._changed_centrally(conn, table, row_id, terminal, since):
+            progressed = table == 'rentals' and PROGRESS.get(row.get('status'), 0) > PROGRESS.get(current['status'], 0)
+            if not progressed:
+                return
+            # Logged as a central change so the terminal pulls the merged row back
+            _set_state(conn, 'origin', None)
+            _write_row(self.database, conn, table, row_id, {column: row[column] for column in PROGRESS_COLUMNS if column in row})
+            _set_state(conn, 'origin', terminal)
+            return
+        _write_row(self.database, conn, table, row_id, row)
+
+class TerminalSync:
+    """The terminal's side: pushes local changes, adopts central IDs and applies pulled deltas"""
+
+    def __init__(self, transport, database=None):
+        self.transport = transport
+        self.database = database or db
+        self.database.require_sqlite("Branch sync")
+
+    def status(self):
+        conn = self.database.get_connection()
+        try:
+            return {
+                'role': _state(conn, 'role'),
+                'terminal': _state(conn, 'terminal'),
+                'pulled_seq': _state(conn, 'pulled_seq'),
+                'pending_changes': conn.execute(
+                    "SELECT COUNT(DISTINCT table_name || ':' || row_id) FROM change_log WHERE origin IS NULL").fetchone()[0],
+            }
+        finally:
+            conn.close()
+
+    def sync(self):
+        """Push, then pull; returns counts and the bytes sent over the link"""
+        conn = self.database.get_connection()
+        try:
+            terminal = _state(conn, 'terminal')
+            if _state(conn, 'role') != 'terminal' or not terminal:
+                raise ValueError("This database is not a branch terminal replica (create one with sync clone)")
+            since = int(_state(conn, 'pulled_seq', 0))
+            events_since = int(_state(conn, 'pulled_event', 0))
+            upto = _last_seq(conn)
+            changes = _latest_changes(conn, 0, upto)
+            tables = _export(conn, changes, skip_provisional_deletes=True)
+        finally:
+            conn.close()
+
+        stats = {'pushed': sum(len(d['rows']) + len(d['deleted']) for d in tables.values()),
+                 'pulled': 0, 'rejected': []}
+        if tables:
+            result = self.transport.push({'terminal': terminal, 'since': since, 'tables': tables})
+            stats['rejected'] = self._adopt(result, upto)
+        elif changes:
+            with self.database.transaction() as conn:
+                conn.execute("DELETE FROM change_log WHERE seq <= ?", (upto,))
+
+        delta = self.transport.pull(terminal, since, events_since)
+        stats['pulled'] = self._apply(delta)
+        stats['bytes_sent'], stats['bytes_received'] = self.transport.sent, self.transport.received
+        return stats
+
+    def _adopt(self, result, upto):
+        """Swap provisional IDs for central ones and cancel rejected bookings"""
+        mapping = {(table, local_id): central_id for table, local_id, central_id in result['ids']}
+        with self.database.transaction() as conn:
+            _set_state(conn, 'origin', 'central')
+            conn.execute("PRAGMA defer_foreign_keys = ON")
+            for (table, local_id), central_id in mapping.items():
+                self._move(conn, table, local_id, central_id)
+            for local_id in result['rejected']:
+                rental_id = mapping.get(('rentals', local_id), local_id)
+                _write_row(self.database, conn, 'rentals', rental_id, {'status': 'cancelled'}, record_events=False)
+            conn.execute("DELETE FROM change_log WHERE seq <= ? OR origin IS NOT NULL", (upto,))
+            _set_state(conn, 'origin', None)
+        for table in {table for table, _ in mapping}:
+            CarRentalORM.notify(table)
+        return [mapping.get(('rentals', local_id), local_id) for local_id in result['rejected']]
+
+    @staticmethod
+    def _move(conn, table, local_id, central_id):
+        """Re-key one row (and everything pointing at it); merge it away if the central row is already here"""
+        # The event log never holds provisional IDs: terminals only copy central events
+        for child, column in _references(conn, table):
+            conn.execute(f"UPDATE {child} SET {column} = ? WHERE {column} = ?", (central_id, local_id))
+        if conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (central_id,)).fetchone():
+            conn.execute(f"DELETE FROM {table} WHERE id = ?", (local_id,))
+        else:
+            conn.execute(f"UPDATE {table} SET id = ? WHERE id = ?", (central_id, local_id))
+
+    def _apply(self, delta):
+        """Apply pulled rows; rows with local changes not yet pushed are left for the next sync"""
+        applied = 0
+        with self.database.transaction() as conn:
+            _set_state(conn, 'origin', 'central')
+            conn.execute("PRAGMA defer_foreign_keys = ON")
+            pending = {(row[0], row[1]) for row in conn.execute(
+                "SELECT table_name, row_id FROM change_log WHERE origin IS NULL")}
+            for table in SYNCED_TABLES:
+                delta_rows = delta['tables'].get(table, {})
+                columns = set(_columns(conn, table))
+                for values in delta_rows.get('rows', []):
+                    row = {column: value for column, value in zip(delta_rows['columns'], values) if column in columns}
+                    row_id = row.pop('id')
+                    if (table, row_id) in pending:
+                        continue
+                    self._merge_provisional(conn, table, row_id, row)
+                    _write_row(self.database, conn, table, row_id, row, record_events=False)
+                    applied += 1
+            for table in reversed(SYNCED_TABLES):
+                for row_id in delta['tables'].get(table, {}).get('deleted', []):
+                    if (table, row_id) not in pending:
+                        applied += conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,)).rowcount
+            events = delta.get('events')
+            if events and events['rows']:
+                # Copied with their central IDs, in order; INSERT OR IGNORE makes a repeated pull harmless
+                conn.executemany(f"INSERT OR IGNORE INTO rental_events ({', '.join(events['columns'])}) "
+                                 f"VALUES ({', '.join('?' * len(events['columns']))})", events['rows'])
+                _set_state(conn, 'pulled_event', events['rows'][-1][0])
+            conn.execute("DELETE FROM change_log WHERE origin IS NOT NULL")
+            _set_state(conn, 'origin', None)
+            _set_state(conn, 'pulled_seq', delta['seq'])
+        for table in delta['tables']:
+            CarRentalORM.notify(table)
+        return applied
+
+    def _merge_provisional(self, conn, table, row_id, row):
+        """A central row arriving with the natural key of an unpushed local row takes that row over"""
+        for key in NATURAL_KEYS.get(table, ()):
+            if row.get(key) is None:
+                continue
+            local = conn.execute(f"SELECT id FROM {table} WHERE {key} = ? AND id >= ? AND id != ?",
+                                 (row[key], LOCAL_ID_BASE, row_id)).fetchone()
+            if local:
+                self._move(conn, table, local[0], row_id)
+
+class LocalTransport:
+    """Sync with a central database file the terminal can open (shared drive, USB stick)"""
+
+    def __init__(self, path):
+        self.central = CentralSync(Database(path))
+        self.sent = self.received = 0
+
+    def _exchange(self, reply):
+        body = _pack(reply)
+        self.received += len(body)
+        return _unpack(body)
+
+    def push(self, payload):
+        body = _pack(payload)
+        self.sent += len(body)
+        return self._exchange(self.central.apply_push(_unpack(body)))
+
+    def pull(self, terminal, since, events_since=None):
+        return self._exchange(self.central.changes_since(terminal, since, events_since))
+
+class HTTPTransport:
+    """Sync through a central API server (``api serve``) with gzip-compressed JSON"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.sent = self.received = 0
+
+    def _request(self, path, body=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            headers.update({'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.sent += len(body)
+        with urlopen(Request(self.url + path, data=body, headers=headers), timeout=self.timeout) as response:
+            reply = response.read()
+        self.received += len(reply)
+        return _unpack(reply)
+
+    def push(self, payload):
+        return self._request('/sync/push', _pack(payload))
+
+    def pull(self, terminal, since, events_since=None):
+        query = {'terminal': terminal, 'since': since}
+        if events_since is not None:
+            query['events_since'] = events_since
+        return self._request('/sync/changes?' + urlencode(query))
+
+def transport_for(central):
+    """HTTP transport for an API server URL, otherwise the central database file"""
+    if central.startswith(('http://', 'https://')):
+        return HTTPTransport(central)
+    return LocalTransport(central)
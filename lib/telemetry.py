@@ -0,0 +1,200 @@
+"""
+Telemetry ingestion - a bounded queue drained by one background writer that
+group-commits odometer, fuel and GPS readings into ``vehicle_telemetry``.
+"""
+
+import queue
+import threading
+import time
+from datetime import datetime
+
+from database import db
+
+# Readings for the same vehicle and millisecond are merged, later values winning
+UPSERT_READING = """
+    INSERT INTO vehicle_telemetry (vehicle_id, recorded_ms, odometer_km, fuel_pct, lat, lon)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (vehicle_id, recorded_ms) DO UPDATE SET
+        odometer_km = COALESCE(excluded.odometer_km, odometer_km),
+        fuel_pct = COALESCE(excluded.fuel_pct, fuel_pct),
+        lat = COALESCE(excluded.lat, lat),
+        lon = COALESCE(excluded.lon, lon)
+"""
+
+# durability -> SQLite synchronous setting for the writer connection (the journal mode is the file's own)
+DURABILITY = {
+    'full': 'FULL',      # every batch is on disk when its commit returns
+    'normal': 'NORMAL',  # fewer syncs; with the default rollback journal a badly timed power cut can
+                         # corrupt the file (very rarely), with WAL it only loses the last batches
+    'off': 'OFF',        # fastest; batches may be lost, or the file corrupted, on an OS crash or power cut
+}
+
+# How often waits look at whether the writer is still alive
+_POLL_SECONDS = 0.1
+
+def _recorded_ms(value):
+    if value is None:
+        return int(time.time() * 1000)
+    if isinstance(value, (int, float)):
+        # Epoch seconds or milliseconds
+        return int(value * 1000) if value < 1e11 else int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+def reading_row(reading):
+    """Parameter tuple for one reading dict (vehicle_id plus any of the measurements)"""
+    return (
+        int(reading['vehicle_id']), _recorded_ms(reading.get('recorded_at')),
+        reading.get('odometer_km'), reading.get('fuel_pct'), reading.get('lat'), reading.get('lon'),
+    )
+
+class TelemetryIngestor:
+    """Accepts readings from any thread and writes them in batches from one writer thread.
+
+    A batch is committed when ``batch_size`` readings are waiting or
+    ``max_delay`` seconds after its first reading, whichever comes first.
+    The queue holds at most ``max_pending`` readings: ``submit`` then blocks
+    (backpressure) or, with ``block=False``, raises ``queue.Full``. Batches
+    are short transactions on their own connection so interactive rental
+    writes get the database lock between them. If the writer thread dies,
+    ``submit`` and ``flush`` raise RuntimeError instead of waiting forever.
+    """
+
+    def __init__(self, batch_size=500, max_delay=0.05, max_pending=20000, durability='normal'):
+        if durability not in DURABILITY:
+            raise ValueError(f"Unknown durability '{durability}' (choose from {', '.join(DURABILITY)})")
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.durability = durability
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = None
+        self.stopping = threading.Event()
+        self.error = None
+        self.crashed = threading.Event()
+        self.stats = {'written': 0, 'batches': 0, 'failed': 0}
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+            self.thread.start()
+        return self
+
+    def _check_writer(self):
+        if self.crashed.is_set():
+            raise RuntimeError(f"Telemetry writer stopped: {self.error}")
+
+    def submit(self, reading, block=True, timeout=None):
+        """Queue one reading dict; waits for room when the queue is full unless ``block`` is False"""
+        self._check_writer()
+        self.pending.put(reading_row(reading), block, timeout)
+
+    def submit_many(self, readings, block=True, timeout=None):
+        for reading in readings:
+            self.submit(reading, block, timeout)
+
+    def flush(self, timeout=None):
+        """Wait until every queued reading has been committed (or failed); False if ``timeout`` ran out"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.pending.all_tasks_done:
+            while self.pending.unfinished_tasks:
+                self._check_writer()
+                wait = _POLL_SECONDS if deadline is None else min(_POLL_SECONDS, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+                self.pending.all_tasks_done.wait(wait)
+        self._check_writer()
+        return True
+
+    def stop(self, timeout=None):
+        """Commit what is queued and stop the writer.
+
+        Readings still queued after ``timeout`` are dropped. A writer that
+        died is not raised here; ``crashed`` and ``error`` tell what happened.
+        """
+        if self.thread is None:
+            return
+        try:
+            self.flush(timeout)
+        except RuntimeError:
+            pass
+        self.stopping.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _connect(self):
+        conn = db.backend.connect(db.db_name, shared=True)
+        if db.backend.name == 'sqlite':
+            # The journal mode belongs to the database file and is left as configured;
+            # the writer waits briefly for interactive writes
+            conn.execute(f"PRAGMA synchronous = {DURABILITY[self.durability]}")
+            conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _next_batch(self):
+        try:
+            batch = [self.pending.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, conn, rows):
+        try:
+            db.backend.executemany(conn, UPSERT_READING, rows)
+            conn.commit()
+            return True
+        except db.backend.Error as e:
+            conn.rollback()
+            self.error = e
+            return False
+
+    def _write(self, conn, batch):
+        try:
+            if self._commit(conn, batch):
+                self.stats['written'] += len(batch)
+                self.stats['batches'] += 1
+                return
+            # Keep the good readings: retry one by one so a bad row (e.g. unknown vehicle) only loses itself
+            for row in batch:
+                if self._commit(conn, [row]):
+                    self.stats['written'] += 1
+                else:
+                    self.stats['failed'] += 1
+        finally:
+            for _ in batch:
+                self.pending.task_done()
+
+    def _run(self):
+        conn = None
+        try:
+            conn = self._connect()
+            while not (self.stopping.is_set() and self.pending.empty()):
+                batch = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+        except Exception as e:
+            self.error = e
+            self.crashed.set()
+            # Release anyone waiting on readings that will never be written
+            while True:
+                try:
+                    self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                self.stats['failed'] += 1
+                self.pending.task_done()
+        finally:
+            if conn is not None:
+                conn.close()
+
+def latest_readings(vehicle_id, limit=20):
+    """Most recent readings for one vehicle, newest first"""
+    return db.fetch_all(
+        "SELECT * FROM vehicle_telemetry WHERE vehicle_id = ? ORDER BY recorded_ms DESC LIMIT ?",
+        (vehicle_id, limit))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+# The modules import each other from lib/, as they do when cli.py runs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
+# Importing database builds the shared db; keep it away from car_rental.db
+os.environ.setdefault('CAR_RENTAL_DATABASE_URL', ':memory:')
+
+import pytest
+from click.testing import CliRunner
+
+from fixtures import template
+
+@pytest.fixture(autouse=True)
+def isolated_db():
+    """Every test runs on its own copy of the sample data"""
+    with template.isolated() as database:
+        yield database
+
+@pytest.fixture
+def runner():
+    return CliRunner()
+
+@pytest.fixture
+def invoke(runner):
+    """Run a CLI command line and return its result"""
+    from cli import cli
+
+    def run(*args, input=None):
+        return runner.invoke(cli, [str(arg) for arg in args], input=input, catch_exceptions=False)
+    return run
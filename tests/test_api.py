@@ -0,0 +1,43 @@
+import json
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from api import APIHandler, ResponseCache
+from models.orm import CarRentalORM
+
+@pytest.fixture
+def api():
+    """An API server on a free port, answering from the test's database"""
+    cache = ResponseCache()
+    cache.start()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), type('Handler', (APIHandler,), {'cache': cache}))
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+
+    def request(method, path, body=None):
+        conn = HTTPConnection(*server.server_address, timeout=5)
+        try:
+            payload = body if isinstance(body, bytes) or body is None else json.dumps(body).encode()
+            conn.request(method, path, payload, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read() or b'null')
+        finally:
+            conn.close()
+    yield request
+    server.shutdown()
+    server.server_close()
+    cache.stop()
+
+@pytest.mark.parametrize('body', [[1, 2], 'text', 5])
+def test_post_rejects_a_body_that_is_not_an_object(api, body):
+    status, reply = api('POST', '/rentals/1/return', body)
+    assert status == 400
+    assert 'JSON object' in reply['error']
+
+def test_vehicle_type_in_the_path_is_unquoted(api):
+    status, rows = api('GET', '/vehicles/type/%53UV')
+    assert status == 200
+    assert rows and [row['id'] for row in rows] == [v['id'] for v in CarRentalORM.find_vehicles_by_type('SUV')]
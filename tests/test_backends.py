@@ -0,0 +1,93 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from backends import DBAPIBackend, SQLiteBackend, _split_placeholders
+from cache import FleetStateCache
+from database import db, Database
+from housekeeping import DatabaseMaintenance
+from models.dedupe import CustomerDeduplicator
+from models.loyalty import LoyaltyTiers
+from models.orm import CarRentalORM
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+@pytest.fixture(params=['named', 'numeric'])
+def stand_in(request, isolated_db):
+    """Serve the sample data through DBAPIBackend, with sqlite3 standing in for a server driver"""
+    backend = DBAPIBackend(sqlite3, paramstyle=request.param, uri=True)
+    with db.redirect(Database(isolated_db.db_name, backend=backend, initialize=False)):
+        yield backend
+
+def test_placeholders_inside_literals_are_kept():
+    assert _split_placeholders("SELECT '?', \"a?\" FROM t WHERE x = ? AND y = ?") == [
+        "SELECT '?', \"a?\" FROM t WHERE x = ", " AND y = ", ""]
+
+def test_adapt_rewrites_placeholders_to_the_paramstyle():
+    query = "SELECT * FROM rentals WHERE status = '?' AND id = ? AND customer_id = ?"
+    assert DBAPIBackend(sqlite3, paramstyle='named').adapt(query).endswith("'?' AND id = :p0 AND customer_id = :p1")
+    assert DBAPIBackend(sqlite3, paramstyle='numeric').adapt(query).endswith("id = :1 AND customer_id = :2")
+    assert DBAPIBackend(sqlite3, paramstyle='format').adapt(query).endswith("id = %s AND customer_id = %s")
+
+def test_finders_return_dict_rows(stand_in):
+    customer = CarRentalORM.find_by_id('customers', 2)
+    assert isinstance(customer, dict) and customer['email'] == 'mary.wanjiku@email.com'
+    assert len(CarRentalORM.get_all('vehicles')) == 8
+    assert len(list(CarRentalORM.get_all('rentals', stream=True))) == 3
+
+def test_create_and_update(stand_in):
+    customer_id = CarRentalORM.create('customers', {
+        'first_name': 'Amina', 'last_name': 'Hassan', 'email': 'amina.hassan@email.com',
+        'phone': '0756-789012', 'license_number': 'D9988776'})
+    CarRentalORM.update('customers', customer_id, {'phone': '0756-000000'})
+    assert CarRentalORM.find_by_id('customers', customer_id)['phone'] == '0756-000000'
+
+def test_booking_round_trip(stand_in):
+    rental_id, total = CarRentalORM.book_rental(2, 2, day(0), day(2))
+    assert CarRentalORM.find_by_id('vehicles', 2)['status'] == 'rented'
+    CarRentalORM.return_rental(rental_id, day(2))
+    assert CarRentalORM.find_by_id('vehicles', 2)['status'] == 'available'
+    assert CarRentalORM.get_revenue_report()['total_revenue'] == pytest.approx(17500.0 + 18000.0 + 9000.0 + total)
+
+def test_duplicate_keys_raise_the_driver_integrity_error(stand_in):
+    with pytest.raises(stand_in.IntegrityError):
+        CarRentalORM.create('customers', {
+            'first_name': 'John', 'last_name': 'Kamau', 'email': 'john.kamau@email.com',
+            'phone': '0700-000000', 'license_number': 'D0000000'})
+
+def test_sqlite_only_features_are_refused(stand_in):
+    with pytest.raises(ValueError, match="only available for the SQLite backend"):
+        DatabaseMaintenance.vacuum()
+    with pytest.raises(ValueError, match="only available for the SQLite backend"):
+        LoyaltyTiers.rebuild()
+    with pytest.raises(ValueError, match="only available for the SQLite backend"):
+        db.clone()
+    with pytest.raises(ValueError, match="only available for the SQLite backend"):
+        CustomerDeduplicator.merge(4, [5])
+
+def test_session_cache_stays_off(stand_in):
+    cache = FleetStateCache()
+    cache.start()
+    assert not cache.active
+
+@pytest.mark.parametrize('uri', [False, True])
+def test_read_only_connections_refuse_writes(isolated_db, uri):
+    copy = isolated_db.clone(temporary=True)
+    target = f"file:{copy.db_name}" if uri else copy.db_name
+    conn = SQLiteBackend().connect(target, read_only=True)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM rentals")
+    finally:
+        conn.close()
+        copy.close()
+
+def test_read_only_shared_memory_connections_refuse_writes(isolated_db):
+    conn = SQLiteBackend().connect(isolated_db.db_name, read_only=True)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM rentals")
+    finally:
+        conn.close()
@@ -0,0 +1,64 @@
+from api import ResponseCache
+from cache import FleetStateCache
+from database import db
+from models.orm import CarRentalORM
+
+def write_elsewhere(sql):
+    """Commit a change the way another process would, without telling the ORM listeners"""
+    with db.transaction() as conn:
+        db.execute(conn, sql)
+
+def test_fleet_cache_sees_writes_from_other_processes():
+    cache = FleetStateCache()
+    cache.start()
+    try:
+        assert cache.find_by_id('customers', 1)['phone'] != '0700-111111'
+        write_elsewhere("UPDATE customers SET phone = '0700-111111' WHERE id = 1")
+        assert cache.find_by_id('customers', 1)['phone'] == '0700-111111'
+    finally:
+        cache.stop()
+
+def test_response_cache_clears_on_a_foreign_write_next_to_a_local_one():
+    cache = ResponseCache()
+    cache.start()
+    try:
+        _, generation = cache.get('/customers')
+        cache.put('/customers', b'[]', ('customers',), generation)
+        # A local write the cache hears about, plus another process's write to a table it didn't touch
+        CarRentalORM.update('vehicles', 1, {'daily_rate': 4100})
+        write_elsewhere("UPDATE customers SET phone = '0700-111111' WHERE id = 1")
+        entry, _ = cache.get('/customers')
+        assert entry is None
+    finally:
+        cache.stop()
+
+def test_response_cache_invalidates_the_coverage_index_on_foreign_writes():
+    from models.coverage import coverage_index
+    cache = ResponseCache(dependents=(coverage_index,))
+    cache.start()
+    try:
+        write_elsewhere("DELETE FROM insurance WHERE vehicle_id = 2")
+        coverage_index.invalidate()
+        assert not coverage_index.is_covered(2, '2030-01-01', '2030-01-02')
+        write_elsewhere("INSERT INTO insurance (vehicle_id, provider, policy_number, coverage_type, premium, start_date, end_date) "
+                        "VALUES (2, 'Britam', 'POL-FOREIGN', 'comprehensive', 1000, '2029-01-01', '2031-01-01')")
+        cache.poll()
+        assert coverage_index.is_covered(2, '2030-01-01', '2030-01-02')
+    finally:
+        cache.stop()
+
+def test_response_cache_invalidates_demand_pricing_on_foreign_writes():
+    from models.pricing import demand_pricing
+    cache = ResponseCache(dependents=(demand_pricing,))
+    cache.start()
+    try:
+        vehicle = CarRentalORM.find_by_id('vehicles', 2)
+        demand_pricing.quote(vehicle, '2030-01-01', '2030-01-02')
+        write_elsewhere("UPDATE vehicles SET available = 0 WHERE id != 2")
+        write_elsewhere("INSERT INTO rentals (customer_id, vehicle_id, start_date, end_date, total_amount, status) "
+                        "VALUES (4, 2, '2029-12-20', '2030-01-10', 1000, 'reserved')")
+        cache.poll()
+        _, [night] = demand_pricing.quote(vehicle, '2030-01-01', '2030-01-02')
+        assert night['tier'] == 'peak'
+    finally:
+        cache.stop()
@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+from datetime import date, timedelta
+
+import reports
+from database import db
+from models.orm import CarRentalORM
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+def test_vehicles_list_text(invoke):
+    result = invoke('vehicles', 'list')
+    assert result.exit_code == 0
+    assert '2023 Toyota Noah - KES 3500.0/day - Rented' in result.output
+
+def test_vehicles_list_json(invoke):
+    rows = json.loads(invoke('--format', 'json', 'vehicles', 'list').output)
+    assert [row['license_plate'] for row in rows][:2] == ['KCA123A', 'KDB456B']
+
+def test_customers_list_csv(invoke):
+    rows = list(csv.DictReader(io.StringIO(invoke('--format', 'csv', 'customers', 'list').output)))
+    assert len(rows) == 5
+    assert rows[0]['email'] == 'john.kamau@email.com'
+
+def test_rentals_create(invoke):
+    result = invoke('rentals', 'create', '--customer-id', 2, '--vehicle-id', 2,
+                    '--start-date', day(0), '--end-date', day(2))
+    assert 'Rental created! ID: 4' in result.output
+    assert CarRentalORM.find_by_id('vehicles', 2)['status'] == 'rented'
+
+def test_rentals_create_reports_errors(invoke):
+    result = invoke('rentals', 'create', '--customer-id', 2, '--vehicle-id', 99,
+                    '--start-date', day(0), '--end-date', day(2))
+    assert 'Vehicle not found!' in result.output
+
+def test_rentals_history_jsonl(invoke):
+    lines = invoke('--format', 'jsonl', 'rentals', 'history', 1).output.splitlines()
+    assert [json.loads(line)['event_type'] for line in lines] == ['reserved', 'picked_up']
+
+def test_rentals_snapshot_json(invoke):
+    rows = json.loads(invoke('--format', 'json', 'rentals', 'snapshot').output)
+    assert {(row['vehicle_id'], row['status']) for row in rows} == {(1, 'active'), (5, 'reserved')}
+
+def test_insurance_add_and_audit(invoke):
+    result = invoke('insurance', 'add', '--vehicle-id', 2, '--provider', 'Britam', '--policy-number', 'POL-TEST-1',
+                    '--coverage-type', 'liability', '--premium', 1000, '--start-date', day(0), '--end-date', day(400))
+    assert 'Insurance policy added!' in result.output
+    rows = json.loads(invoke('--format', 'json', 'insurance', 'audit').output)
+    assert all(row['issue'] != 'uncovered' for row in rows)
+
+def test_customers_status_and_tiering(invoke):
+    assert 'John Kamau: Standard (VIP)' in invoke('customers', 'status', 1).output
+    assert 'Evaluated 4 customers, 0 tier changes, 3 VIP flags updated' in invoke('customers', 'tiering').output
+    assert 'John Kamau: Standard -' in invoke('customers', 'status', 1).output
+
+def test_reports_revenue_json(invoke):
+    [report] = json.loads(invoke('--format', 'json', 'reports', 'revenue').output)
+    assert report['total_revenue'] == 17500.0 + 18000.0 + 9000.0
+
+def test_debug_selftest(invoke):
+    result = invoke('debug', 'selftest')
+    assert 'Write/read round trip: PASSED' in result.output
+
+def test_reports_run_all_fails_loudly(invoke, isolated_db, monkeypatch, tmp_path):
+    def broken():
+        raise RuntimeError("report query failed")
+    monkeypatch.setitem(reports.REPORT_TASKS, 'broken', broken)
+    output = tmp_path / 'reports.json'
+    copy = isolated_db.clone(temporary=True)
+    try:
+        with db.redirect(copy):
+            result = invoke('reports', 'run-all', '--workers', 2, '--report', 'broken',
+                            '--report', 'table_counts', '--output', output)
+    finally:
+        copy.close()
+    document = json.loads(output.read_text())
+    assert result.exit_code == 1
+    assert document['failed'] == ['broken']
+    assert 'result' not in document['reports']['broken']
+    assert document['reports']['broken']['error'] == "RuntimeError: report query failed"
+    assert document['reports']['table_counts']['result']['vehicles'] == 8
+
+def test_telemetry_ingest_skips_malformed_lines(invoke):
+    lines = ['{"vehicle_id": 1, "odometer_km": 1200, "recorded_at": 1700000000}', '{not json', '[1, 2]',
+             '{"odometer_km": 5}', '{"vehicle_id": 2, "fuel_pct": 55, "recorded_at": 1700000000}']
+    result = invoke('telemetry', 'ingest', '-', input='\n'.join(lines) + '\n')
+    assert ' 2 readings in ' in result.output
+    assert ' 3 malformed lines skipped (first at line 2: ' in result.output
+    assert db.fetch_one("SELECT COUNT(*) AS total FROM vehicle_telemetry")['total'] == 2
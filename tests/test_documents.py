@@ -0,0 +1,33 @@
+import io
+import os
+
+import pytest
+
+import documents
+from documents import DocumentStore
+
+@pytest.fixture(params=[True, False], ids=['blobopen', 'sql-chunks'])
+def blob_io(request, monkeypatch):
+    """Run each test with incremental blob I/O and with the SQL fallback for Python < 3.11"""
+    if request.param and not documents.INCREMENTAL_IO:
+        pytest.skip("Connection.blobopen needs Python 3.11")
+    monkeypatch.setattr(documents, 'INCREMENTAL_IO', request.param)
+    monkeypatch.setattr(documents, 'CHUNK_SIZE', 1000)
+
+def test_store_and_read_back_in_chunks(blob_io):
+    content = os.urandom(4500) + b'\x00\xff'
+    document_id, reused = DocumentStore.store('customer', 1, 'license_scan', io.BytesIO(content), 'scan.png')
+    assert not reused
+    assert b''.join(DocumentStore.iter_content(document_id, chunk_size=700)) == content
+    assert DocumentStore.find_by_id(document_id)['size'] == len(content)
+
+def test_identical_content_is_stored_once(blob_io):
+    content = os.urandom(2500)
+    DocumentStore.store('customer', 1, 'license_scan', io.BytesIO(content), 'scan.png')
+    _, reused = DocumentStore.store('vehicle', 2, 'damage_photo', io.BytesIO(content), 'photo.png')
+    assert reused
+    assert DocumentStore.storage_stats()['stored_bytes'] == len(content)
+
+def test_empty_file(blob_io):
+    document_id, _ = DocumentStore.store('rental', 1, 'other', io.BytesIO(b''), 'empty.txt')
+    assert b''.join(DocumentStore.iter_content(document_id)) == b''
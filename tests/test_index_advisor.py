@@ -0,0 +1,27 @@
+from database import db
+from index_advisor import IndexAdvisor, advise
+
+def propose(statement):
+    conn = db.get_connection()
+    try:
+        return IndexAdvisor(conn).propose(statement)
+    finally:
+        conn.close()
+
+def test_proposals_cover_the_columns_read():
+    assert propose("SELECT id, status, total_amount FROM rentals WHERE customer_id = ? ORDER BY start_date") == [
+        ('rentals', ('customer_id', 'status', 'total_amount', 'start_date'))]
+
+def test_existing_filter_index_is_widened_to_cover():
+    # idx_rentals_vehicle_status serves the filter but not start_day
+    assert propose("SELECT vehicle_id, start_day FROM rentals WHERE vehicle_id = ? AND status = 'active'") == [
+        ('rentals', ('vehicle_id', 'status', 'start_day'))]
+
+def test_select_all_only_indexes_the_filter():
+    assert propose("SELECT m.*, v.make FROM maintenance_records m JOIN vehicles v ON m.vehicle_id = v.id "
+                   "WHERE m.cost > ?") == [('maintenance_records', ('cost',))]
+
+def test_advise_leaves_the_shared_db_alone(isolated_db):
+    results, _ = advise(rentals=200, repeat=1)
+    assert db.db_name == isolated_db.db_name
+    assert any(result['statement'].startswith('SELECT') for result in results)
@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import db, epoch_day
+from models import coverage
+from models.allocation import ReservationAllocator
+from models.dedupe import CustomerDeduplicator
+from models.events import RentalEventLog, RentalProjector
+from models.forecast import MaintenanceForecaster
+from models.loyalty import LoyaltyTiers
+from models.orm import CarRentalORM
+from models.pricing import DemandPricing
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+def vehicle_status(vehicle_id):
+    return CarRentalORM.find_by_id('vehicles', vehicle_id)['status']
+
+def test_sample_data_is_seeded():
+    assert len(CarRentalORM.get_all('vehicles')) == 8
+    assert len(CarRentalORM.get_all('customers')) == 5
+    assert len(CarRentalORM.get_all('insurance')) == 8
+
+def test_each_test_gets_a_fresh_copy():
+    CarRentalORM.create('locations', {'name': 'Eldoret Branch', 'address': 'Uganda Road', 'city': 'Eldoret',
+                                      'state': 'Uasin Gishu', 'zip_code': '30100'})
+    assert len(CarRentalORM.get_all('locations')) == 6
+
+def test_each_test_gets_a_fresh_copy_again():
+    assert len(CarRentalORM.get_all('locations')) == 5
+
+def test_book_rental_prices_by_demand_and_rents_the_vehicle():
+    _, quoted, nights = CarRentalORM.quote_rental(2, day(0), day(3))
+    rental_id, total = CarRentalORM.book_rental(2, 2, day(0), day(3))
+    assert len(nights) == 3
+    assert total == pytest.approx(quoted)
+    rental = CarRentalORM.find_by_id('rentals', rental_id)
+    assert rental['status'] == 'active'
+    assert vehicle_status(2) == 'rented'
+
+def test_book_rental_rejects_an_empty_date_range():
+    with pytest.raises(ValueError, match="Invalid date range"):
+        CarRentalORM.book_rental(2, 2, day(3), day(3))
+
+def test_book_rental_refuses_a_double_booking():
+    CarRentalORM.book_rental(2, 2, day(0), day(3))
+    with pytest.raises(ValueError, match="already booked"):
+        CarRentalORM.book_rental(3, 2, day(0), day(3))
+    with pytest.raises(ValueError, match="already booked"):
+        CarRentalORM.book_rental(3, 2, day(2), day(5))
+    CarRentalORM.book_rental(3, 2, day(3), day(5))
+    assert len(CarRentalORM.find_rentals_by_customer(3)) == 2
+
+def test_return_rental_completes_and_releases_the_vehicle():
+    rental_id, _ = CarRentalORM.book_rental(2, 2, day(0), day(3))
+    CarRentalORM.return_rental(rental_id, day(3))
+    rental = CarRentalORM.find_by_id('rentals', rental_id)
+    assert (rental['status'], rental['actual_return_date']) == ('completed', day(3))
+    assert vehicle_status(2) == 'available'
+
+def test_return_rental_refuses_a_completed_rental():
+    with pytest.raises(ValueError, match="already completed"):
+        CarRentalORM.return_rental(2)
+
+def test_return_rental_refuses_a_cancelled_rental():
+    CarRentalORM.update('rentals', 3, {'status': 'cancelled'})
+    with pytest.raises(ValueError, match="already cancelled"):
+        CarRentalORM.return_rental(3)
+
+def test_uninsured_booking_is_allowed_unless_cover_is_required(monkeypatch):
+    with db.transaction() as conn:
+        db.execute(conn, "DELETE FROM insurance WHERE vehicle_id = 2")
+    CarRentalORM.notify('insurance')
+    CarRentalORM.book_rental(2, 2, day(0), day(2))
+    monkeypatch.setattr(coverage, 'REQUIRE_COVER', True)
+    with pytest.raises(ValueError, match="not insured"):
+        CarRentalORM.book_rental(2, 2, day(5), day(7))
+
+def test_rate_cache_keeps_the_most_recently_used_entries():
+    pricing = DemandPricing(max_entries=3)
+    for day in range(5):
+        pricing.rate(1, 'sedan', 30000 + day)
+    pricing.rate(1, 'sedan', 30002)
+    pricing.rate(1, 'sedan', 30010)
+    assert [key[2] for key in pricing.rates] == [30004, 30002, 30010]
+
+def test_demand_counters_for_past_days_are_dropped(monkeypatch):
+    pricing = DemandPricing()
+    rental_id, _ = CarRentalORM.book_rental(4, 2, day(0), day(3))
+    pricing.rate(1, 'sedan', 0)
+    assert rental_id in pricing.open_rentals
+    today = pricing.pruned_day
+    # Five days later
+    monkeypatch.setattr('models.pricing.epoch_day', lambda *args: epoch_day(*args) if args else today + 5)
+    pricing.rate(1, 'sedan', today + 5)
+    assert rental_id not in pricing.open_rentals
+    assert all(key[2] >= today + 5 for key in pricing.booked)
+
+def test_event_history_is_in_order_for_back_dated_rentals():
+    rental_id, _ = CarRentalORM.book_rental(4, 4, day(-10), day(-8))
+    events = RentalEventLog.find_by_rental(rental_id)
+    assert [e['event_type'] for e in events] == ['reserved', 'picked_up']
+    assert events[0]['event_date'] <= events[1]['event_date']
+
+def test_snapshot_replays_the_event_log():
+    snapshot = RentalProjector.snapshot()
+    assert snapshot['vehicles_out'] == {1: 1, 5: 3}
+
+def test_customer_stats_follow_rental_writes():
+    before = LoyaltyTiers.status(4)
+    rental_id, total = CarRentalORM.book_rental(4, 2, day(0), day(2))
+    CarRentalORM.return_rental(rental_id, day(4))
+    after = LoyaltyTiers.status(4)
+    assert after['rentals'] == before['rentals'] + 1
+    assert after['total_spend'] == pytest.approx(before['total_spend'] + total)
+    assert after['late_returns'] == before['late_returns'] + 1
+    CarRentalORM.update('rentals', rental_id, {'status': 'cancelled'})
+    assert LoyaltyTiers.status(4)['rentals'] == before['rentals']
+
+def test_tiering_syncs_the_vip_flag():
+    result = LoyaltyTiers.run()
+    assert result['vip_updated'] == 3
+    assert all(not LoyaltyTiers.status(customer_id)['is_vip'] for customer_id in (1, 3, 5))
+    assert LoyaltyTiers.run()['evaluated'] == 0
+
+def test_tiering_promotes_a_frequent_customer():
+    for index in range(5):
+        start = index * 4
+        rental_id, _ = CarRentalORM.book_rental(2, 4, day(start), day(start + 3))
+        CarRentalORM.return_rental(rental_id, day(start + 3))
+    result = LoyaltyTiers.run(date.today() + timedelta(days=30))
+    assert {'customer_id': 2, 'from': 'standard', 'to': 'silver'} in result['changed']
+    assert LoyaltyTiers.status(2)['is_vip'] == 1
+
+def test_allocator_prices_reservations_like_bookings(tmp_path):
+    requests = tmp_path / 'requests.csv'
+    requests.write_text(f"customer_id,location_id,vehicle_type,start_date,end_date\n4,2,SUV,{day(30)},{day(33)}\n")
+    assignments, unassigned = ReservationAllocator().allocate(ReservationAllocator.load_requests(requests))
+    assert len(assignments) == 1 and not unassigned
+    vehicle_id = assignments[0]['vehicle']['id']
+    _, quoted, _ = CarRentalORM.quote_rental(vehicle_id, day(30), day(33))
+    [rental_id] = ReservationAllocator.commit(assignments)
+    rental = CarRentalORM.find_by_id('rentals', rental_id)
+    assert rental['status'] == 'reserved'
+    assert rental['total_amount'] == pytest.approx(quoted)
+
+def test_allocator_respects_a_service_already_under_way():
+    for vehicle in CarRentalORM.find_vehicles_by_type('SUV'):
+        CarRentalORM.create('maintenance_records', {'vehicle_id': vehicle['id'], 'maintenance_type': 'routine',
+                                                    'maintenance_date': day(-1), 'status': 'scheduled'})
+    request = {'customer_id': 4, 'location_id': 2, 'vehicle_type': 'SUV', 'start_date': day(0), 'end_date': day(1)}
+    assignments, unassigned = ReservationAllocator().allocate([request])
+    assert not assignments and unassigned == [request]
+
+def test_forecast_fills_next_service_date_around_bookings():
+    # Idle since a service 170 days ago, so due on the 180-day calendar limit in 10 days
+    record_id = CarRentalORM.create('maintenance_records', {'vehicle_id': 4, 'maintenance_type': 'routine',
+                                                            'maintenance_date': day(-170), 'status': 'completed'})
+    CarRentalORM.book_rental(3, 4, day(9), day(12), status='reserved')
+    MaintenanceForecaster.run()
+    [forecast] = [f for f in MaintenanceForecaster.run() if f['vehicle_id'] == 4]
+    records = CarRentalORM.get_all('maintenance_records')
+    assert forecast['due_date'] == day(7)
+    assert [(r['id'], r['next_maintenance_date'], r['forecast']) for r in records] == [(record_id, day(7), 1)]
+    with pytest.raises(ValueError, match="scheduled for maintenance"):
+        CarRentalORM.book_rental(2, 4, day(8), day(9))
+    # A newer service supersedes the prediction
+    CarRentalORM.create('maintenance_records', {'vehicle_id': 4, 'maintenance_type': 'routine',
+                                                'maintenance_date': day(0), 'status': 'completed'})
+    assert not CarRentalORM.has_maintenance_window(4, day(8), day(9))
+
+def test_allocator_reports_bad_dates_by_line(tmp_path):
+    requests = tmp_path / 'requests.csv'
+    requests.write_text("customer_id,location_id,vehicle_type,start_date,end_date\n4,2,SUV,2026-13-01,2026-13-04\n")
+    with pytest.raises(ValueError, match="Line 2"):
+        ReservationAllocator.load_requests(requests)
+
+def test_merge_moves_rentals_and_stats():
+    duplicate = CarRentalORM.create('customers', {
+        'first_name': 'Grace', 'last_name': 'Akinyi', 'email': 'g.akinyi@email.com',
+        'phone': '0745-678901', 'license_number': 'D4455668'})
+    CarRentalORM.book_rental(duplicate, 2, day(0), day(2))
+    proposals = CustomerDeduplicator().find_duplicates()
+    assert any(set(p['merge_ids']) | {p['keep_id']} == {4, duplicate} for p in proposals)
+    assert CustomerDeduplicator.merge(4, [duplicate]) == 1
+    assert CarRentalORM.find_by_id('customers', duplicate) is None
+    assert LoyaltyTiers.status(4)['rentals'] == 1
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import db, Database
+from fixtures import reset_caches
+from models.events import RentalEventLog
+from models.orm import CarRentalORM
+from sync import CentralSync, LocalTransport, TerminalSync
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+def events(database):
+    with db.redirect(database):
+        return [tuple(row) for row in db.fetch_all("SELECT * FROM rental_events ORDER BY id")]
+
+@pytest.fixture
+def branch(tmp_path, isolated_db):
+    """A central database file and one registered terminal replica"""
+    central = isolated_db.clone(temporary=True)
+    replica = tmp_path / 'branch.db'
+    CentralSync(central).register('nakuru', str(replica))
+    terminal = Database(str(replica))
+    yield central, terminal
+    central.close()
+
+def test_offline_booking_gets_the_central_event_history(branch):
+    central, terminal = branch
+    with db.redirect(terminal):
+        reset_caches()
+        CarRentalORM.book_rental(4, 2, day(0), day(2))
+        stats = TerminalSync(LocalTransport(central.db_name), terminal).sync()
+        [rental] = CarRentalORM.find_rentals_by_customer(4)
+        history = RentalEventLog.find_by_rental(rental['id'])
+    reset_caches()
+    assert stats['rejected'] == []
+    assert [event['event_type'] for event in history] == ['reserved', 'picked_up']
+    assert events(terminal) == events(central)
+
+def test_second_terminal_sees_the_same_history(branch, tmp_path):
+    central, first = branch
+    CentralSync(central).register('eldoret', str(tmp_path / 'second.db'))
+    second = Database(str(tmp_path / 'second.db'))
+    with db.redirect(first):
+        reset_caches()
+        CarRentalORM.book_rental(4, 2, day(0), day(2))
+        TerminalSync(LocalTransport(central.db_name), first).sync()
+    with db.redirect(second):
+        reset_caches()
+        TerminalSync(LocalTransport(central.db_name), second).sync()
+    reset_caches()
+    assert events(second) == events(central) == events(first)
+
+def test_sync_keeps_the_event_log_append_only(branch):
+    central, terminal = branch
+    with db.redirect(terminal):
+        reset_caches()
+        CarRentalORM.book_rental(4, 2, day(0), day(2))
+        TerminalSync(LocalTransport(central.db_name), terminal).sync()
+        with pytest.raises(db.backend.Error, match="append-only"):
+            with db.transaction() as conn:
+                db.execute(conn, "UPDATE rental_events SET rental_id = 0")
+    reset_caches()